@@ -0,0 +1,142 @@
+"""
+Benchmark cache save/load time and size for each available codec and compression, on a large
+synthetic state.
+
+Run from the repository root:
+
+    python benchmarks/bench_cache.py --subs 200 --entries 2000
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import puckfetcher.cache as cache
+import puckfetcher.codec as codec
+
+
+def main() -> None:
+    """Run the benchmark and print results."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subs", type=int, default=200, help="Number of subscriptions.")
+    parser.add_argument("--entries", type=int, default=2000, help="Entries per subscription.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, best is kept.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    (records, shards) = synthetic_state(args.subs, args.entries)
+
+    results = []
+    for codec_name in codec.CODECS:
+        for compression in [None, *codec.COMPRESSORS]:
+            results.append(run_case(records, shards, codec_name, compression, args.repeat))
+
+    if args.json:
+        print(json.dumps({"subs": args.subs, "entries": args.entries, "results": results},
+                         indent=2))
+        return
+
+    print(f"{args.subs} subscriptions, {args.entries} entries each.")
+    print(f"{'codec':<10} {'compression':<12} {'save (s)':>10} {'load (s)':>10} {'size (MB)':>10}")
+    for result in results:
+        print(f"{result['codec']:<10} {str(result['compression']):<12} "
+              f"{result['save_seconds']:>10.3f} {result['load_seconds']:>10.3f} "
+              f"{result['size_bytes'] / 1e6:>10.2f}")
+
+
+def run_case(records: List[Dict[str, Any]], shards: Dict[str, Any], codec_name: str,
+             compression: Any, repeat: int) -> Dict[str, Any]:
+    """Time saving and fully loading a state with one codec and compression."""
+    best_save = best_load = float("inf")
+    size = 0
+
+    for _ in range(repeat):
+        cache_dir = tempfile.mkdtemp(prefix="puckbench")
+        try:
+            backend = cache.ShardedCache(cache_dir, compression=compression,
+                                         codec_name=codec_name)
+
+            start = time.perf_counter()
+            backend.save(records, shards)
+            best_save = min(best_save, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for record in backend.load_index():
+                backend.load_shard(record["shard"])
+            best_load = min(best_load, time.perf_counter() - start)
+
+            size = _dir_size(backend.directory)
+
+        finally:
+            shutil.rmtree(cache_dir)
+
+    return {
+        "codec": codec_name,
+        "compression": compression,
+        "save_seconds": best_save,
+        "load_seconds": best_load,
+        "size_bytes": size,
+    }
+
+
+def synthetic_state(num_subs: int, num_entries: int,
+                    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Build index records and feed states shaped like real ones."""
+    records = []
+    shards = {}
+    for i in range(num_subs):
+        key = f"{i:032x}"
+        name = f"Podcast {i}"
+        records.append({
+            "__type__": "subscription",
+            "__version__": "bench",
+            "url": f"https://example.com/{i}/rss.xml",
+            "original_url": f"https://example.com/{i}/rss.xml",
+            "directory": f"/data/podcasts/{name}",
+            "settings": {"use_title_as_filename": False, "backlog_limit": 1,
+                         "set_tags": True, "overwrite_title": False},
+            "metadata": {"name": name, "artist": "Someone", "album": name,
+                         "album_artist": "Someone"},
+            "name": name,
+            "latest_entry_number": num_entries,
+            "queue_length": 0,
+            "shard": key,
+        })
+
+        entries = [{
+            "title": f"Episode {n} - A Fairly Typical Episode Title",
+            "id": f"https://example.com/{i}/episodes/{n}",
+            "urls": [f"https://cdn.example.com/podcasts/{i}/episode-{n}.mp3?source=rss"],
+            "metadata": {"artist": "Someone", "album": name, "album_artist": "Someone",
+                         "genre": "Podcast", "date": "2020-01-01"},
+        } for n in range(num_entries, 0, -1)]
+
+        shards[key] = {
+            "entries": entries,
+            "entries_state_dict": {n: True for n in range(num_entries)},
+            "queue": [],
+            "latest_entry_number": num_entries,
+            "summary_queue": [{"number": n, "name": f"Episode {n}", "is_this_session": False}
+                              for n in range(num_entries - 15, num_entries)],
+            "last_modified": None,
+            "etag": "W/\"abcdef\"",
+        }
+
+    return (records, shards)
+
+
+def _dir_size(directory: str) -> int:
+    total = 0
+    for (root, _, files) in os.walk(directory):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+
+    return total
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Measure command startup cost with `python -X importtime`, and fail if a command goes over its
+time budget or imports a module it shouldn't need.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --budget list=0.3 --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Set, Tuple
+
+# Command -> default wall time budget in seconds, for the whole process.
+BUDGETS = {
+    "--version": 0.4,
+    "exit": 0.5,
+    "list": 0.6,
+}
+
+# Modules only needed for fetching, downloading or tagging, which read-only commands shouldn't
+# pay for.
+HEAVY_MODULES = ["feedparser", "eyed3", "magic", "clint"]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def main() -> None:
+    """Run startup benchmark for each command and check budgets."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", action="append", default=[],
+                        help="Override a budget, as COMMAND=SECONDS.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per command, best is kept.")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to show.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for override in args.budget:
+        (command, seconds) = override.split("=")
+        budgets[command] = float(seconds)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="puckstartup") as root:
+        for (command, budget) in budgets.items():
+            results.append(run_command(command, budget, root, args.repeat))
+
+    failed = [r for r in results if r["over_budget"] or r["heavy_imports"]]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            status = "FAIL" if result in failed else "ok"
+            print(f"[{status}] {result['command']:<10} "
+                  f"{result['wall_seconds']:.3f}s (budget {result['budget_seconds']:.3f}s), "
+                  f"imports {result['import_seconds']:.3f}s")
+            if result["heavy_imports"]:
+                print(f"    imported heavy modules: {', '.join(result['heavy_imports'])}")
+            for (module, seconds) in result["slowest_imports"][0:args.top]:
+                print(f"    {seconds:.4f}s {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+def run_command(command: str, budget: float, root: str, repeat: int) -> Dict[str, Any]:
+    """Run one command repeatedly with -X importtime, keeping the fastest run."""
+    dirs = []
+    for name in ["config", "cache", "data"]:
+        path = os.path.join(root, name)
+        os.makedirs(path, exist_ok=True)
+        dirs += [f"--{name}", path]
+
+    best_wall = float("inf")
+    best_stderr = ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "puckfetcher", command, *dirs],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        wall = time.perf_counter() - start
+        if wall < best_wall:
+            (best_wall, best_stderr) = (wall, proc.stderr)
+
+    (total, top_level, imported) = parse_importtime(best_stderr)
+
+    return {
+        "command": command,
+        "wall_seconds": best_wall,
+        "budget_seconds": budget,
+        "over_budget": best_wall > budget,
+        "import_seconds": total,
+        "heavy_imports": [module for module in HEAVY_MODULES if module in imported],
+        "slowest_imports": sorted(top_level, key=lambda item: item[1], reverse=True),
+    }
+
+
+def parse_importtime(stderr: str) -> Tuple[float, List[Tuple[str, float]], Set[str]]:
+    """
+    Parse -X importtime output.
+
+    :returns: Total import time in seconds, cumulative time of each top-level import, and the
+        root package of every imported module.
+    """
+    total = 0.0
+    top_level = []
+    imported = set()
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+
+        (self_us, cumulative_us, indent, module) = match.groups()
+        total += int(self_us) / 1e6
+        imported.add(module.split(".")[0])
+        if len(indent) <= 1:
+            top_level.append((module, int(cumulative_us) / 1e6))
+
+    return (total, top_level, imported)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Benchmark a full update against a local HTTP server serving synthetic podcast feeds.
+
+Each scenario runs `Config.update` in a fresh subprocess (so peak RSS is per scenario) against
+a server in this process, and can inject latency and errors. A second pass is run by default,
+where unchanged feeds should come back as 304 Not Modified.
+
+Run from the repository root:
+
+    python benchmarks/bench_update.py --subs 10 100 1000 --json > results.json
+    python benchmarks/bench_update.py --subs 50 --entries 200 --backlog 5 --latency-ms 20 \\
+        --error-rate 0.05
+"""
+import argparse
+import http.server
+import json
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from typing import Any, Dict, List, Optional
+from xml.sax.saxutils import escape
+
+import yaml
+
+
+class FeedServer(object):
+    """Local HTTP server for synthetic feeds and enclosures, counting what it serves."""
+
+    def __init__(self, *, entries: int, enclosure_bytes: int, latency: float, error_rate: float,
+                 etags: bool, seed: int=0) -> None:
+        self.entries = entries
+        self.enclosure_bytes = enclosure_bytes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.etags = etags
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self.reset_stats()
+
+        # Enclosures are the same bytes every time, so they're generated once.
+        self.enclosure = os.urandom(enclosure_bytes)
+
+        server = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                server.handle(self)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self.httpd = _Server(("127.0.0.1", 0), _Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        """Start serving in a background thread."""
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self) -> None:
+        """Zero request counters."""
+        with self.lock:
+            self.stats = {"requests": 0, "feeds": 0, "not_modified": 0, "enclosures": 0,
+                          "errors": 0, "bytes": 0}
+
+    def feed_url(self, sub: int) -> str:
+        """Provide URL of a subscription's feed."""
+        return f"http://127.0.0.1:{self.port}/feed/{sub}.xml"
+
+    def handle(self, request: http.server.BaseHTTPRequestHandler) -> None:
+        """Serve one request."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.stats["requests"] += 1
+            inject_error = self.random.random() < self.error_rate
+
+        if inject_error:
+            self._send(request, 500, b"injected error", "text/plain")
+            with self.lock:
+                self.stats["errors"] += 1
+            return
+
+        parts = request.path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "feed":
+            sub = int(parts[1].split(".")[0])
+            etag = f'"feed-{sub}-{self.entries}"'
+            if self.etags and request.headers.get("If-None-Match") == etag:
+                self._send(request, 304, b"", "application/rss+xml", {"ETag": etag})
+                with self.lock:
+                    self.stats["not_modified"] += 1
+                return
+
+            headers = {"ETag": etag} if self.etags else {}
+            self._send(request, 200, self._feed(sub), "application/rss+xml", headers)
+            with self.lock:
+                self.stats["feeds"] += 1
+
+        elif len(parts) == 3 and parts[0] == "enclosure":
+            self._send(request, 200, self.enclosure, "audio/mpeg")
+            with self.lock:
+                self.stats["enclosures"] += 1
+
+        else:
+            self._send(request, 404, b"not found", "text/plain")
+
+    def _feed(self, sub: int) -> bytes:
+        items = []
+        for n in range(self.entries, 0, -1):
+            url = f"http://127.0.0.1:{self.port}/enclosure/{sub}/episode-{n}.mp3"
+            items.append(
+                f"<item><title>{escape(f'Podcast {sub} episode {n}')}</title>"
+                f"<guid>urn:bench:{sub}:{n}</guid>"
+                f"<pubDate>{formatdate(1500000000 + n * 86400)}</pubDate>"
+                f"<enclosure url=\"{url}\" length=\"{self.enclosure_bytes}\" type=\"audio/mpeg\"/>"
+                f"</item>")
+
+        return (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><rss version=\"2.0\"><channel>"
+                f"<title>Podcast {sub}</title>{''.join(items)}</channel></rss>").encode("UTF-8")
+
+    def _send(self, request: http.server.BaseHTTPRequestHandler, status: int, body: bytes,
+              content_type: str, headers: Optional[Dict[str, str]]=None) -> None:
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        for (name, value) in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+        with self.lock:
+            self.stats["bytes"] += len(body)
+
+
+def main() -> None:
+    """Run each scenario and print results."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subs", type=int, nargs="+", default=[10, 100],
+                        help="Subscription counts, one scenario each.")
+    parser.add_argument("--entries", type=int, default=50, help="Entries per feed.")
+    parser.add_argument("--backlog", type=int, default=1,
+                        help="Entries each subscription downloads on its first update.")
+    parser.add_argument("--enclosure-kb", type=int, default=256, help="Size of each enclosure.")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay on every response.")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="Fraction of responses that are 500 errors.")
+    parser.add_argument("--no-etags", action="store_true",
+                        help="Don't send ETags, so nothing is ever 304 Not Modified.")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="Updates per scenario. Passes after the first are mostly 304s.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    parser.add_argument("--worker", nargs=3, metavar=("CONFIG", "CACHE", "DATA"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(*args.worker)
+        return
+
+    server = FeedServer(entries=args.entries, enclosure_bytes=args.enclosure_kb * 1024,
+                        latency=args.latency_ms / 1000, error_rate=args.error_rate,
+                        etags=not args.no_etags)
+    server.start()
+
+    results = []
+    try:
+        for num_subs in args.subs:
+            results.extend(run_scenario(server, num_subs, args.backlog, args.passes))
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps({"settings": {k: v for (k, v) in vars(args).items() if k != "worker"},
+                          "results": results}, indent=2))
+        return
+
+    print(f"{'subs':>6} {'pass':>5} {'wall (s)':>9} {'req/s':>8} {'MB/s':>8} {'304s':>6} "
+          f"{'errors':>7} {'peak RSS (MB)':>14}")
+    for result in results:
+        print(f"{result['subs']:>6} {result['pass']:>5} {result['wall_seconds']:>9.2f} "
+              f"{result['requests_per_second']:>8.1f} {result['megabytes_per_second']:>8.2f} "
+              f"{result['not_modified']:>6} {result['errors']:>7} "
+              f"{result['peak_rss_bytes'] / 1e6:>14.1f}")
+
+
+def run_scenario(server: FeedServer, num_subs: int, backlog: int,
+                 passes: int) -> List[Dict[str, Any]]:
+    """Update a fresh config of num_subs subscriptions against the server, passes times."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="puckbench") as root:
+        dirs = [os.path.join(root, name) for name in ["config", "cache", "data"]]
+        for directory in dirs:
+            os.makedirs(directory)
+
+        config = {
+            "backlog_limit": backlog,
+            "subscriptions": [{"name": f"Podcast {i}", "url": server.feed_url(i)}
+                              for i in range(num_subs)],
+        }
+        with open(os.path.join(dirs[0], "config.yaml"), "w", encoding="UTF-8") as stream:
+            yaml.dump(config, stream)
+
+        for run in range(passes):
+            server.reset_stats()
+            proc = subprocess.run([sys.executable, __file__, "--worker", *dirs],
+                                  stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            worker = json.loads(proc.stdout.splitlines()[-1])
+            stats = dict(server.stats)
+
+            wall = worker["wall_seconds"]
+            results.append({
+                "subs": num_subs,
+                "pass": run + 1,
+                "wall_seconds": wall,
+                "requests": stats["requests"],
+                "requests_per_second": stats["requests"] / wall if wall else 0,
+                "megabytes_per_second": stats["bytes"] / 1e6 / wall if wall else 0,
+                "bytes": stats["bytes"],
+                "feeds": stats["feeds"],
+                "not_modified": stats["not_modified"],
+                "enclosures": stats["enclosures"],
+                "errors": stats["errors"],
+                "peak_rss_bytes": worker["peak_rss_bytes"],
+            })
+
+    return results
+
+
+def _worker(config_dir: str, cache_dir: str, data_dir: str) -> None:
+    """Load a config and update it once, then report timing on stdout."""
+    import logging
+    import resource
+
+    import puckfetcher.config
+
+    logging.getLogger("root").setLevel(logging.ERROR)
+
+    start = time.perf_counter()
+    conf = puckfetcher.config.Config(config_dir=config_dir, cache_dir=cache_dir,
+                                     data_dir=data_dir)
+    conf.load_state()
+    conf.update()
+    wall = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024
+
+    print(json.dumps({"wall_seconds": wall, "peak_rss_bytes": peak}))
+
+
+if __name__ == "__main__":
+    main()
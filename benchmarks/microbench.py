@@ -0,0 +1,259 @@
+"""
+Microbenchmarks for feed state, subscription and cache hot paths, with stored baselines.
+
+Run from the repository root:
+
+    python benchmarks/microbench.py run
+    python benchmarks/microbench.py save laptop
+    python benchmarks/microbench.py compare laptop --threshold 0.15
+
+Baselines are JSON files in benchmarks/baselines/. compare exits non-zero if any benchmark got
+slower than its baseline by more than the threshold (a fraction, so 0.15 is 15%).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+import puckfetcher.config as config
+import puckfetcher.subscription as subscription
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+BASELINE_DIR = os.path.join(HERE, "baselines")
+SAMPLE_MP3 = os.path.join(HERE, os.pardir, "puckfetcher", "test", "test.mp3")
+
+# Size of the synthetic state benchmarks run on.
+NUM_ENTRIES = 5000
+NUM_SUBS = 100
+SUB_ENTRIES = 1000
+
+Setup = Callable[[str], Callable[[], Any]]
+CASES: Dict[str, Setup] = {}
+
+
+def case(name: str) -> Callable[[Setup], Setup]:
+    """Register a benchmark. The function gets a scratch directory and returns what to time."""
+    def _register(setup: Setup) -> Setup:
+        CASES[name] = setup
+        return setup
+
+    return _register
+
+
+@case("feed_state.load_rss_info")
+def _load_rss_info(_: str) -> Callable[[], Any]:
+    parsed = _parsed_feed(NUM_ENTRIES)
+    feed_state = subscription._FeedState()
+    return lambda: feed_state.load_rss_info(parsed)
+
+
+@case("subscription.encode")
+def _encode(scratch: str) -> Callable[[], Any]:
+    sub = _sub(scratch, "encode", NUM_ENTRIES)
+    return lambda: subscription.Subscription.encode_subscription(sub)
+
+
+@case("subscription.decode")
+def _decode(scratch: str) -> Callable[[], Any]:
+    encoded = subscription.Subscription.encode_subscription(_sub(scratch, "decode", NUM_ENTRIES))
+    # Touch the feed state, since decoding it is otherwise deferred.
+    return lambda: subscription.Subscription.decode_subscription(encoded).feed_state
+
+
+@case("subscription.get_details")
+def _get_details(scratch: str) -> Callable[[], Any]:
+    sub = _sub(scratch, "details", NUM_ENTRIES)
+    for n in range(0, NUM_ENTRIES, 3):
+        sub.feed_state.entries_state_dict[n] = True
+    return lambda: sub.get_details(0, 1)
+
+
+@case("subscription.enqueue")
+def _enqueue(scratch: str) -> Callable[[], Any]:
+    sub = _sub(scratch, "enqueue", NUM_ENTRIES)
+    nums = list(range(1, NUM_ENTRIES + 1))
+
+    def _run() -> None:
+        sub.feed_state.queue.clear()
+        sub.enqueue(nums)
+
+    return _run
+
+
+@case("subscription.process_tags")
+def _process_tags(scratch: str) -> Callable[[], Any]:
+    import eyed3
+
+    dest = os.path.join(scratch, "tags.mp3")
+    shutil.copyfile(SAMPLE_MP3, dest)
+    audiofile = eyed3.load(dest)
+    audiofile.tag = audiofile.initTag()
+    audiofile.tag.save()
+
+    sub = _sub(scratch, "tags", 1)
+    sub.settings["set_tags"] = True
+    sub.metadata["artist"] = "Someone"
+    entry = {"title": "Episode", "metadata": {}}
+    return lambda: sub.process_tags(dest, entry)
+
+
+@case("config.save_cache")
+def _save_cache(scratch: str) -> Callable[[], Any]:
+    conf = _config(scratch)
+    return conf.save_cache
+
+
+@case("config.load_cache_settings")
+def _load_cache_settings(scratch: str) -> Callable[[], Any]:
+    conf = _config(scratch)
+    conf.save_cache()
+    return conf._load_cache_settings
+
+
+def main() -> None:
+    """Run, save or compare benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("action", choices=["run", "save", "compare"])
+    parser.add_argument("baseline", nargs="?", default=platform.node() or "default",
+                        help="Baseline name for save and compare. Defaults to the host name.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks containing this.")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per benchmark, best kept.")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per round, roughly.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown over baseline that counts as a regression.")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON.")
+    args = parser.parse_args()
+
+    # Log records are still created and formatted at INFO, as they would be for real.
+    log = logging.getLogger("root")
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="puckmicro") as scratch:
+        for (name, setup) in CASES.items():
+            if args.filter in name:
+                case_dir = os.path.join(scratch, name)
+                os.makedirs(case_dir)
+                results[name] = measure(setup(case_dir), args.repeat, args.min_time)
+
+    baseline_file = os.path.join(BASELINE_DIR, f"{args.baseline}.json")
+    if args.action == "save":
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(baseline_file, "w", encoding="UTF-8") as stream:
+            json.dump({"python": platform.python_version(), "results": results}, stream,
+                      indent=2, sort_keys=True)
+        print(f"Saved baseline '{baseline_file}'.")
+
+    baseline: Optional[Dict[str, float]] = None
+    if args.action == "compare":
+        with open(baseline_file, encoding="UTF-8") as stream:
+            baseline = json.load(stream)["results"]
+
+    regressions = report(results, baseline, args.threshold, args.json)
+    sys.exit(1 if regressions else 0)
+
+
+def measure(func: Callable[[], Any], repeat: int, min_time: float) -> float:
+    """Time a function, returning the best seconds per call over several rounds."""
+    # Find a call count that makes a round take about min_time.
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1e6:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+
+    return best
+
+
+def report(results: Dict[str, float], baseline: Optional[Dict[str, float]], threshold: float,
+           as_json: bool) -> List[str]:
+    """Print results, compared to the baseline if there is one, and return regressed names."""
+    rows = []
+    regressions = []
+    for (name, seconds) in results.items():
+        row: Dict[str, Any] = {"name": name, "seconds": seconds}
+        if baseline is not None and name in baseline:
+            row["baseline_seconds"] = baseline[name]
+            row["change"] = seconds / baseline[name] - 1
+            row["regressed"] = row["change"] > threshold
+            if row["regressed"]:
+                regressions.append(name)
+        rows.append(row)
+
+    if as_json:
+        print(json.dumps(rows, indent=2))
+        return regressions
+
+    for row in rows:
+        line = f"{row['name']:<32} {row['seconds'] * 1000:>10.3f} ms"
+        if "change" in row:
+            flag = "  REGRESSION" if row["regressed"] else ""
+            line += (f"   baseline {row['baseline_seconds'] * 1000:>10.3f} ms "
+                     f"({row['change']:+.1%}){flag}")
+        print(line)
+
+    return regressions
+
+
+# Helpers.
+def _parsed_feed(num_entries: int) -> Dict[str, Any]:
+    return {
+        "status": 200,
+        "entries": [{
+            "title": f"Episode {n} - A Fairly Typical Episode Title",
+            "id": f"https://example.com/episodes/{n}",
+            "enclosures": [{"href": f"https://cdn.example.com/podcast/episode-{n}.mp3?src=rss"}],
+        } for n in range(num_entries, 0, -1)],
+    }
+
+
+def _sub(scratch: str, name: str, num_entries: int) -> subscription.Subscription:
+    sub = subscription.Subscription(url=f"https://example.com/{name}.xml", name=name,
+                                    directory=os.path.join(scratch, name))
+    sub.feed_state.load_rss_info(_parsed_feed(num_entries))
+    sub.feed_state.latest_entry_number = num_entries
+    return sub
+
+
+def _config(scratch: str) -> config.Config:
+    dirs = [os.path.join(scratch, name) for name in ["config", "cache", "data"]]
+    for directory in dirs:
+        os.makedirs(directory, exist_ok=True)
+
+    subs = [{"name": f"Podcast {i}", "url": f"https://example.com/{i}.xml"}
+            for i in range(NUM_SUBS)]
+    with open(os.path.join(dirs[0], "config.yaml"), "w", encoding="UTF-8") as stream:
+        yaml.dump({"subscriptions": subs}, stream)
+
+    conf = config.Config(config_dir=dirs[0], cache_dir=dirs[1], data_dir=dirs[2])
+    conf.load_state()
+    for sub in conf.subscriptions:
+        sub.feed_state.load_rss_info(_parsed_feed(SUB_ENTRIES))
+
+    return conf
+
+
+if __name__ == "__main__":
+    main()
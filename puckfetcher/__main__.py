@@ -1,16 +1,21 @@
 """Main entry point for puckfetcher, used to repeatedly download podcasts from the command line."""
 import argparse
+import atexit
+import datetime
+import functools
 import os
 import sys
 from logging import Logger
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import drewtilities as util
-from clint.textui import prompt
 
 import puckfetcher.constants as constants
 import puckfetcher.config as config
 import puckfetcher.error as error
+import puckfetcher.logs as logs
+import puckfetcher.profiling as profiling
+import puckfetcher.trace as trace
 
 LOG: Logger
 
@@ -18,12 +23,17 @@ def main() -> None:
     """Run puckfetcher on the command line."""
 
     global LOG
+    parser = _setup_program_arguments()
+    args = parser.parse_args()
+
     log_dir = constants.APPDIRS.user_log_dir
     log_filename = os.path.join(log_dir, f"{__package__}.log")
     LOG = util.set_up_logging(log_filename=log_filename, verbosity=constants.VERBOSITY)
 
-    parser = _setup_program_arguments()
-    args = parser.parse_args()
+    # Runs before logging's own exit handler, so queued records are written before it flushes.
+    listener = logs.start_async(LOG, json_file=args.log_json)
+    if listener is not None:
+        atexit.register(logs.stop_async, LOG, listener)
 
     (cache_dir, config_dir, data_dir) = _setup_directories(args)
 
@@ -36,6 +46,14 @@ def main() -> None:
 
     args = parser.parse_args()
 
+    if args.check_dirs:
+        try:
+            if conf.check_dirs():
+                parser.exit(status=1)
+        except error.PuckError as exception:
+            LOG.error(exception.desc)
+            parser.exit(status=1)
+
     command_options = []
     config_commands = config.get_commands()
     for i, key in enumerate(config_commands):
@@ -51,10 +69,13 @@ def main() -> None:
 
         else:
             if command != "exit":
-                _handle_command(command, conf)
+                _run_command(command, conf, args)
             parser.exit()
 
-    LOG.info(f"{__package__} {constants.VERSION} started!")
+    LOG.info("%s %s started!", __package__, constants.VERSION)
+
+    # Only the interactive menu needs clint.
+    from clint.textui import prompt
 
     while True:
         try:
@@ -63,7 +84,7 @@ def main() -> None:
             if command == "exit":
                 parser.exit()
 
-            _handle_command(command, conf)
+            _run_command(command, conf, args)
 
         # TODO look into replacing with
         # https://stackoverflow.com/questions/1112343/how-do-i-capture-sigint-in-python
@@ -77,11 +98,35 @@ def main() -> None:
 
     parser.exit()
 
+def _run_command(command: str, conf: config.Config, args: argparse.Namespace) -> None:
+    """Run a command, under the profilers and tracing requested on the command line."""
+    run: Callable[[], Any] = functools.partial(_handle_command, command, conf, args)
+
+    if args.trace_memory:
+        run = functools.partial(profiling.run_memory_traced, run, args.profile_top)
+
+    if args.trace is not None:
+        trace.start(args.trace_events)
+
+    try:
+        if args.profile is not None:
+            profiling.run_profiled(run, args.profile, args.profile_top)
+        else:
+            run()
+    finally:
+        recorder = trace.stop()
+        if recorder is not None:
+            recorder.write(args.trace)
+
 # TODO find a way to simplify and/or push logic into Config.
-def _handle_command(command: str, conf: config.Config) -> None:
+def _handle_command(command: str, conf: config.Config,
+                    args: Optional[argparse.Namespace]=None) -> None:
     try:
         if command == config.Command.update.name:
-            conf.update()
+            if args is None or args.processes <= 1:
+                conf.update()
+            else:
+                conf.update(args.processes)
 
         elif command == config.Command.list.name:
             conf.list()
@@ -92,8 +137,13 @@ def _handle_command(command: str, conf: config.Config) -> None:
 
         elif command == config.Command.details.name:
             sub_index = _choose_sub(conf)
-            conf.details(sub_index)
-            input("Press enter when done.")
+            if args is None:
+                conf.details(sub_index)
+                input("Press enter when done.")
+            else:
+                conf.details(sub_index, args.details_start, args.details_limit, args.json)
+                if not args.json:
+                    input("Press enter when done.")
 
         elif command == config.Command.summarize_sub.name:
             sub_index = _choose_sub(conf)
@@ -117,9 +167,44 @@ def _handle_command(command: str, conf: config.Config) -> None:
             (sub_index, entry_nums) = _sub_list_command_wrapper(conf, command)
             conf.unmark(sub_index, entry_nums)
 
+        elif command == config.Command.history.name:
+            if args is None:
+                conf.history()
+            else:
+                conf.history(args.since, args.limit)
+
+        elif command == config.Command.batch.name:
+            batch_file = "-" if args is None else args.batch_file
+            if batch_file == "-":
+                failures = conf.batch(sys.stdin)
+            else:
+                with open(batch_file, encoding=constants.ENCODING) as stream:
+                    failures = conf.batch(stream)
+
+            if failures:
+                sys.exit(1)
+
+        elif command == config.Command.import_opml.name:
+            if args is None or args.opml_file is None:
+                opml_file = input("Provide path of OPML file to import.")
+            else:
+                opml_file = args.opml_file
+
+            conf.import_opml(util.expand(opml_file),
+                             config.PROBE_THREADS if args is None else args.probe_threads)
+
+        elif command == config.Command.reparse.name:
+            conf.reparse()
+
         elif command == config.Command.reload_config.name:
             conf.reload_config()
 
+        elif command == config.Command.migrate_cache.name:
+            conf.migrate_cache()
+
+        elif command == config.Command.daemon.name:
+            conf.daemon()
+
         else:
             LOG.error("Unknown command. Allowed commands are:")
             LOG.error(config.get_command_help())
@@ -129,14 +214,18 @@ def _handle_command(command: str, conf: config.Config) -> None:
         LOG.error("Encountered error running command.")
         LOG.error(e.desc)
 
+    conf.write_metrics()
+
 
 def _sub_list_command_wrapper(conf: config.Config, command: str) -> Tuple[int, List[int]]:
     sub_index = _choose_sub(conf)
     conf.details(sub_index)
-    LOG.info(f"COMMAND - {command}")
+    LOG.info("COMMAND - %s", command)
     return (sub_index, _choose_entries())
 
 def _choose_sub(conf: config.Config) -> int:
+    from clint.textui import prompt
+
     sub_names = conf.get_subs()
 
     subscription_options = []
@@ -199,6 +288,18 @@ def _setup_directories(args: argparse.Namespace) -> Tuple[str, str, str]:
     return (cache_dir, config_dir, data_dir)
 
 
+def _parse_date(text: str) -> float:
+    for date_format in ["%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S",
+                        "%Y-%m-%dT%H:%M:%S"]:
+        try:
+            return datetime.datetime.strptime(text, date_format).timestamp()
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError(f"Can't understand date '{text}', expected something like "
+                                     "'2018-03-01' or '2018-03-01 18:30'.")
+
+
 def _setup_program_arguments() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Download RSS feeds based on a config.",
                                      formatter_class=argparse.RawTextHelpFormatter)
@@ -208,6 +309,10 @@ def _setup_program_arguments() -> argparse.ArgumentParser:
                         help=(f"Command to run, one of:"
                               f"\n{a:<14}"))
 
+    parser.add_argument("--batch-file", dest="batch_file", default="-",
+                        help=("File of commands for the batch command, one per line. Commands "
+                              "are read from stdin if this is '-' or not given."))
+
     parser.add_argument("--cache", "-a", dest="cache",
                         help=(f"Cache directory to use. The '{__package__}' directory will be "
                               f"created here, and the 'puckcache' and '{__package__}.log' files "
@@ -227,6 +332,69 @@ def _setup_program_arguments() -> argparse.ArgumentParser:
                               "affect the data directory, but this flag takes precedent. "
                               "'$XDG_DATA_HOME' will be used if nothing is provided."))
 
+    parser.add_argument("--check-dirs", dest="check_dirs", action="store_true",
+                        help=("Make sure every subscription's directory exists and is writable "
+                              "before running the command. Directories are otherwise only "
+                              "created when something is first downloaded into them."))
+
+    parser.add_argument("--details-start", dest="details_start", type=int, default=1,
+                        help="First entry number the details command shows.")
+
+    parser.add_argument("--details-limit", dest="details_limit", type=int,
+                        help=("Most entries the details command shows. Entries are shown as "
+                              "ranges with the same state, so all of them are shown by default."))
+
+    parser.add_argument("--json", dest="json", action="store_true",
+                        help="Print the details command's output to stdout as JSON, for scripts.")
+
+    parser.add_argument("--since", dest="since", type=_parse_date,
+                        help=("Only show downloads at or after this local date or time with the "
+                              "history command, like '2018-03-01' or '2018-03-01 18:30'."))
+
+    parser.add_argument("--limit", dest="limit", type=int, default=config.HISTORY_LIMIT,
+                        help="Most downloads the history command shows.")
+
+    parser.add_argument("--log-json", dest="log_json", action="store_true",
+                        help=("Write the log file as one JSON object per line, for log "
+                              "collectors. Output to the terminal is unchanged."))
+
+    parser.add_argument("--opml-file", dest="opml_file",
+                        help="OPML file of feeds for the import_opml command.")
+
+    parser.add_argument("--probe-threads", dest="probe_threads", type=int,
+                        default=config.PROBE_THREADS,
+                        help=("Most feeds the import_opml command fetches at once "
+                              f"(default {config.PROBE_THREADS})."))
+
+    parser.add_argument("--processes", "-p", dest="processes", type=int, default=1,
+                        help=("Update subscriptions in this many worker processes. Helps with "
+                              "very many subscriptions, where parsing and tagging are limited by "
+                              "one CPU core."))
+
+    parser.add_argument("--profile", dest="profile", nargs="?", const=f"{__package__}.prof",
+                        help=("Run the command under cProfile, write the stats to this file "
+                              f"('{__package__}.prof' if no file is given), and log the most "
+                              "expensive functions."))
+
+    parser.add_argument("--profile-top", dest="profile_top", type=int, default=25,
+                        help="How many functions or allocation sites profiling reports.")
+
+    parser.add_argument("--trace-memory", dest="trace_memory", action="store_true",
+                        help=("Trace memory allocations with tracemalloc, and log peak memory "
+                              "and the largest allocation sites for loading state, updating and "
+                              "saving the cache. Slows everything down a lot."))
+
+    parser.add_argument("--trace", dest="trace", nargs="?", const=f"{__package__}.trace.json",
+                        help=("Record a timeline of fetches, parses, downloads, tagging and "
+                              "cache writes on every thread, and write it to this file "
+                              f"('{__package__}.trace.json' if no file is given) in the Chrome "
+                              "trace event format. Open it in Perfetto or chrome://tracing."))
+
+    parser.add_argument("--trace-events", dest="trace_events", type=int,
+                        default=trace.DEFAULT_CAPACITY,
+                        help=("How many trace events to keep. Older events are dropped, so "
+                              "long daemon runs keep only their most recent activity."))
+
     parser.add_argument("--verbose", "-v", action="count",
                         help=("How verbose to be. If this is unused, only normal program output "
                               "will be logged. If there is one v, DEBUG output will be logged, "
@@ -0,0 +1,858 @@
+"""
+Module for on-disk subscription cache backends.
+The default backend is a small msgpack index plus one msgpack feed state file per subscription.
+A SQLite backend is available for very large sets of subscriptions.
+"""
+import bisect
+import collections
+import logging
+import mmap
+import os
+import struct
+import uuid
+from typing import (Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple,
+                    TYPE_CHECKING)
+
+import umsgpack
+
+import puckfetcher.codec as codec
+import puckfetcher.error as error
+
+# Only the SQLite backend needs sqlite3, so it's imported when a database is opened.
+if TYPE_CHECKING:
+    import sqlite3
+
+INDEX_FILENAME = "index"
+SHARD_DIRNAME = "subs"
+SQLITE_FILENAME = "puckcache.sqlite"
+HISTORY_DIRNAME = "history"
+HISTORY_LOG_FILENAME = "log"
+
+# Version of the cache format. Bump this and add a migration below when changing what's cached.
+# Version 1 is everything written before the format was versioned.
+FORMAT_VERSION = 2
+
+# Version of the SQLite cache's tables, kept in the database's user_version.
+# Bump it when _SCHEMA changes, so existing databases get the new tables.
+SCHEMA_VERSION = 1
+
+# Fields of a record read before deciding whether to decode the rest of it.
+PEEK_FIELDS = ("name", "original_url")
+
+LOG = logging.getLogger("root")
+
+# Predicate deciding whether a record is needed, given its PEEK_FIELDS.
+Wanted = Callable[[Mapping[str, Any]], bool]
+
+
+class CacheBackend(object):
+    """
+    Interface for subscription cache storage.
+
+    A cache is a list of index records (everything about a subscription except its feed state,
+    plus a summary of the feed state), and one encoded feed state per subscription, keyed by the
+    "shard" key in its index record.
+    Feed states are loaded on demand.
+    """
+
+    # Description of where the cache lives, for logging.
+    location = ""
+
+    def __init__(self, cache_dir: str, *, compression: Optional[str]=None,
+                 codec_name: Optional[str]=None) -> None:
+        """
+        Object constructor for cache backends.
+
+        :param cache_dir: Directory to keep the cache in.
+        :param compression: Compression for large parts of the cache, one of
+            codec.COMPRESSORS. Uncompressed if not provided. Not every backend compresses.
+        :param codec_name: Encoder/decoder to use, one of codec.CODECS. Defaults to the fastest
+            one available.
+        """
+        self.cache_dir = cache_dir
+        self.compression = codec.get_compression(compression)
+        self.codec = codec.CODECS[codec_name] if codec_name is not None else codec.DEFAULT_CODEC
+
+    def exists(self) -> bool:
+        """
+        Check whether this cache has been written.
+
+        :returns: Whether there is a cache to load.
+        """
+        raise NotImplementedError
+
+    def load_index(self, wanted: Optional[Wanted]=None) -> List[Dict[str, Any]]:
+        """
+        Load index records for cached subscriptions.
+
+        :param wanted: Predicate given each record's PEEK_FIELDS, records it rejects are skipped
+            without being decoded. All records are loaded if this isn't provided.
+        :returns: List of index records, in the order they were saved.
+        """
+        raise NotImplementedError
+
+    def load_shard(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Load feed state for one subscription.
+
+        :param key: Shard key of the subscription, as stored in its index record.
+        :returns: Encoded feed state, or None if it is missing or unreadable.
+        """
+        raise NotImplementedError
+
+    def save(self, records: Sequence[Mapping[str, Any]], shards: Mapping[str, Any]) -> None:
+        """
+        Write index records and changed feed states.
+        Feed states not referenced by any index record are removed.
+
+        :param records: Index records for every subscription to keep. Each needs a "shard" key.
+        :param shards: Encoded feed states to write, keyed by shard key. Subscriptions without an
+            entry here keep their existing feed state.
+        """
+        raise NotImplementedError
+
+    def append_history(self, items: Sequence[Mapping[str, Any]]) -> None:
+        """
+        Add completed downloads to the download history. History is only ever appended to.
+
+        :param items: Downloads to record, oldest first. Each needs a "time" (seconds since the
+            epoch) and the "shard" key of its subscription.
+        """
+        raise NotImplementedError
+
+    def load_history(self, shard: Optional[str]=None, since: Optional[float]=None,
+                     limit: Optional[int]=None) -> List[Dict[str, Any]]:
+        """
+        Load recorded downloads, newest first, using an index rather than reading everything.
+
+        :param shard: Only load downloads for the subscription with this shard key.
+        :param since: Only load downloads at or after this time, in seconds since the epoch.
+        :param limit: Most downloads to load.
+        :returns: Recorded downloads.
+        """
+        raise NotImplementedError
+
+    def stamp(self) -> Any:
+        """
+        Provide a stamp that changes whenever the index is written, so writes by other processes
+        sharing the cache can be noticed cheaply.
+
+        :returns: Stamp to compare with earlier ones, or None if nothing has been written.
+        """
+        raise NotImplementedError
+
+    def shard_loader(self, key: str) -> Callable[[], Optional[Dict[str, Any]]]:
+        """
+        Provide a callable that loads one subscription's feed state when called.
+
+        :param key: Shard key of the subscription.
+        :returns: Loader for that feed state.
+        """
+        return lambda: self.load_shard(key)
+
+
+class ShardedCache(CacheBackend):
+    """
+    Subscription cache stored as an index file and a directory of per-subscription shards.
+
+    The index holds everything about a subscription except its feed state (settings, metadata,
+    URLs, latest entry number, queue length), so listing subscriptions only needs the index.
+    Each shard holds one subscription's feed state, and is only read when that subscription's
+    entries are actually needed. Completed downloads are kept in a HistoryLog next to the index.
+    """
+
+    def __init__(self, cache_dir: str, *, compression: Optional[str]=None,
+                 codec_name: Optional[str]=None) -> None:
+        super(ShardedCache, self).__init__(cache_dir, compression=compression,
+                                           codec_name=codec_name)
+        self.directory = os.path.join(cache_dir, "puckcache.d")
+        self.location = self.directory
+        self.index_file = os.path.join(self.directory, INDEX_FILENAME)
+        self.shard_dir = os.path.join(self.directory, SHARD_DIRNAME)
+        self.history = HistoryLog(os.path.join(self.directory, HISTORY_DIRNAME), self.codec)
+
+    def exists(self) -> bool:
+        """
+        Check whether a sharded cache has been written.
+
+        :returns: Whether the index file exists.
+        """
+        return os.path.isfile(self.index_file)
+
+    def load_index(self, wanted: Optional[Wanted]=None) -> List[Dict[str, Any]]:
+        LOG.debug("Opening cache index to retrieve subscriptions.")
+        return [migrate_record(record)
+                for record in iter_packed_records(self.index_file, wanted, self.codec)]
+
+    def load_shard(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Load feed state for one subscription.
+
+        :param key: Shard key of the subscription, as stored in its index record.
+        :returns: Encoded feed state, or None if the shard is missing or unreadable.
+        """
+        path = self._shard_path(key)
+        LOG.debug("Loading cache shard '%s'.", path)
+
+        try:
+            with open(path, "rb") as stream:
+                feed_state = self.codec.unpackb(stream.read())
+
+            # Entries may be stored compressed, as their own msgpack object.
+            if feed_state.get("compression", None) is not None:
+                entries = codec.decompress(feed_state["compression"], feed_state["entries"])
+                feed_state["entries"] = self.codec.unpackb(entries)
+
+            return migrate_feed_state(feed_state)
+
+        except (OSError, KeyError, AttributeError, codec.DecompressionError) + \
+                self.codec.errors as exception:
+            LOG.error("Unable to read cache shard '%s', feed state will be reset: "
+                      "%s", path, exception)
+            return None
+
+    def save(self, records: Sequence[Mapping[str, Any]], shards: Mapping[str, Any]) -> None:
+        """
+        Write index and changed shards.
+        Shards not referenced by the index are removed.
+
+        :param records: Index records for every subscription to keep. Each needs a "shard" key.
+        :param shards: Encoded feed states to write, keyed by shard key. Subscriptions without an
+            entry here keep their existing shard file.
+        """
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        for key, feed_state in shards.items():
+            feed_state = {**feed_state, "__format__": FORMAT_VERSION,
+                          "compression": self.compression}
+            if self.compression is not None:
+                packed_entries = self.codec.packb(feed_state["entries"])
+                feed_state["entries"] = codec.compress(self.compression, packed_entries)
+
+            _write_atomic(self._shard_path(key), self.codec.packb(feed_state))
+
+        records = [{**record, "__format__": FORMAT_VERSION} for record in records]
+        _write_atomic(self.index_file, self.codec.packb(records))
+
+        live_keys = {record["shard"] for record in records}
+        for filename in os.listdir(self.shard_dir):
+            if filename not in live_keys:
+                LOG.debug("Removing orphaned cache shard '%s'.", filename)
+                os.remove(os.path.join(self.shard_dir, filename))
+
+    def append_history(self, items: Sequence[Mapping[str, Any]]) -> None:
+        self.history.append(items)
+
+    def load_history(self, shard: Optional[str]=None, since: Optional[float]=None,
+                     limit: Optional[int]=None) -> List[Dict[str, Any]]:
+        return self.history.load(shard, since, limit)
+
+    def stamp(self) -> Any:
+        return _file_stamp(self.index_file)
+
+    def _shard_path(self, key: str) -> str:
+        return os.path.join(self.shard_dir, key)
+
+
+class SqliteCache(CacheBackend):
+    """
+    Subscription cache stored in a SQLite database.
+
+    Subscriptions, feed entries, download queues and download history live in their own tables,
+    indexed by subscription name, original URL and entry GUID.
+    Each subscription's feed state is written in its own transaction, and only entries that
+    actually changed are rewritten.
+    """
+
+    def __init__(self, cache_dir: str, *, compression: Optional[str]=None,
+                 codec_name: Optional[str]=None) -> None:
+        super(SqliteCache, self).__init__(cache_dir, compression=compression,
+                                          codec_name=codec_name)
+        self.db_file = os.path.join(cache_dir, SQLITE_FILENAME)
+        self.location = self.db_file
+
+        # Tables only need creating once per process, not on every transaction.
+        self._schema_checked = False
+
+    def exists(self) -> bool:
+        if not os.path.isfile(self.db_file):
+            return False
+
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM subscriptions").fetchone()[0] > 0
+
+    def load_index(self, wanted: Optional[Wanted]=None) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            LOG.debug("Querying cache database for subscriptions.")
+            rows = conn.execute("SELECT name, original_url, record FROM subscriptions "
+                                "ORDER BY position").fetchall()
+
+        return [migrate_record(self.codec.unpackb(record))
+                for (name, original_url, record) in rows
+                if wanted is None or wanted({"name": name, "original_url": original_url})]
+
+    def load_shard(self, key: str) -> Optional[Dict[str, Any]]:
+        LOG.debug("Loading feed state '%s' from cache database.", key)
+        with self._connect() as conn:
+            row = conn.execute("SELECT feed_state FROM subscriptions WHERE shard = ?",
+                               (key,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+
+            feed_state = self.codec.unpackb(row[0])
+
+            entries = []
+            entries_state_dict = {}
+            for (number, data, downloaded) in conn.execute(
+                    "SELECT number, data, downloaded FROM entries WHERE shard = ? "
+                    "ORDER BY number DESC", (key,)):
+                if data is not None:
+                    entries.append(self.codec.unpackb(data))
+                if downloaded is not None:
+                    entries_state_dict[number - 1] = bool(downloaded)
+
+            queue = [row[0] for row in conn.execute(
+                "SELECT number FROM queue WHERE shard = ? ORDER BY position", (key,))]
+
+            summary_queue = [self.codec.unpackb(row[0]) for row in conn.execute(
+                "SELECT data FROM history WHERE shard = ? ORDER BY position", (key,))]
+
+        feed_state["entries"] = entries
+        feed_state["entries_state_dict"] = entries_state_dict
+        feed_state["queue"] = queue
+        feed_state["summary_queue"] = summary_queue
+        return migrate_feed_state(feed_state)
+
+    def save(self, records: Sequence[Mapping[str, Any]], shards: Mapping[str, Any]) -> None:
+        with self._connect() as conn:
+            live_keys = {record["shard"] for record in records}
+            for (key,) in conn.execute("SELECT shard FROM subscriptions").fetchall():
+                if key not in live_keys:
+                    LOG.debug("Removing orphaned subscription '%s' from cache database.", key)
+                    for table in ["subscriptions", "entries", "queue", "history"]:
+                        conn.execute(f"DELETE FROM {table} WHERE shard = ?", (key,))
+
+            for (position, record) in enumerate(records):
+                conn.execute(
+                    "INSERT OR IGNORE INTO subscriptions (shard) VALUES (?)", (record["shard"],))
+                conn.execute(
+                    "UPDATE subscriptions SET position = ?, name = ?, url = ?, "
+                    "original_url = ?, record = ? WHERE shard = ?",
+                    (position, record["name"], record["url"], record["original_url"],
+                     self.codec.packb({**record, "__format__": FORMAT_VERSION}),
+                     record["shard"]))
+
+        for (key, feed_state) in shards.items():
+            self._save_feed_state(key, feed_state)
+
+    def append_history(self, items: Sequence[Mapping[str, Any]]) -> None:
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO downloads (time, shard, data) VALUES (?, ?, ?)",
+                             [(item["time"], item["shard"], self.codec.packb(item))
+                              for item in items])
+
+    def load_history(self, shard: Optional[str]=None, since: Optional[float]=None,
+                     limit: Optional[int]=None) -> List[Dict[str, Any]]:
+        conditions: List[str] = []
+        params: List[Any] = []
+        if shard is not None:
+            conditions.append("shard = ?")
+            params.append(shard)
+        if since is not None:
+            conditions.append("time >= ?")
+            params.append(since)
+
+        query = "SELECT data FROM downloads"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += " ORDER BY time DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._connect() as conn:
+            return [self.codec.unpackb(row[0]) for row in conn.execute(query, params)]
+
+    def _save_feed_state(self, key: str, feed_state: Mapping[str, Any]) -> None:
+        """Write one subscription's feed state, in one transaction."""
+        entries = feed_state["entries"]
+        states = feed_state["entries_state_dict"]
+
+        # Entries are stored by their one-indexed entry number.
+        # The entries list is newest first, and entry state is keyed by zero-indexed number.
+        num_entries = len(entries)
+        new_rows: Dict[int, Tuple[Optional[str], Optional[bytes], Optional[int]]] = {}
+        for (age, entry) in enumerate(entries):
+            number = num_entries - age
+            new_rows[number] = (entry.get("id", None), self.codec.packb(entry), None)
+        for (zero_indexed_num, downloaded) in states.items():
+            number = zero_indexed_num + 1
+            (guid, data, _) = new_rows.get(number, (None, None, None))
+            new_rows[number] = (guid, data, int(downloaded))
+
+        rest = {k: v for (k, v) in feed_state.items()
+                if k not in ("entries", "entries_state_dict", "queue", "summary_queue")}
+        rest["__format__"] = FORMAT_VERSION
+
+        with self._connect() as conn:
+            old_rows = {number: (guid, data, downloaded)
+                        for (number, guid, data, downloaded) in conn.execute(
+                            "SELECT number, guid, data, downloaded FROM entries WHERE shard = ?",
+                            (key,))}
+
+            for number in old_rows.keys() - new_rows.keys():
+                conn.execute("DELETE FROM entries WHERE shard = ? AND number = ?", (key, number))
+
+            for (number, row) in new_rows.items():
+                if old_rows.get(number) != row:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries (shard, number, guid, data, downloaded) "
+                        "VALUES (?, ?, ?, ?, ?)", (key, number, *row))
+
+            conn.execute("DELETE FROM queue WHERE shard = ?", (key,))
+            conn.executemany("INSERT INTO queue (shard, position, number) VALUES (?, ?, ?)",
+                             [(key, i, num) for (i, num) in enumerate(feed_state["queue"])])
+
+            conn.execute("DELETE FROM history WHERE shard = ?", (key,))
+            conn.executemany(
+                "INSERT INTO history (shard, position, number, data) VALUES (?, ?, ?, ?)",
+                [(key, i, item["number"], self.codec.packb(item))
+                 for (i, item) in enumerate(feed_state["summary_queue"])])
+
+            conn.execute("UPDATE subscriptions SET feed_state = ? WHERE shard = ?",
+                         (self.codec.packb(rest), key))
+
+    def stamp(self) -> Any:
+        return _file_stamp(self.db_file)
+
+    def _connect(self) -> "_Transaction":
+        check_schema = not self._schema_checked
+        self._schema_checked = True
+        return _Transaction(self.db_file, check_schema)
+
+
+class _Transaction(object):
+    """Context manager for one transaction on the cache database."""
+
+    def __init__(self, db_file: str, check_schema: bool=False) -> None:
+        self.db_file = db_file
+        self.check_schema = check_schema
+        self.conn: Optional["sqlite3.Connection"] = None
+
+    def __enter__(self) -> "sqlite3.Connection":
+        import sqlite3
+
+        self.conn = sqlite3.connect(self.db_file)
+        if self.check_schema:
+            # Databases created before the schema was versioned are at version 0 too.
+            if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                LOG.debug("Creating cache database tables in '%s'.", self.db_file)
+                self.conn.executescript(_SCHEMA)
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        return self.conn
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if self.conn is not None:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+
+            self.conn.close()
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    shard TEXT PRIMARY KEY,
+    position INTEGER,
+    name TEXT,
+    url TEXT,
+    original_url TEXT,
+    record BLOB,
+    feed_state BLOB
+);
+CREATE INDEX IF NOT EXISTS subscriptions_name ON subscriptions (name);
+CREATE INDEX IF NOT EXISTS subscriptions_original_url ON subscriptions (original_url);
+
+CREATE TABLE IF NOT EXISTS entries (
+    shard TEXT,
+    number INTEGER,
+    guid TEXT,
+    data BLOB,
+    downloaded INTEGER,
+    PRIMARY KEY (shard, number)
+);
+CREATE INDEX IF NOT EXISTS entries_guid ON entries (guid);
+
+CREATE TABLE IF NOT EXISTS queue (
+    shard TEXT,
+    position INTEGER,
+    number INTEGER,
+    PRIMARY KEY (shard, position)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    shard TEXT,
+    position INTEGER,
+    number INTEGER,
+    data BLOB,
+    PRIMARY KEY (shard, position)
+);
+
+CREATE TABLE IF NOT EXISTS downloads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL,
+    shard TEXT,
+    data BLOB
+);
+CREATE INDEX IF NOT EXISTS downloads_time ON downloads (time);
+CREATE INDEX IF NOT EXISTS downloads_shard_time ON downloads (shard, time);
+"""
+
+
+class HistoryLog(object):
+    """
+    Append-only download history kept in files.
+
+    Downloads are appended to a log as length-prefixed msgpack records. Each append also adds a
+    fixed-size (time, offset) entry to a global index and to an index per subscription, so recent
+    downloads and downloads since a time are found by seeking in an index, not reading the log.
+    """
+
+    def __init__(self, directory: str, record_codec: codec.Codec=codec.DEFAULT_CODEC) -> None:
+        """
+        Object constructor for history log.
+
+        :param directory: Directory holding the log and its indexes.
+        :param record_codec: Codec to encode records with.
+        """
+        self.directory = directory
+        self.codec = record_codec
+        self.log_file = os.path.join(directory, HISTORY_LOG_FILENAME)
+        self.index_file = os.path.join(directory, INDEX_FILENAME)
+        self.sub_index_dir = os.path.join(directory, SHARD_DIRNAME)
+
+    def append(self, items: Sequence[Mapping[str, Any]]) -> None:
+        """
+        Append downloads to the log and its indexes.
+
+        :param items: Downloads to record, oldest first. Each needs a "time" and a "shard".
+        """
+        if not items:
+            return
+
+        os.makedirs(self.sub_index_dir, exist_ok=True)
+
+        # The log is written first, so a crash can only leave records no index points to.
+        index_entries = []
+        with open(self.log_file, "ab") as stream:
+            offset = stream.tell()
+            for item in items:
+                data = self.codec.packb(dict(item))
+                stream.write(struct.pack(_HISTORY_LENGTH_FORMAT, len(data)))
+                stream.write(data)
+                index_entries.append((item["shard"],
+                                      struct.pack(_HISTORY_INDEX_FORMAT, item["time"], offset)))
+                offset += _HISTORY_LENGTH_SIZE + len(data)
+
+        with open(self.index_file, "ab") as stream:
+            stream.write(b"".join(entry for (_, entry) in index_entries))
+
+        by_shard: Dict[str, List[bytes]] = collections.defaultdict(list)
+        for (shard, entry) in index_entries:
+            by_shard[shard].append(entry)
+        for (shard, entries) in by_shard.items():
+            with open(os.path.join(self.sub_index_dir, shard), "ab") as stream:
+                stream.write(b"".join(entries))
+
+    def load(self, shard: Optional[str]=None, since: Optional[float]=None,
+             limit: Optional[int]=None) -> List[Dict[str, Any]]:
+        """
+        Load downloads, newest first.
+
+        :param shard: Only load downloads for the subscription with this shard key.
+        :param since: Only load downloads at or after this time, in seconds since the epoch.
+        :param limit: Most downloads to load.
+        :returns: Recorded downloads.
+        """
+        index_file = self.index_file if shard is None else \
+            os.path.join(self.sub_index_dir, shard)
+        if not os.path.isfile(index_file) or os.path.getsize(index_file) == 0:
+            return []
+
+        with open(index_file, "rb") as stream, \
+                mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            count = len(buf) // _HISTORY_INDEX_SIZE
+
+            # Entries are appended in time order, so the first one since a time is a bisect away.
+            first = 0
+            if since is not None:
+                first = bisect.bisect_left(_IndexTimes(buf), since, 0, count)
+            if limit is not None:
+                first = max(first, count - limit)
+
+            offsets = [struct.unpack_from(_HISTORY_INDEX_FORMAT, buf,
+                                          i * _HISTORY_INDEX_SIZE)[1]
+                       for i in range(count - 1, first - 1, -1)]
+
+        items = []
+        with open(self.log_file, "rb") as stream:
+            for offset in offsets:
+                stream.seek(offset)
+                (length,) = struct.unpack(_HISTORY_LENGTH_FORMAT,
+                                          stream.read(_HISTORY_LENGTH_SIZE))
+                items.append(self.codec.unpackb(stream.read(length)))
+
+        return items
+
+
+class _IndexTimes(object):
+    """Times in a history index, as a sequence bisect can search."""
+
+    def __init__(self, buf: Any) -> None:
+        self.buf = buf
+
+    def __getitem__(self, i: int) -> float:
+        return struct.unpack_from(_HISTORY_INDEX_FORMAT, self.buf, i * _HISTORY_INDEX_SIZE)[0]
+
+
+_HISTORY_LENGTH_FORMAT = ">I"
+_HISTORY_LENGTH_SIZE = struct.calcsize(_HISTORY_LENGTH_FORMAT)
+_HISTORY_INDEX_FORMAT = "<dQ"
+_HISTORY_INDEX_SIZE = struct.calcsize(_HISTORY_INDEX_FORMAT)
+
+BACKENDS: Mapping[str, Callable[..., CacheBackend]] = collections.OrderedDict((
+    ("msgpack", ShardedCache),
+    ("sqlite", SqliteCache),
+))
+
+
+def get_backend(name: str, cache_dir: str, compression: Optional[str]=None) -> CacheBackend:
+    """
+    Provide cache backend by name.
+
+    :param name: Name of backend, one of the keys of BACKENDS.
+    :param cache_dir: Directory to keep the cache in.
+    :param compression: Compression to use, if the backend supports it.
+    :returns: Cache backend object.
+    """
+    if name not in BACKENDS:
+        msg = f"Unknown cache backend '{name}', expected one of {list(BACKENDS.keys())}."
+        raise error.MalformedConfigError(msg)
+
+    return BACKENDS[name](cache_dir, compression=compression)
+
+
+def iter_packed_records(
+        path: str,
+        wanted: Optional[Wanted]=None,
+        record_codec: codec.Codec=codec.DEFAULT_CODEC,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream records out of a file holding one msgpack array of maps, one record at a time.
+    The file is memory-mapped rather than read, and records rejected by wanted are skipped over
+    without being decoded, so only one record is ever held decoded at once.
+
+    :param path: File to read. A missing or empty file has no records.
+    :param wanted: Predicate given each record's PEEK_FIELDS. All records are provided if this
+        isn't provided.
+    :param record_codec: Codec to decode records with.
+    :returns: Iterator over decoded records.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        LOG.debug("No records in '%s'.", path)
+        return
+
+    with open(path, "rb") as stream, \
+            mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if buf[0] not in _ARRAY_TYPES:
+            raise umsgpack.UnpackException(f"Expected an array of records in '{path}'.")
+
+        (pos, _, count) = _header(buf, 0)
+
+        for _ in range(count):
+            start = pos
+            if wanted is not None and \
+                    not wanted(_peek(buf, pos, PEEK_FIELDS, record_codec)):
+                pos = _skip(buf, pos)
+                continue
+
+            pos = _skip(buf, pos)
+            yield record_codec.unpackb(buf[start:pos])
+
+
+def migrate_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bring an encoded subscription or index record up to the current format version.
+    Feed state embedded in the record (from the old single-file cache) is migrated too.
+
+    :param record: Record in any format version.
+    :returns: Record in the current format version.
+    """
+    record = _migrate(record, _RECORD_MIGRATIONS)
+
+    if record.get("feed_state", None) is not None:
+        record["feed_state"] = migrate_feed_state(record["feed_state"])
+
+    return record
+
+
+def migrate_feed_state(feed_state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Bring an encoded feed state up to the current format version.
+
+    :param feed_state: Feed state in any format version.
+    :returns: Feed state in the current format version.
+    """
+    return _migrate(feed_state, _FEED_STATE_MIGRATIONS)
+
+
+def _migrate(data: Dict[str, Any], migrations: Mapping[int, Callable[[Dict[str, Any]], None]],
+             ) -> Dict[str, Any]:
+    version = data.get("__format__", 1)
+    if version > FORMAT_VERSION:
+        LOG.warning("Cache format version %s is newer than this version of puckfetcher "
+                    "understands (%s), reading it anyway.", version, FORMAT_VERSION)
+
+    while version < FORMAT_VERSION:
+        LOG.debug("Migrating cache data from format version %s to %s.", version, version + 1)
+        migration = migrations.get(version, None)
+        if migration is not None:
+            migration(data)
+        version += 1
+
+    data["__format__"] = version
+    return data
+
+
+def _feed_state_1_to_2(feed_state: Dict[str, Any]) -> None:
+    # Version 2 records each entry's GUID.
+    for entry in feed_state.get("entries", []):
+        if "id" not in entry:
+            entry["id"] = None
+
+
+# Format version -> function upgrading data in place from that version to the next.
+_RECORD_MIGRATIONS: Mapping[int, Callable[[Dict[str, Any]], None]] = {}
+_FEED_STATE_MIGRATIONS: Mapping[int, Callable[[Dict[str, Any]], None]] = {
+    1: _feed_state_1_to_2,
+}
+
+
+def new_key() -> str:
+    """
+    Generate a shard key for a subscription that has never been cached.
+
+    :returns: New, unique shard key.
+    """
+    return uuid.uuid4().hex
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write data to a temporary file and move it into place, so readers never see half a file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as stream:
+        stream.write(data)
+
+    os.replace(temp_path, path)
+
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    # Atomic replaces give the file a new inode, in-place writes a new mtime and usually size.
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+# Minimal msgpack walking, so records can be skipped without decoding them.
+_ARRAY_TYPES = {*range(0x90, 0xa0), 0xdc, 0xdd}
+_MAP_TYPES = {*range(0x80, 0x90), 0xde, 0xdf}
+
+# Type byte -> (size of length field, extra fixed bytes), for types with a length field.
+_SIZED_TYPES = {
+    0xc4: (1, 0), 0xc5: (2, 0), 0xc6: (4, 0),  # bin
+    0xc7: (1, 1), 0xc8: (2, 1), 0xc9: (4, 1),  # ext, plus type byte
+    0xd9: (1, 0), 0xda: (2, 0), 0xdb: (4, 0),  # str
+}
+
+# Type byte -> payload size, for fixed size types.
+_FIXED_TYPES = {
+    0xc0: 0, 0xc2: 0, 0xc3: 0,  # nil, bool
+    0xca: 4, 0xcb: 8,  # float
+    0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8,  # uint
+    0xd0: 1, 0xd1: 2, 0xd2: 4, 0xd3: 8,  # int
+    0xd4: 2, 0xd5: 3, 0xd6: 5, 0xd7: 9, 0xd8: 17,  # fixext, plus type byte
+}
+
+_LENGTH_FORMATS = {1: ">B", 2: ">H", 4: ">I"}
+
+
+def _header(buf: Any, pos: int) -> Tuple[int, int, int]:
+    """
+    Read the header of the msgpack object at pos.
+
+    :returns: Position after the header, payload size, and number of child objects.
+    """
+    type_byte = buf[pos]
+    pos += 1
+
+    if type_byte <= 0x7f or type_byte >= 0xe0:
+        return (pos, 0, 0)
+    elif 0x80 <= type_byte <= 0x8f:
+        return (pos, 0, 2 * (type_byte & 0x0f))
+    elif 0x90 <= type_byte <= 0x9f:
+        return (pos, 0, type_byte & 0x0f)
+    elif 0xa0 <= type_byte <= 0xbf:
+        return (pos, type_byte & 0x1f, 0)
+    elif type_byte in _FIXED_TYPES:
+        return (pos, _FIXED_TYPES[type_byte], 0)
+    elif type_byte in _SIZED_TYPES:
+        (length_size, extra) = _SIZED_TYPES[type_byte]
+        (length,) = struct.unpack_from(_LENGTH_FORMATS[length_size], buf, pos)
+        return (pos + length_size, length + extra, 0)
+    elif type_byte in (0xdc, 0xde):
+        (count,) = struct.unpack_from(">H", buf, pos)
+        return (pos + 2, 0, count * (2 if type_byte == 0xde else 1))
+    elif type_byte in (0xdd, 0xdf):
+        (count,) = struct.unpack_from(">I", buf, pos)
+        return (pos + 4, 0, count * (2 if type_byte == 0xdf else 1))
+
+    raise umsgpack.UnpackException(f"Invalid msgpack type byte {type_byte:#x} at {pos - 1}.")
+
+
+def _skip(buf: Any, pos: int) -> int:
+    """Skip over the msgpack object at pos, returning the position after it."""
+    remaining = 1
+    while remaining > 0:
+        remaining -= 1
+        (pos, size, children) = _header(buf, pos)
+        pos += size
+        remaining += children
+
+    return pos
+
+
+def _peek(buf: Any, pos: int, fields: Tuple[str, ...], record_codec: codec.Codec,
+          ) -> Dict[str, Any]:
+    """Decode only the given fields of the msgpack map at pos."""
+    if buf[pos] not in _MAP_TYPES:
+        return {}
+
+    (pos, _, children) = _header(buf, pos)
+
+    peeked = {}
+    for _ in range(children // 2):
+        key_end = _skip(buf, pos)
+        key = record_codec.unpackb(buf[pos:key_end])
+        value_end = _skip(buf, key_end)
+
+        if key in fields:
+            peeked[key] = record_codec.unpackb(buf[key_end:value_end])
+
+        pos = value_end
+
+    return peeked
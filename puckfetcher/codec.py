@@ -0,0 +1,131 @@
+"""
+Module for encoding cache data to bytes and back, and for compressing it.
+The C-accelerated msgpack package is used when it's installed, with u-msgpack-python as the
+pure-Python fallback. Both produce the same bytes, so caches can move between them.
+"""
+import importlib.util
+import logging
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+import umsgpack
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LOG = logging.getLogger("root")
+
+
+class DecompressionError(ValueError):
+    """Compressed data couldn't be decompressed, whichever compression it used."""
+
+
+class Codec(object):
+    """Pair of msgpack encode/decode functions, plus the errors decoding can raise."""
+
+    def __init__(
+            self,
+            name: str,
+            packb: Callable[[Any], bytes],
+            unpackb: Callable[[bytes], Any],
+            errors: Tuple[Type[BaseException], ...],
+    ) -> None:
+        """
+        Object constructor for codec.
+
+        :param name: Name of codec, for logging and benchmarks.
+        :param packb: Function encoding an object to bytes.
+        :param unpackb: Function decoding bytes to an object.
+        :param errors: Exception types raised on undecodable input.
+        """
+        self.name = name
+        self.packb = packb
+        self.unpackb = unpackb
+        self.errors = errors
+
+
+CODECS: Dict[str, Codec] = {
+    "umsgpack": Codec(
+        "umsgpack",
+        umsgpack.packb,
+        umsgpack.unpackb,
+        (umsgpack.UnpackException, ValueError, zlib.error),
+    ),
+}
+
+if msgpack is not None:
+    def _msgpack_unpackb(data: bytes) -> Any:
+        # Entry state is keyed by entry number, so map keys can't be restricted to strings.
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    CODECS["msgpack"] = Codec(
+        "msgpack",
+        lambda obj: msgpack.packb(obj, use_bin_type=True),
+        _msgpack_unpackb,
+        (msgpack.UnpackException, umsgpack.UnpackException, ValueError, zlib.error),
+    )
+
+DEFAULT_CODEC = CODECS["msgpack"] if "msgpack" in CODECS else CODECS["umsgpack"]
+
+# Compression name -> (compress, decompress).
+COMPRESSORS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+
+# zstandard is only imported once something is actually compressed with it.
+if importlib.util.find_spec("zstandard") is not None:
+    def _zstd_compress(data: bytes) -> bytes:
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def _zstd_decompress(data: bytes) -> bytes:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    COMPRESSORS["zstd"] = (_zstd_compress, _zstd_decompress)
+
+
+def get_compression(name: Optional[str]) -> Optional[str]:
+    """
+    Check a requested compression is available, falling back to zlib when it isn't.
+
+    :param name: Name of compression, or None for no compression.
+    :returns: Name of compression to actually use, or None.
+    """
+    if name is None or name in COMPRESSORS:
+        return name
+
+    LOG.warning("Cache compression '%s' is not available, using zlib instead.", name)
+    return "zlib"
+
+
+def compress(name: str, data: bytes) -> bytes:
+    """
+    Compress data.
+
+    :param name: Name of compression to use.
+    :param data: Bytes to compress.
+    :returns: Compressed bytes.
+    """
+    return COMPRESSORS[name][0](data)
+
+
+def decompress(name: str, data: bytes) -> bytes:
+    """
+    Decompress data.
+
+    :param name: Name of compression that was used.
+    :param data: Compressed bytes.
+    :returns: Decompressed bytes.
+    :raises DecompressionError: If the compression is unavailable, or the data is corrupt.
+    """
+    if name not in COMPRESSORS:
+        raise DecompressionError(f"Data was compressed with unavailable compression '{name}'.")
+
+    # Each compression library raises its own errors (zlib.error, zstandard.ZstdError).
+    try:
+        return COMPRESSORS[name][1](data)
+    except Exception as exception:
+        raise DecompressionError(f"Unable to decompress {name} data: {exception}") from exception
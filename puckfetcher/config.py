@@ -1,24 +1,75 @@
 """Module describing a Config object, which controls how an instance of puckfetcher acts."""
 import collections
+import concurrent.futures
+import contextlib
+import datetime
 import enum
+import json
 import logging
 import os
-from typing import Any, List, Mapping, Dict
+import shlex
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional,
+                    Tuple)
 
 import drewtilities as util
-import umsgpack
 import yaml
 
+import puckfetcher.cache as cache
 import puckfetcher.constants as constants
+import puckfetcher.daemon as daemon
 import puckfetcher.error as error
+import puckfetcher.fetch as fetch
+import puckfetcher.lock as lock
+import puckfetcher.logs as logs
+import puckfetcher.metrics as metrics
+import puckfetcher.opml as opml
+import puckfetcher.profiling as profiling
 import puckfetcher.subscription as subscription
+import puckfetcher.trace as trace
 
 SUMMARY_LIMIT = 4
 
+# Downloads shown by default by history and summarize_sub.
+HISTORY_LIMIT = 50
+
+# Commands the batch command can run.
+BATCH_COMMANDS = ["enqueue", "mark", "unmark", "details", "download_queue", "summarize_sub"]
+
+# Lock held while writing the cache, and directory of subscription leases, in the cache dir.
+CACHE_LOCK_FILENAME = "puckcache.lock"
+LEASE_DIRNAME = "leases"
+
+# Feeds fetched at once when importing an OPML file.
+PROBE_THREADS = 16
+
+# Directory of archived raw feeds, in the cache dir.
+FEED_ARCHIVE_DIRNAME = "feeds"
+
+# Longest to wait for another process to finish writing the cache, in seconds.
+CACHE_LOCK_TIMEOUT = 120
+
+# libyaml's loader is much faster than the pure Python one, use it when it's available.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 LOG = logging.getLogger("root")
 
 
+class ReloadResult(NamedTuple):
+    """Names of subscriptions changed by a config reload."""
+    added: List[str]
+    removed: List[str]
+    modified: List[str]
+
+
+class ImportResult(NamedTuple):
+    """What happened to one feed from an imported OPML file."""
+    name: str
+    url: str
+    imported: bool
+    detail: str
+
+
 class Config(object):
     """Class holding config options."""
 
@@ -26,79 +77,81 @@ class Config(object):
         _validate_dirs(config_dir, cache_dir, data_dir)
 
         self.config_file = os.path.join(config_dir, "config.yaml")
-        LOG.debug(f"Using config file '{self.config_file}'.")
+        LOG.debug("Using config file '%s'.", self.config_file)
 
+        # Single-file cache used before the cache was sharded. Only read to migrate old caches.
         self.cache_file = os.path.join(cache_dir, "puckcache")
-        LOG.debug(f"Using cache file '{self.cache_file}'.")
 
-        self.settings = {
+        # Cache backend is picked once user settings are loaded.
+        self.cache_dir = cache_dir
+        self.cache: cache.CacheBackend = cache.ShardedCache(cache_dir)
+
+        self.settings: Dict[str, Any] = {
             "directory": data_dir,
             "backlog_limit": 1,
             "use_title_as_filename": False,
             "set_tags": False,
+            "cache_backend": "msgpack",
+            "cache_compression": None,
+            "update_interval": 60,
+            "metrics_textfile": None,
+            "metrics_port": None,
+            "lease_seconds": lock.DEFAULT_LEASE_SECONDS,
+            "archive_feeds": False,
+            "keep_entries": None,
         }
 
         self.state_loaded = False
         self.subscriptions: List[subscription.Subscription] = []
 
+        # While running a batch, saves are put off until the batch is done.
+        # Subscriptions to save then, or None to save every loaded feed state.
+        self._batching = False
+        self._batch_changed: Optional[List[subscription.Subscription]] = []
+
+        # Other processes may share the cache directory. Writes to the cache are locked, and
+        # subscriptions are leased while being updated so only one process updates each.
+        self.cache_lock = lock.FileLock(os.path.join(cache_dir, CACHE_LOCK_FILENAME), "cache")
+        self.leases: Optional[lock.LeaseManager] = None
+
+        # Cache stamp after our last load or save, and the stamp each subscription was last known
+        # to match the cache at, to notice when another process has saved newer state.
+        self._cache_stamp: Any = None
+        self._synced: Dict[str, Any] = {}
+
         # This map is used to match user subs to cache subs, in case names or URLs (but not both)
         # have changed.
-        self.cache_map: Dict[str, Dict[str, subscription.Subscription]] = {
+        # Cached subs are only decoded once they're matched.
+        self.cache_map: Dict[str, Dict[str, subscription.LazySubscription]] = {
             "by_name": {},
             "by_url": {},
         }
 
     # "Public" functions.
+    @profiling.traced_phase("load_state")
     def load_state(self) -> None:
         """Load config file, and load subscription cache if we haven't yet."""
         try:
             self._load_user_settings()
         except error.MalformedConfigError as e:
-            LOG.error(f"Error loading user settings: {e}")
+            LOG.error("Error loading user settings: %s", e)
             raise
 
         try:
+            self.cache = cache.get_backend(self.settings["cache_backend"], self.cache_dir,
+                                           compression=self.settings["cache_compression"])
+            LOG.debug("Using cache '%s'.", self.cache.location)
             self._load_cache_settings()
         except error.MalformedConfigError as e:
-            LOG.error(f"Error loading cache settings: {e}")
+            LOG.error("Error loading cache settings: %s", e)
             raise
 
-        if self.subscriptions != []:
-            # Iterate through subscriptions to merge user settings and cache.
-            subs = []
-            for sub in self.subscriptions:
-
-                # Items we want to use to look up subs in maps.
-                name = sub.metadata["name"]
-                url = sub.url
-
-                # Items where we want to favor user settings over cache settings.
-                directory = sub.directory
-                settings = sub.settings
-                metadata = sub.metadata
-
-                # Match cached sub to current sub and take its settings.
-                # If the user has changed either we can still match the sub and update settings
-                # correctly.
-                # If they update neither, there's nothing we can do.
-                if name in self.cache_map["by_name"]:
-                    LOG.debug(f"Found sub with name '{name}' in cached subscriptions, merging.")
-                    sub = self.cache_map["by_name"][name]
+        self._merge_cache()
+        _configure_feed_archive(self.cache_dir, self.settings["archive_feeds"],
+                                self.settings["cache_compression"])
 
-                elif url in self.cache_map["by_url"]:
-                    LOG.debug(f"Found sub with url '{url}' in cached subscriptions, merging.")
-                    sub = self.cache_map["by_url"][url]
-
-                sub.update(directory=directory, name=name, url=url, set_original=True,
-                           config_dir=self.settings["directory"], settings=settings,
-                           metadata=metadata
-                          )
-
-                sub.default_missing_fields(self.settings)
-
-                subs.append(sub)
-
-            self.subscriptions = subs
+        self._cache_stamp = self.cache.stamp()
+        self._synced = {sub.metadata["name"]: self._cache_stamp for sub in self.subscriptions}
 
         LOG.debug("Successful load.")
         self.state_loaded = True
@@ -112,41 +165,71 @@ class Config(object):
 
         return subs
 
-    def update(self) -> None:
-        """Update all subscriptions once."""
+    @profiling.traced_phase("update")
+    def update(self, processes: int=1) -> None:
+        """
+        Update all subscriptions once.
+
+        :param processes: Number of worker processes to update subscriptions in. Subscriptions
+            are updated one at a time in this process if this is 1.
+        """
         _ensure_loaded(self)
 
+        if processes > 1 and len(self.subscriptions) > 1:
+            self._update_in_processes(processes)
+            return
+
         num_subs = len(self.subscriptions)
         for i, sub in enumerate(self.subscriptions):
-            LOG.info(f"Working on sub number {i+1}/{num_subs} - '{sub.metadata['name']}'")
-            update_successful = sub.attempt_update()
+            LOG.info("Working on sub number %s/%s - '%s'", i+1, num_subs, sub.metadata['name'])
+            with self.leased(sub) as leased_sub:
+                if leased_sub is None:
+                    LOG.info("Skipping sub '%s', another process is updating it.\n",
+                             sub.metadata['name'])
+                    continue
 
-            if update_successful:
-                LOG.info(f"Updated sub '{sub.metadata['name']}' successfully.\n")
-            else:
-                LOG.info(f"Unsuccessful update for sub '{sub.metadata['name']}'.\n")
+                sub = leased_sub
+                with trace.span("update", "subscription", subscription=sub.metadata["name"]):
+                    update_successful = sub.attempt_update()
 
-            self.subscriptions[i] = sub
-            self.save_cache()
+                if update_successful:
+                    LOG.info("Updated sub '%s' successfully.\n", sub.metadata['name'])
+                else:
+                    LOG.info("Unsuccessful update for sub '%s'.\n", sub.metadata['name'])
+
+                self.subscriptions[i] = sub
+                self.save_cache([sub])
 
     def list(self) -> None:
         """Load state and list subscriptions."""
         _ensure_loaded(self)
 
         num_subs = len(self.subscriptions)
-        LOG.info(f"{num_subs} subscriptions loaded.")
+        LOG.info("%s subscriptions loaded.", num_subs)
         for i, sub in enumerate(self.subscriptions):
             LOG.info(sub.get_status(i, num_subs))
 
         LOG.debug("Load + list completed, no issues.")
 
-    def details(self, sub_index: int) -> None:
-        """Get details on one sub, including last update date and what entries we have."""
+    def details(self, sub_index: int, start: int=1, limit: Optional[int]=None,
+                as_json: bool=False) -> None:
+        """
+        Get details on one sub, including last update date and what entries we have.
+
+        :param sub_index: Index of sub.
+        :param start: First entry number to show.
+        :param limit: Most entries to show. All entries from start are shown if None.
+        :param as_json: Whether to print details to stdout as JSON, for scripts, instead of
+            logging them.
+        """
         self._validate_command(sub_index)
 
         num_subs = len(self.subscriptions)
         sub = self.subscriptions[sub_index]
-        sub.get_details(sub_index, num_subs)
+        if as_json:
+            print(json.dumps(sub.details_data(start, limit)))
+        else:
+            sub.get_details(sub_index, num_subs, start, limit)
 
         LOG.debug("Load + detail completed, no issues.")
 
@@ -161,8 +244,8 @@ class Config(object):
         sub.unmark(nums)
         enqueued_nums = sub.enqueue(nums)
 
-        LOG.info(f"Added items {enqueued_nums} to queue successfully.")
-        self.save_cache()
+        LOG.info("Added items %s to queue successfully.", enqueued_nums)
+        self.save_cache([sub])
 
     def mark(self, sub_index: int, nums: List[int]) -> None:
         """Mark items as downloaded by a subscription."""
@@ -171,8 +254,8 @@ class Config(object):
         sub = self.subscriptions[sub_index]
         marked_nums = sub.mark(nums)
 
-        LOG.info(f"Marked items {marked_nums} as downloaded successfully.")
-        self.save_cache()
+        LOG.info("Marked items %s as downloaded successfully.", marked_nums)
+        self.save_cache([sub])
 
     def unmark(self, sub_index: int, nums: List[int]) -> None:
         """Unmark items as downloaded by a subscription."""
@@ -181,8 +264,8 @@ class Config(object):
         sub = self.subscriptions[sub_index]
         unmarked_nums = sub.unmark(nums)
 
-        LOG.info(f"Unmarked items {unmarked_nums} successfully.")
-        self.save_cache()
+        LOG.info("Unmarked items %s successfully.", unmarked_nums)
+        self.save_cache([sub])
 
     def summarize(self) -> None:
         """
@@ -196,7 +279,11 @@ class Config(object):
             lines.append("")
 
         # Skip subs we haven't downloaded anything for in this session.
+        # Subs whose feed state was never loaded can't have downloaded anything.
         for sub in self.subscriptions:
+            if not sub.feed_state_loaded:
+                continue
+
             summary_list = list(sub.session_summary())[0:SUMMARY_LIMIT]
             if len(summary_list) > 0:
                 lines.append(sub.metadata["name"])
@@ -218,7 +305,14 @@ class Config(object):
 
         lines.append(f"Items recently downloaded for {sub.metadata['name']}:")
 
-        summary_list = sub.full_summary()
+        # Older caches only have the last few downloads, from before there was a history.
+        history = [] if sub.cache_key is None else \
+            self.cache.load_history(shard=sub.cache_key, limit=HISTORY_LIMIT)
+        if history:
+            summary_list = [_format_download(item) for item in history]
+        else:
+            summary_list = sub.full_summary()
+
         if len(summary_list) == 0:
             lines.append("    No items downloaded.")
 
@@ -229,29 +323,476 @@ class Config(object):
 
         LOG.info("\n".join(lines))
 
+    def history(self, since: Optional[float]=None, limit: Optional[int]=HISTORY_LIMIT) -> None:
+        """
+        Show downloads across all subscriptions, newest first, from the download history.
+
+        :param since: Only show downloads at or after this time, in seconds since the epoch.
+        :param limit: Most downloads to show. All of them are shown if None.
+        """
+        _ensure_loaded(self)
+
+        history = self.cache.load_history(since=since, limit=limit)
+
+        lines = [f"{len(history)} downloads:"]
+        for item in history:
+            lines.append(f"    {_format_download(item, with_sub=True)}")
+
+        LOG.info("\n".join(lines))
+
     def download_queue(self, sub_index: int) -> None:
         """Download one sub's download queue."""
         self._validate_command(sub_index)
 
-        sub = self.subscriptions[sub_index]
-        sub.download_queue()
+        name = self.subscriptions[sub_index].metadata["name"]
+        with self.leased(self.subscriptions[sub_index]) as sub:
+            if sub is None:
+                raise error.AlreadyRunningError(f"Another process is updating sub '{name}'.")
 
-        LOG.info("Queue downloading complete, no issues.")
-        self.save_cache()
+            sub.download_queue()
+
+            LOG.info("Queue downloading complete, no issues.")
+            self.save_cache([sub])
 
-    def save_cache(self) -> None:
-        """Write current in-memory config to cache file."""
-        LOG.debug(f"Writing settings to cache file '{self.cache_file}'.")
-        with open(self.cache_file, "wb") as stream:
-            dicts = [subscription.Subscription.encode_subscription(s) for s in self.subscriptions]
-            packed = umsgpack.packb(dicts)
-            stream.write(packed)
+    def check_dirs(self) -> List[str]:
+        """
+        Make sure every subscription's directory exists and is writable.
+        Loading doesn't touch directories, so this is the way to catch bad ones before downloading.
 
-    def reload_config(self) -> None:
-        """Reload config file."""
+        :returns: Names of subscriptions with unusable directories.
+        """
+        _ensure_loaded(self)
+
+        bad_subs = []
+        for sub in self.subscriptions:
+            problem = sub.check_directory()
+            if problem is not None:
+                LOG.error("Sub '%s': %s", sub.metadata['name'], problem)
+                bad_subs.append(sub.metadata["name"])
+
+        if bad_subs:
+            LOG.error("%s subscription directories can't be used.", len(bad_subs))
+        else:
+            LOG.info("All subscription directories are usable.")
+
+        return bad_subs
+
+    @profiling.traced_phase("save_cache")
+    def save_cache(self, changed: Optional[Iterable[subscription.Subscription]]=None) -> None:
+        """
+        Write current in-memory config to cache.
+        Feed state is only written for subscriptions that had it loaded.
+
+        :param changed: Subscriptions whose feed state may have changed. If provided, only their
+            feed states (and those of subscriptions never saved before) are written, and other
+            subscriptions keep whatever another process saved for them since our last save.
+            All feed states are written otherwise.
+        """
+        if self._batching:
+            if changed is None or self._batch_changed is None:
+                self._batch_changed = None
+            else:
+                self._batch_changed.extend(changed)
+            return
+
+        LOG.debug("Writing settings to cache '%s'.", self.cache.location)
+
+        changed_ids = None if changed is None else {id(sub) for sub in changed}
+
+        self.cache_lock.acquire(CACHE_LOCK_TIMEOUT)
+        try:
+            before = self.cache.stamp()
+
+            # Index records another process saved since we last loaded or saved.
+            saved_elsewhere: Dict[str, Mapping[str, Any]] = {}
+            if changed_ids is not None and before != self._cache_stamp and self.cache.exists():
+                LOG.debug("Cache was written by another process, keeping its changes.")
+                saved_elsewhere = {record["name"]: record for record in self.cache.load_index()}
+
+            records = []
+            shards: Dict[str, Any] = {}
+            written = []
+            for sub in self.subscriptions:
+                name = sub.metadata["name"]
+                other = saved_elsewhere.get(name, None)
+                if sub.cache_key is None and other is not None:
+                    # Cached by another process first, so share its shard rather than adding one.
+                    sub.cache_key = other["shard"]
+
+                is_new = sub.cache_key is None
+                if sub.cache_key is None:
+                    sub.cache_key = cache.new_key()
+
+                is_changed = changed_ids is None or id(sub) in changed_ids
+                if not is_new and not is_changed and other is not None and \
+                        other["shard"] == sub.cache_key:
+                    records.append(other)
+                    continue
+
+                records.append(subscription.Subscription.encode_index_record(sub))
+
+                if not sub.feed_state_loaded:
+                    continue
+
+                if is_new or is_changed:
+                    shards[sub.cache_key] = sub.feed_state.as_dict()
+                    written.append(name)
+
+            history: List[Mapping[str, Any]] = []
+            recorded = []
+            for sub in self.subscriptions:
+                if sub.completed_downloads:
+                    history.extend({**item, "shard": sub.cache_key}
+                                   for item in sub.completed_downloads)
+                    recorded.append(sub)
+
+            with metrics.CACHE_SAVE_SECONDS.time(backend=self.settings["cache_backend"]), \
+                    trace.span("save_cache", "cache", shards=len(shards)):
+                self.cache.save(records, shards)
+                if history:
+                    self.cache.append_history(history)
+
+            # Kept until they're recorded, so a failed save tries them again next time.
+            for sub in recorded:
+                sub.completed_downloads = []
+
+            # Subscriptions that matched the cache before still do, unless another process
+            # wrote to it in between.
+            after = self.cache.stamp()
+            if before == self._cache_stamp:
+                for (name, stamp) in self._synced.items():
+                    if stamp == before:
+                        self._synced[name] = after
+
+            for name in written:
+                self._synced[name] = after
+
+            self._cache_stamp = after
+
+        finally:
+            self.cache_lock.release()
+
+        # Old single-file cache has been migrated, move it out of the way.
+        if os.path.isfile(self.cache_file):
+            LOG.info("Migrated old cache file '%s' to sharded cache.", self.cache_file)
+            os.replace(self.cache_file, f"{self.cache_file}.old")
+
+    @contextlib.contextmanager
+    def leased(
+            self,
+            sub: subscription.Subscription,
+    ) -> Iterator[Optional[subscription.Subscription]]:
+        """
+        Lease a subscription for the body of a with statement, so other puckfetcher processes
+        sharing the cache directory leave it alone until the body is done.
+        State another process saved for the subscription since we loaded it is picked up first.
+
+        :param sub: Subscription to lease.
+        :returns: Subscription to work on, which replaces the given one if it was reloaded.
+            None if another process holds the lease.
+        """
+        name = sub.metadata["name"]
+        leases = self._lease_manager()
+        if leases is not None and not leases.acquire(name):
+            yield None
+            return
+
+        try:
+            yield self._refresh_sub(sub)
+        finally:
+            if leases is not None:
+                leases.release(name)
+
+    @contextlib.contextmanager
+    def batched(self) -> Iterator[None]:
+        """Put off saving the cache until the body of a with statement is done, then save once."""
+        self._batching = True
+        self._batch_changed = []
+        try:
+            yield
+        finally:
+            self._batching = False
+            if self._batch_changed is None or self._batch_changed:
+                self.save_cache(self._batch_changed)
+            self._batch_changed = []
+
+    def batch(self, lines: Iterable[str]) -> int:
+        """
+        Run commands non-interactively, one per line, saving the cache once at the end.
+        Lines look like 'enqueue "Some Podcast" 1-40' or 'mark 3 3,5'. Subscriptions are given
+        by name or by their number in the list command. Blank lines and lines starting with '#'
+        are skipped.
+
+        :param lines: Commands to run.
+        :returns: Number of lines that failed. Other lines still run.
+        """
+        _ensure_loaded(self)
+
+        failures = 0
+        with self.batched():
+            for (line_num, line) in enumerate(lines, start=1):
+                try:
+                    words = shlex.split(line, comments=True)
+                except ValueError as exception:
+                    LOG.error("Line %s: can't parse '%s': %s", line_num, line.strip(), exception)
+                    failures += 1
+                    continue
+
+                if not words:
+                    continue
+
+                try:
+                    self._run_batch_command(words)
+                except error.PuckError as exception:
+                    LOG.error("Line %s: %s", line_num, exception.desc)
+                    failures += 1
+
+        LOG.info("Batch complete, %s commands failed.", failures)
+        return failures
+
+    def daemon(self) -> None:
+        """
+        Keep running, updating each subscription on its own interval, until told to stop.
+        See the daemon module.
+        """
+        _ensure_loaded(self)
+
+        daemon.Daemon(self).run()
+
+    def write_metrics(self) -> None:
+        """Write metrics to the textfile named in the config file, if there is one."""
+        path = self.settings["metrics_textfile"]
+        if path is None:
+            return
+
+        try:
+            metrics.REGISTRY.write_textfile(util.expand(path))
+        except OSError as exception:
+            LOG.error("Unable to write metrics to '%s': %s", path, exception)
+
+    def reload_config(self) -> "ReloadResult":
+        """
+        Reload config file, applying only what changed.
+        Subscriptions whose config is unchanged keep their in-memory state untouched.
+        Subscriptions are matched to the old ones by name, or by URL if the name changed.
+
+        :returns: Names of added, removed and modified subscriptions.
+        """
+        if not self.state_loaded:
+            self.load_state()
+            return ReloadResult(added=self.get_subs(), removed=[], modified=[])
+
+        old_subs = self.subscriptions
+        old_settings = dict(self.settings)
+        old_backend = (self.settings["cache_backend"], self.settings["cache_compression"])
+
+        # Replaces subscriptions with fresh ones from the config file.
+        try:
+            self._load_user_settings()
+        except error.MalformedConfigError:
+            self.subscriptions = old_subs
+            self.settings = old_settings
+            raise
+
+        _configure_feed_archive(self.cache_dir, self.settings["archive_feeds"],
+                                self.settings["cache_compression"])
+
+        if (self.settings["cache_backend"], self.settings["cache_compression"]) != old_backend:
+            LOG.info("Cache settings changed, reloading everything.")
+            self.subscriptions = old_subs
+            self.save_cache()
+            self.load_state()
+            return ReloadResult(added=self.get_subs(),
+                                removed=[sub.metadata["name"] for sub in old_subs],
+                                modified=[])
+
+        by_name = {sub.metadata["name"]: sub for sub in old_subs}
+        by_url = {sub.original_url: sub for sub in old_subs}
+
+        result = ReloadResult(added=[], removed=[], modified=[])
+        kept = set()
+        subs = []
+        for user_sub in self.subscriptions:
+            old_sub = by_name.get(user_sub.metadata["name"], by_url.get(user_sub.original_url))
+            if old_sub is None or id(old_sub) in kept:
+                # Might still have cached state from before it was removed from the config file.
+                subs.append(self._merge_sub(user_sub))
+                result.added.append(user_sub.metadata["name"])
+                continue
+
+            kept.add(id(old_sub))
+
+            # Resolve the new config the same way loading does, so unchanged subs compare equal.
+            user_sub.update(directory=user_sub.directory, config_dir=self.settings["directory"])
+            user_sub.default_missing_fields(self.settings)
+
+            if _config_changed(old_sub, user_sub):
+                old_sub.update(directory=user_sub.directory, name=user_sub.metadata["name"],
+                               url=user_sub.url, set_original=True,
+                               config_dir=self.settings["directory"], settings=user_sub.settings,
+                               metadata=user_sub.metadata)
+                result.modified.append(old_sub.metadata["name"])
+
+            subs.append(old_sub)
+
+        result.removed.extend(sub.metadata["name"] for sub in old_subs if id(sub) not in kept)
+        self.subscriptions = subs
+
+        LOG.info("Reloaded - %s added, %s removed, %s modified.",
+                 len(result.added), len(result.removed), len(result.modified))
+
+        if result.added or result.removed or result.modified:
+            self.save_cache(changed=[])
+
+        return result
+
+    def migrate_cache(self) -> None:
+        """
+        Copy cached subscriptions from whichever other cache backend has them into the backend
+        selected in the config file.
+        """
+        _ensure_loaded(self)
+
+        target = self.cache
+        sources = [cache.get_backend(name, self.cache_dir) for name in cache.BACKENDS
+                   if name != self.settings["cache_backend"]]
+        sources = [source for source in sources if source.exists()]
+        if len(sources) == 0:
+            LOG.info("No other cache to migrate into '%s'.", target.location)
+            return
+
+        source = sources[0]
+        LOG.info("Migrating cache '%s' to '%s'.", source.location, target.location)
+
+        self.cache = source
+        self._load_cache_settings()
+        self._merge_cache()
+
+        # Pull every feed state into memory so all of it gets written to the new backend.
+        for sub in self.subscriptions:
+            sub.feed_state
+
+        self.cache = target
         self.save_cache()
-        self.load_state()
-        LOG.info("Reloaded")
+
+        # History is append-only, so it's only copied into a target that has none yet.
+        with self.cache_lock:
+            if not target.load_history(limit=1):
+                target.append_history(list(reversed(source.load_history())))
+
+        LOG.info("Migrated %s subscriptions.", len(self.subscriptions))
+
+    def import_opml(self, opml_file: str, threads: int=PROBE_THREADS) -> List[ImportResult]:
+        """
+        Subscribe to every feed in an OPML file that isn't subscribed to already.
+        New feeds are fetched concurrently to follow redirects, check they parse, and settle how
+        much backlog to download, so the next update only has to download. Feeds that fail are
+        left out. Everything else is added to the config file and the cache in one go.
+
+        :param opml_file: OPML file to import.
+        :param threads: Most feeds to fetch at once.
+        :returns: What happened to each feed, in the order the file lists them.
+        """
+        _ensure_loaded(self)
+
+        names = {sub.metadata["name"] for sub in self.subscriptions}
+        urls = {url for sub in self.subscriptions for url in [sub.url, sub.original_url]}
+
+        results: List[Optional[ImportResult]] = []
+        new_subs: List[Tuple[int, subscription.Subscription]] = []
+        for outline in opml.iter_feeds(opml_file):
+            if outline.url in urls:
+                results.append(ImportResult(outline.name, outline.url, False,
+                                            "already subscribed"))
+                continue
+
+            name = _unique_name(outline.name, names)
+            names.add(name)
+            urls.add(outline.url)
+
+            sub = subscription.Subscription.parse_from_user_yaml({"name": name,
+                                                                  "url": outline.url},
+                                                                 self.settings)
+            sub.update(directory=sub.directory, config_dir=self.settings["directory"])
+            sub.default_missing_fields(self.settings)
+
+            new_subs.append((len(results), sub))
+            results.append(None)
+
+        LOG.info("Checking %s new feeds, %s at a time.", len(new_subs), threads)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads,
+                                                   thread_name_prefix="probe") as executor:
+            problems = list(executor.map(_probe_feed, [sub for (_, sub) in new_subs]))
+
+        imported = []
+        for ((position, sub), problem) in zip(new_subs, problems):
+            if problem is not None:
+                results[position] = ImportResult(sub.metadata["name"], sub.original_url, False,
+                                                 problem)
+                continue
+
+            detail = f"{len(sub.feed_state.entries)} entries, " \
+                f"{len(sub.feed_state.entries) - sub.latest()} to download"
+            if sub.url != sub.original_url:
+                detail += f", moved from {sub.original_url}"
+                sub.original_url = sub.url
+
+            results[position] = ImportResult(sub.metadata["name"], sub.url, True, detail)
+            imported.append(sub)
+
+        if imported:
+            _append_config_subscriptions(self.config_file,
+                                         [{"name": sub.metadata["name"], "url": sub.url}
+                                          for sub in imported])
+            self.subscriptions.extend(imported)
+            self.save_cache(imported)
+
+        final_results = [result for result in results if result is not None]
+        for result in final_results:
+            LOG.info("%s '%s' (%s): %s.", "Imported" if result.imported else "Skipped",
+                     result.name, result.url, result.detail)
+
+        LOG.info("Imported %s of %s feeds from '%s'.", len(imported), len(final_results),
+                 opml_file)
+        return final_results
+
+    def reparse(self) -> List[str]:
+        """
+        Rebuild subscription entries from archived feeds, without fetching anything.
+        Download state is kept, only the entries parsed from each feed are replaced.
+
+        :returns: Names of subscriptions reparsed.
+        :raises BadCommandError: If feeds aren't being archived.
+        """
+        _ensure_loaded(self)
+
+        archive = fetch.get_service().archive
+        if archive is None:
+            raise error.BadCommandError("Feeds aren't archived, set 'archive_feeds' to reparse.")
+
+        reparsed = []
+        for sub in self.subscriptions:
+            with self.leased(sub) as leased_sub:
+                if leased_sub is None:
+                    LOG.info("Skipping sub '%s', another process is updating it.",
+                             sub.metadata["name"])
+                    continue
+
+                body = archive.load(leased_sub.metadata["name"])
+                if body is None:
+                    LOG.info("No archived feed for sub '%s'.", leased_sub.metadata["name"])
+                    continue
+
+                leased_sub.feed_state.load_rss_info(fetch.parse(body))
+                leased_sub.compact_entries()
+                LOG.info("Reparsed sub '%s', %s entries.", leased_sub.metadata["name"],
+                         len(leased_sub.feed_state.entries))
+                reparsed.append(leased_sub)
+
+        if reparsed:
+            self.save_cache(reparsed)
+
+        return [sub.metadata["name"] for sub in reparsed]
 
     # "Private" functions (messy internals).
     def _validate_list_command(self, sub_index: int, nums: List[int]) -> None:
@@ -260,6 +801,99 @@ class Config(object):
 
         self._validate_command(sub_index)
 
+    def _update_in_processes(self, processes: int) -> None:
+        """
+        Update subscriptions in worker processes, sidestepping the GIL for parsing and tagging.
+        Workers load feed states from the cache themselves and send back what the update
+        changed, which is merged here and saved as each subscription finishes.
+        """
+        with contextlib.ExitStack() as held_leases:
+            jobs = []
+            for (i, sub) in enumerate(self.subscriptions):
+                # Leased for the whole run, since workers can't renew leases.
+                leased_sub = held_leases.enter_context(self.leased(sub))
+                if leased_sub is None:
+                    LOG.info("Skipping sub '%s', another process is updating it.",
+                             sub.metadata['name'])
+                    continue
+
+                if leased_sub.feed_state_loaded or leased_sub.cache_key is None:
+                    record = subscription.Subscription.encode_subscription(leased_sub)
+                else:
+                    record = subscription.Subscription.encode_index_record(leased_sub)
+                jobs.append((i, record, self.settings["cache_backend"], self.cache_dir,
+                             self.settings["cache_compression"], self.settings["archive_feeds"]))
+
+            if jobs:
+                self._run_update_jobs(jobs, processes)
+
+    def _run_update_jobs(self, jobs: List[Tuple[Any, ...]], processes: int) -> None:
+        """Run update jobs for _update_worker in a pool of processes, and apply the results."""
+        import multiprocessing
+
+        LOG.info("Updating %s subscriptions in %s processes.", len(jobs), processes)
+
+        # Spawned rather than forked, so workers don't inherit locks held by this process's
+        # threads (like the log writer).
+        context = multiprocessing.get_context("spawn")
+        (log_queue, listener) = logs.start_process_logging(LOG, context)
+        try:
+            with context.Pool(processes, logs.init_worker_logging,
+                              (log_queue, LOG.getEffectiveLevel())) as pool:
+                for (i, update_successful, result) in pool.imap_unordered(_update_worker, jobs):
+                    sub = self.subscriptions[i]
+                    sub.apply_update_result(result)
+
+                    if update_successful:
+                        LOG.info("Updated sub '%s' successfully.\n", sub.metadata['name'])
+                    else:
+                        LOG.info("Unsuccessful update for sub '%s'.\n", sub.metadata['name'])
+
+                    self.save_cache([sub])
+
+                # Leaving the with statement terminates workers, which can kill one while it
+                # holds the log queue's lock. Joining lets them flush their logs and exit first.
+                pool.close()
+                pool.join()
+        finally:
+            listener.stop()
+
+    def _run_batch_command(self, words: List[str]) -> None:
+        (command, args) = (words[0], words[1:])
+        if command not in BATCH_COMMANDS:
+            raise error.BadCommandError(f"Unknown batch command '{command}', expected one of "
+                                        f"{', '.join(BATCH_COMMANDS)}.")
+
+        if len(args) < 1:
+            raise error.BadCommandError(f"'{command}' needs a subscription.")
+
+        sub_index = self._find_sub(args[0])
+        if command in ["details", "download_queue", "summarize_sub"]:
+            getattr(self, command)(sub_index)
+            return
+
+        try:
+            nums = util.parse_int_string(" ".join(args[1:]))
+        except ValueError:
+            raise error.BadCommandError(f"Can't understand entry numbers '{' '.join(args[1:])}'.")
+
+        getattr(self, command)(sub_index, nums)
+
+    def _find_sub(self, name: str) -> int:
+        """Find a subscription by name (case-insensitively if needed) or one-indexed number."""
+        names = [sub.metadata["name"] for sub in self.subscriptions]
+        if name in names:
+            return names.index(name)
+
+        lower_names = [sub_name.lower() for sub_name in names]
+        if name.lower() in lower_names:
+            return lower_names.index(name.lower())
+
+        if name.isdigit() and 1 <= int(name) <= len(names):
+            return int(name) - 1
+
+        raise error.BadCommandError(f"No subscription called '{name}'.")
+
     def _validate_command(self, sub_index: int) -> None:
         if sub_index < 0 or sub_index > len(self.subscriptions):
             raise error.BadCommandError(f"Invalid sub index {sub_index}.")
@@ -267,29 +901,143 @@ class Config(object):
         _ensure_loaded(self)
 
     def _load_cache_settings(self) -> None:
-        """Load settings from cache to self.cached_settings."""
-        _ensure_file(self.cache_file)
+        """
+        Load subscriptions from cache into self.cache_map.
+        Only the cache index is read here, feed states are loaded when they're needed.
+        Cached subscriptions that can't match any subscription from the config file are skipped
+        without being decoded.
+        """
+        self.cache_map = {"by_name": {}, "by_url": {}}
+
+        names = {sub.metadata["name"] for sub in self.subscriptions}
+        urls = {sub.url for sub in self.subscriptions}
+
+        def _wanted(peeked: Mapping[str, Any]) -> bool:
+            return peeked.get("name") in names or peeked.get("original_url") in urls
+
+        encoded_subs: List[Tuple[Mapping[str, Any], Optional[Callable[[], Any]]]]
+        if self.cache.exists():
+            encoded_subs = [
+                (record, self.cache.shard_loader(record["shard"]))
+                for record in self.cache.load_index(_wanted)
+            ]
+
+        else:
+            for name in cache.BACKENDS:
+                if name != self.settings["cache_backend"] and \
+                        cache.get_backend(name, self.cache_dir).exists():
+                    LOG.warning("Found a '%s' cache but the '%s' "
+                                "cache backend is selected. Run the "
+                                "'%s' command to bring it over.",
+                                name, self.settings['cache_backend'], Command.migrate_cache.name)
+
+            encoded_subs = [(encoded_sub, None) for encoded_sub in self._load_old_cache(_wanted)]
+
+        for (encoded_sub, loader) in encoded_subs:
+            lazy_sub = subscription.LazySubscription(encoded_sub, feed_state_loader=loader)
+            if lazy_sub.name is None:
+                LOG.debug("Encountered cached subscription with no name, skipping it.")
+                continue
 
-        with open(self.cache_file, "rb") as stream:
-            LOG.debug("Opening subscription cache to retrieve subscriptions.")
-            data = stream.read()
+            self.cache_map["by_name"][lazy_sub.name] = lazy_sub
+            if lazy_sub.original_url is not None:
+                self.cache_map["by_url"][lazy_sub.original_url] = lazy_sub
 
-        if data == b"":
-            LOG.debug("Received empty string from cache.")
-            return
+    def _load_old_cache(self, wanted: cache.Wanted) -> List[Mapping[str, Any]]:
+        """Load encoded subscriptions from the old single-file cache, if there is one."""
+        if os.path.exists(self.cache_file) and not os.path.isfile(self.cache_file):
+            LOG.debug("Given file %s exists but isn't a file.", self.cache_file)
+            raise error.MalformedConfigError(
+                f"Given file {self.cache_file} exists but isn't a file.")
+
+        LOG.debug("Opening old subscription cache to retrieve subscriptions.")
+        return [cache.migrate_record(record)
+                for record in cache.iter_packed_records(self.cache_file, wanted)]
 
-        for encoded_sub in umsgpack.unpackb(data):
+    def _merge_cache(self) -> None:
+        """Merge subscriptions from user settings with matching subscriptions from the cache."""
+        if self.subscriptions != []:
+            # Iterate through subscriptions to merge user settings and cache.
+            self.subscriptions = [self._merge_sub(sub) for sub in self.subscriptions]
+
+    def _lease_manager(self) -> Optional[lock.LeaseManager]:
+        """Provide lease manager, or None if leases are turned off."""
+        if self.settings["lease_seconds"] is None:
+            return None
+
+        if self.leases is None:
+            self.leases = lock.LeaseManager(os.path.join(self.cache_dir, LEASE_DIRNAME),
+                                            float(self.settings["lease_seconds"]))
+
+        return self.leases
+
+    def _refresh_sub(self, sub: subscription.Subscription) -> subscription.Subscription:
+        """Reload a subscription from the cache if another process saved it since we did."""
+        name = sub.metadata["name"]
+        stamp = self.cache.stamp()
+        if self._batching or stamp is None or self._synced.get(name, None) == stamp:
+            return sub
+
+        records = self.cache.load_index(lambda peeked: peeked.get("name") == name)
+        self._synced[name] = stamp
+        if not records:
+            return sub
+
+        LOG.debug("Reloading sub '%s', the cache has changed since it was loaded.", name)
+        lazy_sub = subscription.LazySubscription(
+            records[0], feed_state_loader=self.cache.shard_loader(records[0]["shard"]))
+        self.cache_map["by_name"][name] = lazy_sub
+        if lazy_sub.original_url is not None:
+            self.cache_map["by_url"][lazy_sub.original_url] = lazy_sub
+
+        refreshed = self._merge_sub(sub)
+        for (i, old_sub) in enumerate(self.subscriptions):
+            if old_sub is sub:
+                self.subscriptions[i] = refreshed
+
+        return refreshed
+
+    def _merge_sub(self, sub: subscription.Subscription) -> subscription.Subscription:
+        """Merge one subscription from user settings with its match from the cache, if any."""
+        # Items we want to use to look up subs in maps.
+        name = sub.metadata["name"]
+        url = sub.url
+
+        # Items where we want to favor user settings over cache settings.
+        directory = sub.directory
+        settings = sub.settings
+        metadata = sub.metadata
+
+        # Match cached sub to current sub and take its settings.
+        # If the user has changed either we can still match the sub and update settings
+        # correctly.
+        # If they update neither, there's nothing we can do.
+        lazy_sub = None
+        if name in self.cache_map["by_name"]:
+            LOG.debug("Found sub with name '%s' in cached subscriptions, merging.", name)
+            lazy_sub = self.cache_map["by_name"][name]
+
+        elif url in self.cache_map["by_url"]:
+            LOG.debug("Found sub with url '%s' in cached subscriptions, merging.", url)
+            lazy_sub = self.cache_map["by_url"][url]
+
+        if lazy_sub is not None:
             try:
-                decoded_sub = subscription.Subscription.decode_subscription(encoded_sub)
+                sub = lazy_sub.decode()
 
             except error.MalformedSubscriptionError as exception:
                 LOG.debug("Encountered error in subscription decoding:")
                 LOG.debug(exception.desc)
-                LOG.debug("Skipping this sub.")
-                continue
+                LOG.debug("Using subscription from config file only.")
+
+        sub.update(directory=directory, name=name, url=url, set_original=True,
+                   config_dir=self.settings["directory"], settings=settings,
+                   metadata=metadata
+                  )
+
+        sub.default_missing_fields(self.settings)
 
-            self.cache_map["by_name"][decoded_sub.metadata["name"]] = decoded_sub
-            self.cache_map["by_url"][decoded_sub.original_url] = decoded_sub
+        return sub
 
     def _load_user_settings(self) -> None:
         """Load user settings from config file."""
@@ -299,10 +1047,12 @@ class Config(object):
 
         with open(self.config_file, "r", encoding=constants.ENCODING) as stream:
             LOG.debug("Opening config file to retrieve settings.")
-            yaml_settings = yaml.safe_load(stream)
+            yaml_settings = yaml.load(stream, Loader=YAML_LOADER)
 
-        pretty_settings = yaml.dump(yaml_settings, width=1, indent=4)
-        LOG.debug(f"Settings retrieved from user config file: {pretty_settings}")
+        # Dumping settings again is only worth it if anyone will see them.
+        if LOG.isEnabledFor(logging.DEBUG):
+            pretty_settings = yaml.dump(yaml_settings, width=1, indent=4)
+            LOG.debug("Settings retrieved from user config file: %s", pretty_settings)
 
         if yaml_settings is not None:
             # Process valid settings. Ignore garbage if the user gave it to us.
@@ -310,7 +1060,7 @@ class Config(object):
                 if name == "subscriptions":
                     pass
                 elif name not in self.settings:
-                    LOG.debug(f"Setting {name} is not a valid setting, ignoring.")
+                    LOG.debug("Setting %s is not a valid setting, ignoring.", name)
                 else:
                     self.settings[name] = value
 
@@ -319,7 +1069,7 @@ class Config(object):
                 sub = subscription.Subscription.parse_from_user_yaml(yaml_sub, self.settings)
 
                 if sub is None:
-                    LOG.debug(f"Unable to parse user YAML for sub #{i+1} - something is wrong.")
+                    LOG.debug("Unable to parse user YAML for sub #%s - something is wrong.", i+1)
                     fail_count += 1
                     continue
 
@@ -352,8 +1102,24 @@ def get_commands() -> Mapping[Any, str]:
          "Summarize subscription entries downloaded in this session."),
         (Command.summarize_sub,
          "Summarize recent entries downloaded for a specific sub."),
+        (Command.history,
+         "Show downloads across all subscriptions, newest first."),
+        (Command.batch,
+         "Run commands from a file or stdin, one per line, saving the cache once at the end. "
+         "Lines look like 'enqueue \"Some Podcast\" 1-40' or 'mark \"Some Podcast\" 3,5'."),
+        (Command.import_opml,
+         "Subscribe to the feeds in an OPML file, checking them all first. Only feeds that can "
+         "be fetched are added to the config file."),
+        (Command.reparse,
+         "Rebuild subscription entries from archived feeds, without fetching them. Needs "
+         "'archive_feeds' on."),
         (Command.reload_config,
          "Reload configuration file."),
+        (Command.migrate_cache,
+         "Copy cached subscriptions from another cache backend into the configured one."),
+        (Command.daemon,
+         "Keep running and update each subscription every 'update_interval' minutes. Stops on "
+         "SIGTERM or Ctrl-C."),
     ))
 
 def get_command_help() -> str:
@@ -365,6 +1131,139 @@ def get_command_help() -> str:
     return "\n".join(command_help_list)
 
 
+def _config_changed(old_sub: subscription.Subscription,
+                    new_sub: subscription.Subscription) -> bool:
+    """Check whether the user-configurable parts of a subscription differ."""
+    return (old_sub.original_url != new_sub.original_url or
+            old_sub.directory != new_sub.directory or
+            old_sub.settings != new_sub.settings or
+            old_sub.metadata != new_sub.metadata)
+
+
+def _configure_feed_archive(cache_dir: str, archive_feeds: bool,
+                            compression: Optional[str]) -> None:
+    """Archive fetched feeds in the cache dir, or stop archiving them."""
+    service = fetch.get_service()
+    if archive_feeds:
+        service.archive = fetch.FeedArchive(os.path.join(cache_dir, FEED_ARCHIVE_DIRNAME),
+                                            compression or fetch.DEFAULT_ARCHIVE_COMPRESSION)
+    else:
+        service.archive = None
+
+
+def _update_worker(job: Tuple[int, Mapping[str, Any], str, str, Optional[str], bool]
+                   ) -> Tuple[int, bool, Mapping[str, Any]]:
+    """Update one subscription in a worker process, loading its feed state from the cache."""
+    (i, record, backend_name, cache_dir, compression, archive_feeds) = job
+    _configure_feed_archive(cache_dir, archive_feeds, compression)
+
+    if "feed_state" in record:
+        sub = subscription.Subscription.decode_subscription(record)
+    else:
+        backend = cache.get_backend(backend_name, cache_dir, compression=compression)
+        sub = subscription.Subscription.decode_subscription(
+            record, feed_state_loader=backend.shard_loader(record["shard"]))
+
+    LOG.info("Working on sub number %s - '%s'", i + 1, sub.metadata["name"])
+    update_successful = sub.attempt_update()
+
+    return (i, update_successful, subscription.Subscription.encode_update_result(sub))
+
+
+def _format_download(item: Mapping[str, Any], with_sub: bool=False) -> str:
+    """Describe one download from the history on a single line."""
+    when = datetime.datetime.fromtimestamp(item["time"]).strftime("%Y-%m-%d %H:%M")
+    size = "unknown size" if item.get("bytes") is None else f"{item['bytes'] / 1e6:.1f} MB"
+    sub = f"{item['subscription']} - " if with_sub else ""
+    return f"{when} {sub}{item['title']} (#{item['number']}, {size}, {item['seconds']:.1f}s)"
+
+
+def _probe_feed(sub: subscription.Subscription) -> Optional[str]:
+    """Fetch a new subscription's feed and settle its backlog. Provide the problem, if any."""
+    # One bad feed shouldn't stop the rest of the file being imported.
+    try:
+        result = sub.get_feed()
+        if result not in (subscription.UpdateResult.SUCCESS, subscription.UpdateResult.UNNEEDED):
+            return "feed couldn't be fetched or parsed"
+
+        if not sub.apply_backlog_limit():
+            return f"invalid backlog limit {sub.settings['backlog_limit']}"
+
+        sub.compact_entries()
+
+    except Exception as exception:
+        LOG.debug("Error checking feed for '%s'.", sub.metadata["name"], exc_info=True)
+        return f"error checking feed: {exception}"
+
+    return None
+
+
+def _unique_name(name: str, taken: Iterable[str]) -> str:
+    """Provide name, with a number added if it's taken already."""
+    candidate = name
+    count = 1
+    while candidate in taken:
+        count += 1
+        candidate = f"{name} ({count})"
+
+    return candidate
+
+
+def _append_config_subscriptions(config_file: str, entries: List[Mapping[str, Any]]) -> None:
+    """
+    Add subscriptions to the config file.
+    New entries go after the existing subscriptions, keeping everything else (comments
+    included) as it was. If the subscriptions aren't a plain list, the file is rewritten instead.
+    """
+    with open(config_file, "r", encoding=constants.ENCODING) as stream:
+        text = stream.read()
+
+    root = yaml.compose(text, Loader=YAML_LOADER)
+    subs_node = None
+    if isinstance(root, yaml.MappingNode):
+        for (key_node, value_node) in root.value:
+            if key_node.value == "subscriptions":
+                subs_node = value_node
+
+    items = yaml.safe_dump(list(entries), default_flow_style=False, allow_unicode=True)
+
+    if subs_node is None and (root is None or isinstance(root, yaml.MappingNode)):
+        if text and not text.endswith("\n"):
+            text += "\n"
+        text += "subscriptions:\n" + _indent(items, 4)
+
+    elif isinstance(subs_node, yaml.SequenceNode) and not subs_node.flow_style and \
+            subs_node.value:
+        # Insert after the last line with content in the last subscription. The node's own end
+        # is past any comments and blank lines that follow it.
+        last = subs_node.value[-1]
+        while isinstance(last, yaml.CollectionNode) and last.value:
+            last = last.value[-1][1] if isinstance(last, yaml.MappingNode) else last.value[-1]
+
+        insert_at = text.find("\n", last.end_mark.index)
+        insert_at = len(text) if insert_at < 0 else insert_at + 1
+        prefix = "" if text[0:insert_at].endswith("\n") else "\n"
+        text = text[0:insert_at] + prefix + _indent(items, subs_node.start_mark.column) + \
+            text[insert_at:]
+
+    else:
+        LOG.warning("Subscriptions in '%s' aren't a plain list, rewriting the whole file. "
+                    "Comments in it will be lost.", config_file)
+        settings = yaml.load(text, Loader=YAML_LOADER) or {}
+        settings["subscriptions"] = list(settings.get("subscriptions") or []) + list(entries)
+        text = yaml.safe_dump(settings, default_flow_style=False, allow_unicode=True)
+
+    temp_file = f"{config_file}.tmp"
+    with open(temp_file, "w", encoding=constants.ENCODING) as stream:
+        stream.write(text)
+    os.replace(temp_file, config_file)
+
+
+def _indent(text: str, columns: int) -> str:
+    return "".join(" " * columns + line if line.strip() else line
+                   for line in text.splitlines(keepends=True))
+
+
 def _ensure_loaded(config: Config) -> None:
     if not config.state_loaded:
         LOG.debug("State not loaded from config file and cache - loading!")
@@ -373,12 +1272,11 @@ def _ensure_loaded(config: Config) -> None:
 
 def _ensure_file(file_path: str) -> None:
     if os.path.exists(file_path) and not os.path.isfile(file_path):
-        msg = f"Given file {file_path} exists but isn't a file."
-        LOG.debug(msg)
-        raise error.MalformedConfigError(msg)
+        LOG.debug("Given file %s exists but isn't a file.", file_path)
+        raise error.MalformedConfigError(f"Given file {file_path} exists but isn't a file.")
 
     elif not os.path.isfile(file_path):
-        LOG.debug(f"Creating empty file at '{file_path}'.")
+        LOG.debug("Creating empty file at '%s'.", file_path)
 
         try:
             open(file_path, "a", encoding=constants.ENCODING).close()
@@ -412,3 +1310,9 @@ class Command(enum.Enum):
     unmark = 800
     download_queue = 900
     reload_config = 1000
+    migrate_cache = 1100
+    daemon = 1200
+    history = 1300
+    batch = 1400
+    import_opml = 1500
+    reparse = 1600
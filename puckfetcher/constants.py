@@ -1,12 +1,37 @@
 """Constants used for the puckfetcher application."""
+import os
+
 import appdirs
-import pkg_resources
 
 APPDIRS = appdirs.AppDirs("puckfetcher")
 
 URL = "https://github.com/alixnovosi/puckfetcher"
 
-VERSION = pkg_resources.require(__package__)[0].version
+
+def _get_version() -> str:
+    """
+    Find our version without pkg_resources, which scans every installed package on import.
+    Use installed package metadata, falling back to the VERSION file in a source checkout.
+    """
+    try:
+        from importlib import metadata
+        return metadata.version(__package__)
+
+    # importlib.metadata is new in Python 3.8, and a source checkout isn't installed.
+    # PackageNotFoundError is an ImportError.
+    except ImportError:
+        pass
+
+    version_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "VERSION")
+    try:
+        with open(version_file, encoding="UTF-8") as stream:
+            return stream.read().strip()
+
+    except OSError:
+        return "unknown"
+
+
+VERSION = _get_version()
 
 USER_AGENT = f"{__package__}/{VERSION} +{URL}"
 
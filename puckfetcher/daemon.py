@@ -0,0 +1,247 @@
+"""
+Module for running puckfetcher as a long-lived process.
+Config and subscriptions stay in memory, and each subscription is updated on its own interval
+instead of everything being reloaded from scratch by cron.
+"""
+import heapq
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+import puckfetcher.error as error
+import puckfetcher.lock as lock
+import puckfetcher.metrics as metrics
+import puckfetcher.trace as trace
+import puckfetcher.watch as watch
+
+if TYPE_CHECKING:
+    import puckfetcher.config as config
+    import puckfetcher.subscription as subscription
+
+LOG = logging.getLogger("root")
+
+LOCK_FILENAME = "puckfetcher.lock"
+
+# Used when neither the subscription nor the config file sets an interval.
+DEFAULT_INTERVAL_MINUTES = 60
+
+
+class Daemon(object):
+    """Scheduler keeping a config's subscriptions up to date."""
+
+    def __init__(
+            self,
+            conf: "config.Config",
+            *,
+            clock: Callable[[], float]=time.monotonic,
+            watch_config: bool=True,
+    ) -> None:
+        """
+        Object constructor for daemon.
+
+        :param conf: Config to run, with state already loaded.
+        :param clock: Monotonic clock in seconds, replaceable for testing.
+        :param watch_config: Whether to reload the config file when it changes.
+        """
+        self.conf = conf
+        self.clock = clock
+        self.watch_config = watch_config
+        self.watcher: Optional[watch.FileWatcher] = None
+
+        # Set by signal handlers (or stop()). Checked between entries while downloading.
+        self.stop_event = threading.Event()
+
+        # Heap of (due time, tiebreak, subscription name). Subscriptions are looked up by name
+        # when they come due, so ones removed in the meantime are skipped.
+        self._schedule: List[Tuple[float, int, str]] = []
+        self._counter = 0
+
+        # Only one daemon per cache directory. One-off commands share it using leases.
+        self._lock = lock.FileLock(os.path.join(conf.cache_dir, LOCK_FILENAME), "daemon")
+
+    def run(self) -> None:
+        """
+        Update subscriptions as they come due until stopped.
+        Feed state is saved after every update, including one cut short on the way out.
+        """
+        self._acquire_lock()
+
+        # Set up as we go, so stopping part way through starting only undoes what was done.
+        previous_handlers: Dict[int, Any] = {}
+        metrics_server = None
+        try:
+            previous_handlers = self._install_signal_handlers()
+
+            if self.watch_config:
+                self.watcher = watch.FileWatcher(self.conf.config_file)
+
+            if self.conf.settings.get("metrics_port") is not None:
+                metrics_server = metrics.REGISTRY.serve(self.conf.settings["metrics_port"])
+
+            LOG.info("Daemon started with %s subscriptions.", len(self.conf.subscriptions))
+            for sub in self.conf.subscriptions:
+                self.schedule(sub, 0)
+
+            while not self.stop_event.is_set():
+                self.run_pending()
+
+        finally:
+            LOG.info("Daemon stopping, saving state.")
+            try:
+                # Updated subscriptions were saved as they went. Passing none keeps whatever
+                # other processes saved for them since, while still recording any added by a
+                # config reload.
+                self.conf.save_cache([])
+                self.conf.write_metrics()
+            finally:
+                if self.watcher is not None:
+                    self.watcher.close()
+                    self.watcher = None
+                if metrics_server is not None:
+                    metrics_server.shutdown()
+                    metrics_server.server_close()
+                _restore_signal_handlers(previous_handlers)
+                self._release_lock()
+
+    def run_pending(self) -> None:
+        """Wait for the next subscription to come due, then update it."""
+        self.check_reload()
+
+        if not self._schedule:
+            # Nothing to do - wait around in case a reload adds subscriptions.
+            self._wait(DEFAULT_INTERVAL_MINUTES * 60)
+            return
+
+        (due, _, name) = self._schedule[0]
+        delay = due - self.clock()
+        if delay > 0:
+            self._wait(delay)
+            return
+
+        heapq.heappop(self._schedule)
+
+        sub = self._find(name)
+        if sub is None:
+            LOG.debug("Sub '%s' is no longer configured, dropping it from the schedule.", name)
+            return
+
+        with self.conf.leased(sub) as leased_sub:
+            if leased_sub is None:
+                LOG.info("Sub '%s' is being updated by another process, trying again later.",
+                         name)
+                self.schedule(sub, self.interval(sub))
+                return
+
+            sub = leased_sub
+            LOG.info("Updating sub '%s'.", name)
+            try:
+                with trace.span("update", "subscription", subscription=name):
+                    update_successful = sub.attempt_update(self.stop_event)
+
+            finally:
+                # Checkpoint straight away (while still holding the lease), so a stop or crash
+                # loses at most the entry in flight.
+                self.conf.save_cache([sub])
+                self.conf.write_metrics()
+
+            if update_successful:
+                LOG.info("Updated sub '%s' successfully.", name)
+            else:
+                LOG.info("Unsuccessful update for sub '%s'.", name)
+
+        self.schedule(sub, self.interval(sub))
+
+    def check_reload(self) -> None:
+        """
+        Reload the config file if it changed.
+        Added subscriptions are updated straight away, removed ones drop out of the schedule when
+        they come due, and everything else carries on as it was.
+        """
+        if self.watcher is None or not self.watcher.changed():
+            return
+
+        LOG.info("Config file changed, reloading.")
+        try:
+            result = self.conf.reload_config()
+        except error.PuckError as exception:
+            LOG.error("Unable to reload config file, keeping current config: %s", exception.desc)
+            return
+
+        for name in result.added:
+            sub = self._find(name)
+            if sub is not None:
+                self.schedule(sub, 0)
+
+    def schedule(self, sub: "subscription.Subscription", delay: float) -> None:
+        """
+        Schedule a subscription to be updated.
+
+        :param sub: Subscription to update.
+        :param delay: Seconds from now to update it.
+        """
+        self._counter += 1
+        heapq.heappush(self._schedule,
+                       (self.clock() + delay, self._counter, sub.metadata["name"]))
+
+    def interval(self, sub: "subscription.Subscription") -> float:
+        """
+        Provide seconds between updates of a subscription.
+
+        :param sub: Subscription to check.
+        :returns: Update interval in seconds.
+        """
+        minutes = sub.settings.get("update_interval")
+        if minutes is None:
+            minutes = self.conf.settings.get("update_interval")
+        if minutes is None:
+            minutes = DEFAULT_INTERVAL_MINUTES
+
+        return float(minutes) * 60
+
+    def stop(self) -> None:
+        """Ask the daemon to stop once the entry being downloaded (if any) is done."""
+        self.stop_event.set()
+
+    # "Private" class functions (messy internals).
+    def _wait(self, seconds: float) -> None:
+        # Wake up regularly to notice config changes.
+        if self.watcher is not None:
+            seconds = min(seconds, self.watcher.poll_interval)
+
+        self.stop_event.wait(seconds)
+
+    def _find(self, name: str) -> Optional["subscription.Subscription"]:
+        for sub in self.conf.subscriptions:
+            if sub.metadata["name"] == name:
+                return sub
+
+        return None
+
+    def _install_signal_handlers(self) -> Dict[int, Any]:
+        # Signal handlers can only be set from the main thread.
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+
+        def _handle(signum: int, _: Any) -> None:
+            LOG.info("Received signal %s, stopping after the current download.", signum)
+            self.stop()
+
+        previous: Dict[int, Any] = {}
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            previous[signum] = signal.signal(signum, _handle)
+
+        return previous
+
+    def _acquire_lock(self) -> None:
+        self._lock.acquire(timeout=0)
+
+    def _release_lock(self) -> None:
+        self._lock.release()
+
+
+def _restore_signal_handlers(previous: Dict[int, Any]) -> None:
+    for (signum, handler) in previous.items():
+        signal.signal(signum, handler)
@@ -40,3 +40,14 @@ class MalformedSubscriptionError(PuckError):
     """
     def __init__(self, desc: str) -> None:
         super(MalformedSubscriptionError, self).__init__(desc)
+
+
+class AlreadyRunningError(PuckError):
+    """
+    Exception raised when another puckfetcher process already holds a lock we need.
+
+    Attributes:
+        desc -- short message describing error
+    """
+    def __init__(self, desc: str) -> None:
+        super(AlreadyRunningError, self).__init__(desc)
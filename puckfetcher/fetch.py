@@ -0,0 +1,284 @@
+"""
+Module for the process-wide service that fetches feeds and downloads enclosures.
+Subscriptions refer to it by name instead of each holding their own network objects, and
+nothing network-related is created until a subscription actually fetches or downloads.
+Feeds are fetched over HTTP with requests, asking for compressed responses, and only parsed by
+feedparser. The raw feed can also be kept in a compressed archive, to parse again later.
+"""
+import calendar
+import email.utils
+import hashlib
+import logging
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Callable, Dict, Mapping, Optional, TYPE_CHECKING
+
+import drewtilities as util
+
+import puckfetcher.codec as codec
+import puckfetcher.constants as constants
+
+if TYPE_CHECKING:
+    import feedparser
+    import requests
+
+HEADERS = {"User-Agent": constants.USER_AGENT}
+
+# Seconds to wait for a feed server to respond.
+FEED_TIMEOUT = 60
+
+# Archive compression, when the cache isn't compressed.
+DEFAULT_ARCHIVE_COMPRESSION = "zlib"
+
+LOG = logging.getLogger("root")
+
+Downloader = Callable[..., None]
+Parser = Callable[[str, Any, Any], Any]
+
+
+class FetchService(object):
+    """
+    Rate-limited feed parsers and downloaders, created on first use and shared by name.
+    Rate limits apply per subscription name, as before.
+    """
+
+    def __init__(self) -> None:
+        """Object constructor for fetch service. Creates no network objects."""
+        self._lock = threading.Lock()
+        self._downloaders: Dict[str, Downloader] = {}
+        self._parsers: Dict[str, Parser] = {}
+        self._session: Optional["requests.Session"] = None
+
+        # Where fetched feeds are archived, if they are.
+        self.archive: Optional[FeedArchive] = None
+
+    def downloader(self, name: str) -> Downloader:
+        """
+        Provide the enclosure downloader for a subscription.
+
+        :param name: Name of subscription, used for rate limiting and progress output.
+        :returns: Callable taking url and dest keyword arguments.
+        """
+        with self._lock:
+            if name not in self._downloaders:
+                LOG.debug("Creating downloader for %s.", name)
+                self._downloaders[name] = util.generate_downloader(HEADERS, name)
+
+            return self._downloaders[name]
+
+    def parser(self, name: str) -> Parser:
+        """
+        Provide the rate-limited feed parser for a subscription.
+
+        :param name: Name of subscription, used for rate limiting.
+        :returns: Callable taking url, etag and last_modified.
+        """
+        with self._lock:
+            if name not in self._parsers:
+                LOG.debug("Creating feed parser for %s.", name)
+                self._parsers[name] = _generate_feedparser(name, self)
+
+            return self._parsers[name]
+
+    def session(self) -> "requests.Session":
+        """
+        Provide the HTTP session feeds are fetched with, so connections to a host are reused.
+
+        :returns: Shared session.
+        """
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+
+            return self._session
+
+    def created(self) -> int:
+        """
+        Count network objects created so far.
+
+        :returns: Number of downloaders, parsers and sessions this service has created.
+        """
+        return len(self._downloaders) + len(self._parsers) + (self._session is not None)
+
+
+class FeedArchive(object):
+    """
+    Last raw body fetched for each feed, compressed, one file per subscription.
+    Lets feeds be parsed again (after an upgrade changes parsing, say) without fetching them.
+    """
+
+    def __init__(self, directory: str,
+                 compression: Optional[str]=DEFAULT_ARCHIVE_COMPRESSION) -> None:
+        """
+        Object constructor for feed archive.
+
+        :param directory: Directory to keep archived feeds in. Created when first written to.
+        :param compression: Compression for archived feeds, one of codec.COMPRESSORS.
+        """
+        self.directory = directory
+        self.compression = codec.get_compression(compression) or DEFAULT_ARCHIVE_COMPRESSION
+
+    def store(self, name: str, body: bytes) -> None:
+        """
+        Archive a feed body, replacing the one archived before.
+
+        :param name: Name of subscription.
+        :param body: Raw feed, as fetched.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(name, self.compression)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as stream:
+            stream.write(codec.compress(self.compression, body))
+        os.replace(temp_path, path)
+
+        # Archives in other compressions are older now.
+        for other in codec.COMPRESSORS:
+            if other != self.compression and os.path.isfile(self._path(name, other)):
+                os.remove(self._path(name, other))
+
+    def load(self, name: str) -> Optional[bytes]:
+        """
+        Load an archived feed body.
+
+        :param name: Name of subscription.
+        :returns: Raw feed, or None if none is archived.
+        """
+        for compression in [self.compression, *codec.COMPRESSORS]:
+            try:
+                with open(self._path(name, compression), "rb") as stream:
+                    return codec.decompress(compression, stream.read())
+            except FileNotFoundError:
+                continue
+
+        return None
+
+    def _path(self, name: str, compression: str) -> str:
+        digest = hashlib.sha1(name.encode("UTF-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.xml.{compression}")
+
+
+_SERVICE: Optional[FetchService] = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_service() -> FetchService:
+    """
+    Provide the process-wide fetch service, creating it on first call.
+
+    :returns: Shared fetch service.
+    """
+    global _SERVICE
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = FetchService()
+
+        return _SERVICE
+
+
+def parse(body: bytes, headers: Optional[Mapping[str, str]]=None) -> "feedparser.FeedParserDict":
+    """
+    Parse a feed body with feedparser.
+
+    :param body: Raw feed.
+    :param headers: HTTP response headers, lower case, for the content type and base URL.
+    :returns: Parsed feed.
+    """
+    import feedparser
+
+    # pylint: disable=no-member
+    return feedparser.parse(body, response_headers=dict(headers or {}))
+
+
+def accept_encoding() -> str:
+    """
+    Provide the Accept-Encoding header for feed requests.
+
+    :returns: Every content encoding responses can be decoded from. Brotli and zstd are included
+        when the packages urllib3 decodes them with are installed.
+    """
+    from urllib3.util.request import ACCEPT_ENCODING
+    return ACCEPT_ENCODING
+
+
+def _generate_feedparser(name: str, service: FetchService) -> Parser:
+    """Perform rate-limited fetch and parse."""
+
+    @util.rate_limited(120, name)
+    def _rate_limited_parser(url: str, etag: str, last_modified: Any,
+                             ) -> "feedparser.FeedParserDict":
+        import feedparser
+        feedparser.USER_AGENT = constants.USER_AGENT
+
+        if urllib.parse.urlsplit(url).scheme not in ["http", "https"]:
+            # Local files and the like.
+            # pylint: disable=no-member
+            return feedparser.parse(url, etag=etag, modified=last_modified)
+
+        return _fetch_feed(service, name, url, etag, last_modified)
+
+    return _rate_limited_parser
+
+
+def _fetch_feed(service: FetchService, name: str, url: str, etag: Optional[str],
+                last_modified: Any) -> "feedparser.FeedParserDict":
+    """
+    Fetch a feed with requests and parse it, giving the same result feedparser would have
+    fetching it itself.
+    """
+    import feedparser
+    import requests
+
+    request_headers = {
+        **HEADERS,
+        "Accept": feedparser.http.ACCEPT_HEADER,
+        "Accept-Encoding": accept_encoding(),
+        "A-IM": "feed",
+    }
+    if etag:
+        request_headers["If-None-Match"] = etag
+    if last_modified is not None:
+        request_headers["If-Modified-Since"] = email.utils.formatdate(
+            calendar.timegm(last_modified), usegmt=True)
+
+    try:
+        response = service.session().get(url, headers=request_headers, timeout=FEED_TIMEOUT)
+        body = response.content
+    except requests.RequestException as exception:
+        return feedparser.FeedParserDict(bozo=1, bozo_exception=exception, entries=[], feed={})
+
+    # Bodies are decoded already, so the encoding headers no longer apply.
+    headers = {key.lower(): value for (key, value) in response.headers.items()
+               if key.lower() not in ["content-encoding", "content-length"]}
+    headers["content-location"] = response.url
+
+    if LOG.isEnabledFor(logging.DEBUG):
+        LOG.debug("Fetched %s bytes for %s (%s on the wire, content encoding '%s').",
+                  len(body), name, response.raw.tell(),
+                  response.headers.get("content-encoding", "identity"))
+
+    if 200 <= response.status_code < 300 and body:
+        parsed = parse(body, headers)
+        if service.archive is not None:
+            service.archive.store(name, body)
+    else:
+        parsed = feedparser.FeedParserDict(bozo=0, entries=[], feed={})
+
+    # Like feedparser, report the first redirect's status with the final URL, so permanent
+    # redirects can be told apart from temporary ones.
+    parsed["status"] = response.history[0].status_code if response.history else \
+        response.status_code
+    parsed["href"] = response.url
+    parsed["headers"] = headers
+    if response.headers.get("etag"):
+        parsed["etag"] = response.headers["etag"]
+    if response.headers.get("last-modified"):
+        parsed["modified"] = response.headers["last-modified"]
+        modified_parsed = email.utils.parsedate(response.headers["last-modified"])
+        if modified_parsed is not None:
+            parsed["modified_parsed"] = time.struct_time(modified_parsed)
+
+    return parsed
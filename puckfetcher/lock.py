@@ -0,0 +1,325 @@
+"""
+Module for running several puckfetcher processes against the same cache directory.
+File locks (flock) keep processes from rewriting the cache at the same time, and lease files let
+them split subscriptions between them, so no subscription is updated by two processes at once.
+Leases are renewed in the background while held, and expire on their own if their holder dies.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, Optional
+
+import puckfetcher.error as error
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+LOG = logging.getLogger("root")
+
+# How often to try again while waiting for a lock, in seconds.
+POLL_INTERVAL = 0.1
+
+# How long a lease lasts without being renewed, in seconds.
+DEFAULT_LEASE_SECONDS = 300
+
+LEASE_SUFFIX = ".lease"
+LEASE_LOCK_FILENAME = "leases.lock"
+
+_warned_no_locking = False
+
+
+class FileLock(object):
+    """Advisory lock on a file, held by one process at a time."""
+
+    def __init__(self, path: str, description: str="puckfetcher") -> None:
+        """
+        Object constructor for file lock.
+
+        :param path: Lock file. Created if it doesn't exist, and never removed.
+        :param description: What the lock protects, for error messages.
+        """
+        self.path = path
+        self.description = description
+        self._stream: Any = None
+
+        # flock doesn't keep out other threads of this process that open the file separately.
+        self._thread_lock = threading.Lock()
+
+    @property
+    def held(self) -> bool:
+        """
+        Whether this object holds the lock.
+
+        :returns: True if acquired and not released yet.
+        """
+        return self._stream is not None
+
+    def acquire(self, timeout: Optional[float]=None) -> None:
+        """
+        Acquire the lock, and write our PID to the lock file.
+
+        :param timeout: Seconds to wait for another process to release the lock. 0 fails straight
+            away, None waits as long as it takes.
+        :raises AlreadyRunningError: If the lock wasn't released in time.
+        """
+        if fcntl is None:
+            _warn_no_locking()
+            return
+
+        if not self._thread_lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise error.AlreadyRunningError(
+                f"Another thread holds the {self.description} lock '{self.path}'.")
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            stream = open(self.path, "a+")
+        except OSError:
+            self._thread_lock.release()
+            raise
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    stream.close()
+                    self._thread_lock.release()
+                    raise error.AlreadyRunningError(
+                        f"Another puckfetcher process holds the {self.description} lock "
+                        f"'{self.path}'.")
+
+            time.sleep(POLL_INTERVAL)
+
+        stream.seek(0)
+        stream.truncate()
+        stream.write(f"{os.getpid()}\n")
+        stream.flush()
+        self._stream = stream
+
+    def release(self) -> None:
+        """Release the lock, if held."""
+        if self._stream is not None:
+            fcntl.flock(self._stream.fileno(), fcntl.LOCK_UN)
+            self._stream.close()
+            self._stream = None
+            self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class LeaseManager(object):
+    """
+    Time-limited claims on subscriptions, shared through lease files in a directory.
+    The directory can be shared between hosts, as long as their clocks roughly agree.
+    """
+
+    def __init__(self, directory: str, ttl: float=DEFAULT_LEASE_SECONDS,
+                 owner: Optional[str]=None) -> None:
+        """
+        Object constructor for lease manager.
+
+        :param directory: Directory to keep lease files in.
+        :param ttl: Seconds a lease lasts without being renewed. Held leases are renewed every
+            third of this, from a background thread.
+        :param owner: Identifier of this process in lease files. Made from host name and PID if
+            not provided.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.host = socket.gethostname()
+        self.owner = owner if owner is not None else \
+            f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[0:8]}"
+
+        self.held: Dict[str, str] = {}
+        self._lock = FileLock(os.path.join(directory, LEASE_LOCK_FILENAME), "lease")
+        self._held_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+    def acquire(self, name: str) -> bool:
+        """
+        Take the lease on a name, unless another process holds it.
+        Leases that expired, or whose holder on this host is gone, are taken over.
+
+        :param name: Name to lease, like a subscription name.
+        :returns: Whether we hold the lease now.
+        """
+        path = self._lease_path(name)
+        with self._lock:
+            lease = _read_lease(path)
+            if lease is not None and lease.get("owner") != self.owner and \
+                    not self._is_stale(lease):
+                LOG.debug("Lease on '%s' is held by '%s'.", name, lease.get("owner"))
+                return False
+
+            if lease is not None and lease.get("owner") != self.owner:
+                LOG.info("Taking over stale lease on '%s' from '%s'.", name, lease.get("owner"))
+
+            self._write_lease(path, name)
+
+        with self._held_lock:
+            self.held[name] = path
+
+        self._start_renewer()
+        return True
+
+    def release(self, name: str) -> None:
+        """
+        Give up the lease on a name, if we hold it.
+
+        :param name: Name to release.
+        """
+        with self._held_lock:
+            path = self.held.pop(name, None)
+
+        if path is None:
+            return
+
+        with self._lock:
+            lease = _read_lease(path)
+            if lease is not None and lease.get("owner") == self.owner:
+                os.remove(path)
+
+    def release_all(self) -> None:
+        """Give up every lease we hold, and stop renewing."""
+        self._stop_event.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+
+        for name in list(self.held):
+            self.release(name)
+
+        self._stop_event.clear()
+
+    def holder(self, name: str) -> Optional[str]:
+        """
+        Provide the holder of a lease.
+
+        :param name: Leased name.
+        :returns: Owner of the lease, or None if nobody holds a live lease on the name.
+        """
+        lease = _read_lease(self._lease_path(name))
+        if lease is None or self._is_stale(lease):
+            return None
+
+        return lease.get("owner")
+
+    def renew(self, names: Optional[Iterable[str]]=None) -> None:
+        """
+        Push back the expiry of held leases.
+        A lease taken over by another process in the meantime is dropped from the held ones.
+
+        :param names: Leases to renew. Every held lease if not provided.
+        """
+        with self._held_lock:
+            held = dict(self.held)
+
+        with self._lock:
+            for name in (held if names is None else names):
+                path = held.get(name)
+                if path is None:
+                    continue
+
+                lease = _read_lease(path)
+                if lease is not None and lease.get("owner") != self.owner:
+                    LOG.warning("Lost lease on '%s' to '%s'.", name, lease.get("owner"))
+                    with self._held_lock:
+                        self.held.pop(name, None)
+                    continue
+
+                self._write_lease(path, name)
+
+    # "Private" class functions (messy internals).
+    def _lease_path(self, name: str) -> str:
+        # Names can hold anything, so they're hashed for file names. The name is in the file.
+        digest = hashlib.sha1(name.encode("UTF-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}{LEASE_SUFFIX}")
+
+    def _write_lease(self, path: str, name: str) -> None:
+        lease = {
+            "name": name,
+            "owner": self.owner,
+            "host": self.host,
+            "pid": os.getpid(),
+            "expires": time.time() + self.ttl,
+        }
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="UTF-8") as stream:
+            json.dump(lease, stream)
+        os.replace(temp_path, path)
+
+    def _is_stale(self, lease: Dict[str, Any]) -> bool:
+        if lease.get("expires", 0) < time.time():
+            return True
+
+        # A holder on this host that has exited won't renew, so don't wait for it to expire.
+        if lease.get("host") == self.host and isinstance(lease.get("pid"), int):
+            return not _pid_alive(lease["pid"])
+
+        return False
+
+    def _start_renewer(self) -> None:
+        if self._renewer is not None:
+            return
+
+        def _renew_until_stopped() -> None:
+            while not self._stop_event.wait(self.ttl / 3):
+                try:
+                    self.renew()
+                except (OSError, error.PuckError) as exception:
+                    LOG.warning("Unable to renew leases: %s", exception)
+
+        self._renewer = threading.Thread(target=_renew_until_stopped, name="lease-renewer",
+                                         daemon=True)
+        self._renewer.start()
+
+
+def _read_lease(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding="UTF-8") as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exception:
+        # Half-written leases can't happen (they're replaced atomically), so this is garbage.
+        LOG.warning("Ignoring unreadable lease file '%s': %s", path, exception)
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    # Signal 0 only checks for the process on POSIX. On Windows, it would kill it.
+    if os.name == "nt":
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to someone else.
+        return True
+
+    return True
+
+
+def _warn_no_locking() -> None:
+    global _warned_no_locking
+    if not _warned_no_locking:
+        LOG.warning("File locking isn't available here, overlapping runs won't be prevented.")
+        _warned_no_locking = True
@@ -0,0 +1,139 @@
+"""
+Module for moving log output off the threads doing the work.
+Records are put on a queue and written by a background thread, so a slow disk never holds up
+downloads. The log file can also be written as one JSON object per line, for log collectors.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Any, Dict, Optional, Tuple
+
+# Attributes every LogRecord has, so anything else on a record was passed in with `extra`.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Format a record as JSON.
+
+        :param record: Record to format.
+        :returns: JSON object with time, level, logger, message and source location, plus any
+            extra attributes given to the log call.
+        """
+        created = datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+        event: Dict[str, Any] = {
+            "time": created.isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            event["exception"] = record.exc_text
+
+        for (key, value) in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key not in event:
+                event[key] = value
+
+        return json.dumps(event, default=str)
+
+
+def start_async(logger: logging.Logger,
+                json_file: bool=False) -> Optional[logging.handlers.QueueListener]:
+    """
+    Move a logger's handlers behind a queue, so logging only costs the caller a queue put.
+
+    :param logger: Logger whose handlers to move.
+    :param json_file: Whether file handlers should write JSON lines instead of text.
+    :returns: Listener writing queued records, to be stopped with stop_async. None if the logger
+        has no handlers to move.
+    """
+    handlers = list(logger.handlers)
+    if not handlers:
+        return None
+
+    if json_file:
+        for handler in handlers:
+            if isinstance(handler, logging.FileHandler):
+                handler.setFormatter(JsonFormatter())
+
+    record_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(record_queue, *handlers,
+                                              respect_handler_level=True)
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(logging.handlers.QueueHandler(record_queue))
+
+    listener.start()
+    return listener
+
+
+def stop_async(logger: logging.Logger, listener: logging.handlers.QueueListener) -> None:
+    """
+    Write out everything still queued and give the logger its handlers back.
+
+    :param logger: Logger passed to start_async.
+    :param listener: Listener start_async returned.
+    """
+    listener.stop()
+
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+class _ForwardHandler(logging.Handler):
+    """Hands records to a logger, for records that came from another process."""
+
+    def __init__(self, logger: logging.Logger) -> None:
+        super(_ForwardHandler, self).__init__()
+        self.logger = logger
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.logger.handle(record)
+
+
+def start_process_logging(logger: logging.Logger,
+                          context: Any) -> Tuple[Any, logging.handlers.QueueListener]:
+    """
+    Collect log records from worker processes, and log them with a logger in this process.
+
+    :param logger: Logger to hand worker records to.
+    :param context: Multiprocessing context the workers are started from.
+    :returns: Queue to pass to init_worker_logging in each worker, and the listener reading it,
+        to be stopped once the workers are done.
+    """
+    record_queue = context.Queue()
+    listener = logging.handlers.QueueListener(record_queue, _ForwardHandler(logger))
+    listener.start()
+    return (record_queue, listener)
+
+
+def init_worker_logging(record_queue: Any, level: int) -> None:
+    """
+    Send a worker process's log records back to the process that started it.
+
+    :param record_queue: Queue from start_process_logging.
+    :param level: Level to log at, usually the parent logger's effective level.
+    """
+    logger = logging.getLogger("root")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    logger.addHandler(logging.handlers.QueueHandler(record_queue))
+    logger.setLevel(level)
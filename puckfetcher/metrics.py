@@ -0,0 +1,337 @@
+"""
+Module for counting and timing what puckfetcher spends its time on.
+Metrics are kept in memory and exposed in the Prometheus text format, either written to a file
+(for node_exporter's textfile collector) or served over HTTP by the daemon.
+"""
+import contextlib
+import logging
+import math
+import os
+import threading
+import time
+import urllib.parse
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LOG = logging.getLogger("root")
+
+# Seconds, for network and disk operations.
+TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Bytes per second, from dial-up to a fast LAN.
+THROUGHPUT_BUCKETS = (1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(object):
+    """Base for metrics with a fixed set of label names."""
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]) -> None:
+        """
+        Object constructor for metric.
+
+        :param name: Metric name, following Prometheus naming conventions.
+        :param description: Help text for the metric.
+        :param labels: Names of labels every observation must provide.
+        """
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} needs labels {self.labels}, got {tuple(labels)}.")
+
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format_labels(self, values: LabelValues, extra: Tuple[Tuple[str, str], ...]=()) -> str:
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ""
+
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for (name, value) in pairs) + "}"
+
+    def render(self) -> List[str]:
+        """
+        Render this metric in the Prometheus text format.
+
+        :returns: Lines of text, without trailing newlines.
+        """
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, per set of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]) -> None:
+        super(Counter, self).__init__(name, description, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float=1.0, **labels: Any) -> None:
+        """
+        Increase counter.
+
+        :param amount: Amount to increase by. Must not be negative.
+        :param labels: Value for each of this metric's labels.
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        """
+        Provide current count.
+
+        :param labels: Value for each of this metric's labels.
+        :returns: Count for these label values.
+        """
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super(Counter, self).render()
+        with self._lock:
+            for (key, value) in sorted(self._values.items()):
+                lines.append(f"{self.name}{self._format_labels(key)} {_format_value(value)}")
+
+        return lines
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, per set of label values."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str],
+                 buckets: Sequence[float]=TIME_BUCKETS) -> None:
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> (count per bucket, with the last one for +Inf; sum of observations).
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        Record an observation.
+
+        :param value: Observed value.
+        :param labels: Value for each of this metric's labels.
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+
+            (counts, total) = self._values[key]
+            index = len(self.buckets)
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+
+            counts[index] += 1
+            total[0] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """
+        Observe how long the body of a with statement takes, in seconds.
+
+        :param labels: Value for each of this metric's labels.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: Any) -> int:
+        """
+        Provide number of observations.
+
+        :param labels: Value for each of this metric's labels.
+        :returns: Number of observations for these label values.
+        """
+        with self._lock:
+            values = self._values.get(self._label_values(labels))
+            return 0 if values is None else sum(values[0])
+
+    def render(self) -> List[str]:
+        lines = super(Histogram, self).render()
+        with self._lock:
+            for (key, (counts, total)) in sorted(self._values.items()):
+                cumulative = 0
+                for (bound, count) in zip([*self.buckets, math.inf], counts):
+                    cumulative += count
+                    labels = self._format_labels(key, (("le", _format_value(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+                lines.append(f"{self.name}_sum{self._format_labels(key)} "
+                             f"{_format_value(total[0])}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+
+        return lines
+
+
+class Registry(object):
+    """Collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        """Object constructor for registry."""
+        self.metrics: List[_Metric] = []
+
+    def counter(self, name: str, description: str, labels: Sequence[str]) -> Counter:
+        """
+        Create and register a counter.
+
+        :returns: New counter.
+        """
+        metric = Counter(name, description, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels: Sequence[str],
+                  buckets: Sequence[float]=TIME_BUCKETS) -> Histogram:
+        """
+        Create and register a histogram.
+
+        :returns: New histogram.
+        """
+        metric = Histogram(name, description, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text format.
+
+        :returns: Exposition text.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Write all metrics to a file, replacing it atomically so collectors never see half a file.
+
+        :param path: File to write.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="UTF-8") as stream:
+            stream.write(self.render())
+
+        os.replace(temp_path, path)
+        LOG.debug("Wrote metrics to '%s'.", path)
+
+    def serve(self, port: int, host: str="127.0.0.1") -> Any:
+        """
+        Serve metrics over HTTP from a background thread.
+
+        :param port: Port to listen on. 0 picks a free one.
+        :param host: Address to listen on. Local only by default.
+        :returns: The running server. Call shutdown() on it to stop serving.
+        """
+        import http.server
+        import socketserver
+
+        registry = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = registry.render().encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                LOG.debug("Metrics request: " + format, *args)
+
+        # http.server.ThreadingHTTPServer needs Python 3.7.
+        class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        server = _Server((host, port), _Handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+        thread.start()
+        LOG.info("Serving metrics on http://%s:%s/metrics.", host, server.server_address[1])
+
+        return server
+
+
+REGISTRY = Registry()
+
+FEED_FETCH_SECONDS = REGISTRY.histogram(
+    "puckfetcher_feed_fetch_seconds",
+    "Time to fetch and parse a feed with feedparser.",
+    ["subscription", "host"],
+)
+FEED_RESPONSES = REGISTRY.counter(
+    "puckfetcher_feed_responses_total",
+    "Feed fetches by HTTP status. 'none' is a response without a status, like a local file, "
+    "and 'error' is a failed fetch.",
+    ["subscription", "host", "status"],
+)
+FEED_PARSE_SECONDS = REGISTRY.histogram(
+    "puckfetcher_feed_parse_seconds",
+    "Time to turn a parsed feed into entries.",
+    ["subscription"],
+)
+DOWNLOAD_BYTES = REGISTRY.counter(
+    "puckfetcher_download_bytes_total",
+    "Bytes of enclosures downloaded.",
+    ["subscription", "host"],
+)
+DOWNLOAD_SECONDS = REGISTRY.histogram(
+    "puckfetcher_download_seconds",
+    "Time to download one enclosure.",
+    ["subscription", "host"],
+)
+DOWNLOAD_THROUGHPUT = REGISTRY.histogram(
+    "puckfetcher_download_throughput_bytes_per_second",
+    "Download speed of each enclosure.",
+    ["subscription", "host"],
+    THROUGHPUT_BUCKETS,
+)
+TAG_SECONDS = REGISTRY.histogram(
+    "puckfetcher_tag_seconds",
+    "Time to read and write tags on one downloaded file.",
+    ["subscription"],
+)
+CACHE_SAVE_SECONDS = REGISTRY.histogram(
+    "puckfetcher_cache_save_seconds",
+    "Time to save the subscription cache.",
+    ["backend"],
+)
+
+
+def host_of(url: Optional[str]) -> str:
+    """
+    Provide host of a URL, for labelling.
+
+    :param url: URL to check.
+    :returns: Host name, or an empty string if there isn't one.
+    """
+    if not url:
+        return ""
+
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value))
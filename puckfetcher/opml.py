@@ -0,0 +1,55 @@
+"""
+Module for reading OPML subscription lists, as exported by most podcast apps.
+Files are streamed with iterparse, so lists of thousands of feeds don't have to fit in memory as
+an element tree.
+"""
+import logging
+import xml.etree.ElementTree as ElementTree
+from typing import Iterator, List, NamedTuple
+
+import puckfetcher.error as error
+
+LOG = logging.getLogger("root")
+
+
+class Outline(NamedTuple):
+    """Feed listed in an OPML file."""
+    name: str
+    url: str
+
+
+def iter_feeds(path: str) -> Iterator[Outline]:
+    """
+    Provide feeds listed in an OPML file, in the order they're listed.
+    Outlines without a feed URL (like folders) are skipped, but feeds inside them are not.
+
+    :param path: OPML file to read.
+    :returns: Iterator of feeds.
+    :raises MalformedConfigError: If the file can't be read, or isn't valid XML.
+    """
+    # Elements being read, outermost first. Finished elements are removed from their parent, so
+    # only the path to the current outline is ever kept in memory.
+    open_elements: List[ElementTree.Element] = []
+    try:
+        for (event, element) in ElementTree.iterparse(path, events=("start", "end")):
+            if event == "start":
+                open_elements.append(element)
+                continue
+
+            open_elements.pop()
+            if _local_name(element.tag) == "outline":
+                url = element.get("xmlUrl") or element.get("xmlurl")
+                if url:
+                    name = element.get("title") or element.get("text") or url
+                    yield Outline(name=name.strip(), url=url.strip())
+
+            if open_elements:
+                open_elements[-1].remove(element)
+
+    except (OSError, ElementTree.ParseError) as exception:
+        raise error.MalformedConfigError(f"Unable to read OPML file '{path}': {exception}")
+
+
+def _local_name(tag: str) -> str:
+    # Some exporters put OPML elements in a namespace.
+    return tag.rsplit("}", 1)[-1]
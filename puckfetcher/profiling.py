@@ -0,0 +1,189 @@
+"""
+Module for profiling commands, for the --profile and --trace-memory flags.
+CPU profiles come from cProfile. Memory tracing uses tracemalloc and reports where memory was
+allocated during each traced phase (loading state, updating, saving the cache).
+"""
+import functools
+import logging
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+LOG = logging.getLogger("root")
+
+# Stack frames kept per allocation. More is more useful and much slower.
+TRACE_FRAMES = 5
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class PhaseStats(object):
+    """Memory use of one traced phase, over every time it ran."""
+
+    def __init__(self, name: str) -> None:
+        """
+        Object constructor for phase stats.
+
+        :param name: Name of phase.
+        """
+        self.name = name
+        self.calls = 0
+        self.peak = 0
+        self.top: List[tracemalloc.StatisticDiff] = []
+
+
+class MemoryTracer(object):
+    """Tracks peak memory and allocation sites per phase, while tracemalloc is tracing."""
+
+    def __init__(self, top: int=10) -> None:
+        """
+        Object constructor for memory tracer.
+
+        :param top: Number of allocation sites to keep per phase.
+        """
+        self.top = top
+        self.phases: Dict[str, PhaseStats] = {}
+
+        # (name, snapshot at start, highest peak seen before a nested phase reset it).
+        self._stack: List[List[Any]] = []
+
+    def start(self) -> None:
+        """Start tracing allocations."""
+        tracemalloc.start(TRACE_FRAMES)
+
+    def stop(self) -> None:
+        """Stop tracing allocations."""
+        tracemalloc.stop()
+
+    def enter(self, name: str) -> None:
+        """
+        Start a phase. Phases can nest.
+
+        :param name: Name of phase.
+        """
+        current_peak = tracemalloc.get_traced_memory()[1]
+        if self._stack:
+            # Resetting the peak below would lose the enclosing phase's peak so far.
+            self._stack[-1][2] = max(self._stack[-1][2], current_peak)
+
+        _reset_peak()
+        self._stack.append([name, tracemalloc.take_snapshot(), 0])
+
+    def exit(self) -> None:
+        """End the innermost phase."""
+        (name, before, saved_peak) = self._stack.pop()
+        peak = max(saved_peak, tracemalloc.get_traced_memory()[1])
+        after = tracemalloc.take_snapshot()
+
+        stats = self.phases.setdefault(name, PhaseStats(name))
+        stats.calls += 1
+        if peak >= stats.peak:
+            stats.peak = peak
+            stats.top = _without_tracemalloc(after).compare_to(
+                _without_tracemalloc(before), "traceback")[0:self.top]
+
+    def report(self) -> str:
+        """
+        Describe memory use of every phase.
+
+        :returns: Multiline report, for logging.
+        """
+        lines = []
+        for stats in self.phases.values():
+            lines.append(f"Phase '{stats.name}': {stats.calls} calls, "
+                         f"peak {stats.peak / 1024 / 1024:.1f} MiB traced.")
+            lines.append("  Largest allocations during the call with the highest peak:")
+            for diff in stats.top:
+                frame = diff.traceback[0]
+                lines.append(f"    {diff.size_diff / 1024:+.1f} KiB in {diff.count_diff:+} blocks "
+                             f"at {frame.filename}:{frame.lineno}")
+
+        return "\n".join(lines)
+
+
+# Tracer in use, if --trace-memory was given.
+_TRACER: Optional[MemoryTracer] = None
+
+
+def traced_phase(name: str) -> Callable[[F], F]:
+    """
+    Decorate a function as a phase for memory tracing.
+    Does nothing beyond one check unless memory is being traced.
+
+    :param name: Name of phase.
+    """
+    def _decorator(func: F) -> F:
+        @functools.wraps(func)
+        def _wrapper(*args: Any, **kwargs: Any) -> Any:
+            tracer = _TRACER
+            if tracer is None:
+                return func(*args, **kwargs)
+
+            tracer.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.exit()
+
+        return _wrapper  # type: ignore
+
+    return _decorator
+
+
+def run_profiled(func: Callable[[], Any], stats_file: str, top: int=25) -> Any:
+    """
+    Run a function under cProfile, save the stats, and log the most expensive calls.
+
+    :param func: Function to run.
+    :param stats_file: File to write pstats data to. Load with pstats or snakeviz.
+    :param top: Number of functions to include in the logged summary.
+    :returns: What the function returned.
+    """
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stats_file)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats("cumulative").print_stats(top)
+        LOG.info("Wrote profile to '%s'. Top %s functions by cumulative time:"
+                 "\n%s", stats_file, top, summary.getvalue())
+
+
+def run_memory_traced(func: Callable[[], Any], top: int=10) -> Any:
+    """
+    Run a function with memory tracing on, and log per-phase memory use.
+
+    :param func: Function to run.
+    :param top: Number of allocation sites to report per phase.
+    :returns: What the function returned.
+    """
+    global _TRACER
+    tracer = MemoryTracer(top)
+    tracer.start()
+    _TRACER = tracer
+    try:
+        return func()
+    finally:
+        _TRACER = None
+        tracer.stop()
+        LOG.info("Memory use by phase:\n%s", tracer.report())
+
+
+def _reset_peak() -> None:
+    # tracemalloc.reset_peak needs Python 3.9. Before that, peaks are since tracing started.
+    reset_peak = getattr(tracemalloc, "reset_peak", None)
+    if reset_peak is not None:
+        reset_peak()
+
+
+def _without_tracemalloc(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    # Snapshots taken for earlier phases are allocations too, but not interesting ones.
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
@@ -8,20 +8,26 @@ import enum
 import logging
 import os
 import platform
+import threading
 import time
-from typing import Any, Dict, List, Mapping, Optional, Tuple, MutableSequence
+from http import HTTPStatus
+from typing import (Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple,
+                    MutableSequence, TYPE_CHECKING)
 
 import drewtilities as util
-import eyed3
-import feedparser
-import magic
-import requests
 
 import puckfetcher.constants as constants
 import puckfetcher.error as error
+import puckfetcher.fetch as fetch
+import puckfetcher.metrics as metrics
+import puckfetcher.trace as trace
+
+# feedparser, eyed3 and magic are slow to import and only needed when fetching, downloading or
+# tagging, so they're imported where they're used.
+if TYPE_CHECKING:
+    import feedparser
 
 DATE_FORMAT_STRING = "%Y%m%dT%H:%M:%S.%f"
-HEADERS = {"User-Agent": constants.USER_AGENT}
 MAX_RECURSIVE_ATTEMPTS = 10
 SUMMARY_LIMIT = 15
 
@@ -54,11 +60,11 @@ class Subscription(object):
         # Temporary storage for swapping around urls.
         self.temp_url: str = ""
 
-        LOG.debug(f"Storing provided url '{url}'.")
+        LOG.debug("Storing provided url '%s'.", url)
         self.url = url
         self.original_url = url
 
-        LOG.debug(f"Storing provided name '{name}'.")
+        LOG.debug("Storing provided name '%s'.", name)
         self.metadata = {
             "name": name,
             "artist": "",
@@ -66,15 +72,22 @@ class Subscription(object):
             "album_artist": "",
         }
 
-        # Our file downloader.
-        self.downloader = util.generate_downloader(HEADERS, self.metadata["name"])
-        feedparser.USER_AGENT = constants.USER_AGENT
-
-        # Our wrapper around feedparser's parse for rate limiting.
-        self.parser = _generate_feedparser(self.metadata["name"])
+        # Our file downloader and our wrapper around feedparser's parse for rate limiting.
+        # These come from the shared fetch service unless overridden (by tests, mostly).
+        self._downloader: Optional[fetch.Downloader] = None
+        self._parser: Optional[fetch.Parser] = None
 
         # Store feed state, including etag/last_modified.
-        self.feed_state = _FeedState()
+        # Feed state may instead be loaded lazily from the cache, see decode_subscription.
+        self._feed_state: Optional[_FeedState] = _FeedState()
+        self._feed_state_loader: Optional[Callable[[], Optional[Mapping[str, Any]]]] = None
+        self._summary: Dict[str, Any] = {}
+
+        # Key of this subscription's shard in the cache. Not cached itself.
+        self.cache_key: Optional[str] = None
+
+        # Downloads finished since the config last saved them to the download history.
+        self.completed_downloads: List[Dict[str, Any]] = []
 
         self.directory = _process_directory(directory)
 
@@ -83,14 +96,23 @@ class Subscription(object):
             "backlog_limit": 0,
             "set_tags": False,
             "overwrite_title": False,
+            "update_interval": None,
+            "keep_entries": None,
         }
 
     @classmethod
-    def decode_subscription(cls, sub_dictionary: Mapping[str, Any]) -> "Subscription":
+    def decode_subscription(
+            cls,
+            sub_dictionary: Mapping[str, Any],
+            feed_state_loader: Optional[Callable[[], Optional[Mapping[str, Any]]]]=None,
+    ) -> "Subscription":
         """
         Decode subscription from dictionary.
 
         :param sub_dictionary: Dictionary from JSON to use to decode object.
+        :param feed_state_loader: Callable providing the encoded feed state, for dictionaries
+            (like cache index records) that don't contain one.
+            It will only be called once the feed state is actually needed.
         :returns: Subscription object built from dictionary.
         """
         url = sub_dictionary.get("url", None)
@@ -100,7 +122,6 @@ class Subscription(object):
 
         original_url = sub_dictionary.get("original_url", None)
         directory = sub_dictionary.get("directory", None)
-        feed_state = _FeedState(feedstate_dict=sub_dictionary.get("feed_state", None))
 
         name = sub_dictionary.get("name", None)
         if name is None:
@@ -110,7 +131,27 @@ class Subscription(object):
         sub = Subscription(url=url, name=name, directory=directory)
 
         sub.original_url = original_url
-        sub.feed_state = feed_state
+
+        # Feed state in the dictionary itself (old single-file cache) is decoded lazily as well.
+        if feed_state_loader is None and sub_dictionary.get("feed_state", None) is not None:
+            encoded_feed_state = sub_dictionary["feed_state"]
+            sub_dictionary = {
+                **sub_dictionary,
+                "latest_entry_number": encoded_feed_state.get("latest_entry_number", None),
+                "queue_length": len(encoded_feed_state.get("queue", [])),
+            }
+            feed_state_loader = lambda: encoded_feed_state
+
+        if feed_state_loader is not None:
+            sub._feed_state = None
+            sub._feed_state_loader = feed_state_loader
+            sub._summary = {
+                "latest_entry_number": sub_dictionary.get("latest_entry_number", None),
+                "queue_length": sub_dictionary.get("queue_length", 0),
+            }
+
+        else:
+            sub.feed_state = _FeedState()
 
         if "settings" in sub_dictionary.keys():
             sub.settings = sub_dictionary["settings"]
@@ -132,9 +173,6 @@ class Subscription(object):
                 "album_artist": sub_dictionary.get("album_artist", ""),
             }
 
-        # Generate data members that shouldn't/won't be cached.
-        sub.downloader = util.generate_downloader(HEADERS, sub.metadata["name"])
-
         return sub
 
     @classmethod
@@ -158,6 +196,66 @@ class Subscription(object):
             "name": sub.metadata["name"],
         }
 
+    @classmethod
+    def encode_index_record(cls, sub: "Subscription") -> Mapping[str, Any]:
+        """
+        Encode subscription to a cache index record.
+        This is everything encode_subscription provides except the feed state,
+        which is stored separately, plus a summary of the feed state.
+        Does not load the feed state if it hasn't been loaded yet.
+
+        :param sub: Subscription object to turn into an index record.
+        :returns: A dictionary that can be passed back to decode_subscription,
+            alongside a feed state loader.
+        """
+        return {
+            "__type__": "subscription",
+            "__version__": constants.VERSION,
+            "url": sub.url,
+            "original_url": sub.original_url,
+            "directory": sub.directory,
+            "settings": sub.settings,
+            "metadata": sub.metadata,
+            "name": sub.metadata["name"],
+            "latest_entry_number": sub.latest(),
+            "queue_length": sub.queue_length(),
+            "shard": sub.cache_key,
+        }
+
+    @classmethod
+    def encode_update_result(cls, sub: "Subscription") -> Mapping[str, Any]:
+        """
+        Encode everything an update can change about a subscription, so an update run in another
+        process can be applied with apply_update_result.
+
+        :param sub: Subscription object that was updated.
+        :returns: A dictionary that can be pickled and passed between processes.
+        """
+        encoded = Subscription.encode_subscription(sub)
+        return {
+            **encoded,
+            # Decoding a feed state forgets which downloads were from this session.
+            "session": [item["is_this_session"]
+                        for item in encoded["feed_state"]["summary_queue"]],
+            "completed_downloads": list(sub.completed_downloads),
+        }
+
+    def apply_update_result(self, result: Mapping[str, Any]) -> None:
+        """
+        Apply an update run in another process to this subscription.
+
+        :param result: Dictionary from encode_update_result.
+        """
+        self.url = result["url"]
+        self.settings = result["settings"]
+        self.metadata = result["metadata"]
+
+        self.feed_state = _FeedState(feedstate_dict=result["feed_state"])
+        for (item, is_this_session) in zip(self.feed_state.summary_queue, result["session"]):
+            item["is_this_session"] = is_this_session
+
+        self.completed_downloads.extend(result["completed_downloads"])
+
     @staticmethod
     def parse_from_user_yaml(
             sub_yaml: Mapping[str, Any],
@@ -192,6 +290,9 @@ class Subscription(object):
         sub.settings["backlog_limit"] = sub_yaml.get("backlog_limit", defaults["backlog_limit"])
         sub.settings["set_tags"] = sub_yaml.get("set_tags", defaults["set_tags"])
         sub.settings["overwrite_title"] = sub_yaml.get("overwrite_title", False)
+        # Left unset unless given, the daemon falls back to the config-wide interval itself.
+        sub.settings["update_interval"] = sub_yaml.get("update_interval", None)
+        sub.settings["keep_entries"] = sub_yaml.get("keep_entries", defaults.get("keep_entries"))
 
         sub.metadata["name"] = name
         sub.metadata["artist"] = sub_yaml.get("artist", "")
@@ -207,77 +308,216 @@ class Subscription(object):
 
         :returns: Latest entry number for this subscription.
         """
+        if not self.feed_state_loaded:
+            return self._summary["latest_entry_number"]
+
         return self.feed_state.latest_entry_number
 
-    def attempt_update(self) -> bool:
+    def queue_length(self) -> int:
+        """
+        Return number of entries in the download queue.
+
+        :returns: Download queue length for this subscription.
+        """
+        if not self.feed_state_loaded:
+            return self._summary["queue_length"]
+
+        return len(self.feed_state.queue)
+
+    @property
+    def feed_state(self) -> "_FeedState":
+        """
+        Feed state of this subscription, loaded from the cache on first access if necessary.
+
+        :returns: Feed state object.
+        """
+        if self._feed_state is None:
+            encoded_feed_state = None
+            if self._feed_state_loader is not None:
+                LOG.debug("Loading cached feed state for %s.", self.metadata['name'])
+                encoded_feed_state = self._feed_state_loader()
+
+            self._feed_state = _FeedState(feedstate_dict=encoded_feed_state)
+            self._feed_state_loader = None
+
+            # Keep our place in the feed even if the cached feed state was lost.
+            if encoded_feed_state is None and self._summary:
+                self._feed_state.latest_entry_number = self._summary["latest_entry_number"]
+
+        return self._feed_state
+
+    @feed_state.setter
+    def feed_state(self, feed_state: "_FeedState") -> None:
+        self._feed_state = feed_state
+        self._feed_state_loader = None
+
+    @property
+    def downloader(self) -> "fetch.Downloader":
+        """
+        Enclosure downloader for this subscription, from the shared fetch service.
+
+        :returns: Callable taking url and dest keyword arguments.
+        """
+        if self._downloader is not None:
+            return self._downloader
+
+        return fetch.get_service().downloader(self.metadata["name"])
+
+    @downloader.setter
+    def downloader(self, downloader: "fetch.Downloader") -> None:
+        self._downloader = downloader
+
+    @property
+    def parser(self) -> "fetch.Parser":
+        """
+        Rate-limited feed parser for this subscription, from the shared fetch service.
+
+        :returns: Callable taking url, etag and last_modified.
+        """
+        if self._parser is not None:
+            return self._parser
+
+        return fetch.get_service().parser(self.metadata["name"])
+
+    @parser.setter
+    def parser(self, parser: "fetch.Parser") -> None:
+        self._parser = parser
+
+    @property
+    def feed_state_loaded(self) -> bool:
+        """
+        Whether the feed state is in memory, as opposed to waiting in the cache.
+
+        :returns: True if feed state has been loaded or set.
+        """
+        return self._feed_state is not None
+
+    def attempt_update(self, stop: Optional[threading.Event]=None) -> bool:
         """
         Attempt to download new entries for a subscription.
 
+        :param stop: Event that, once set, stops downloading after the current entry.
+            Entries not yet downloaded stay in the queue.
         :returns: Whether update succeeded or failed.
         """
 
+        # Compacted entries in the queue need their details back, so fetch the whole feed even if
+        # it hasn't changed. Queued entries aren't compacted again.
+        num_entries = len(self.feed_state.entries)
+        if any(0 < num <= num_entries and is_tombstone(self.feed_state.entries[num_entries - num])
+               for num in self.feed_state.queue):
+            self.feed_state.etag = ""
+            self.feed_state.last_modified = None
+
         # Attempt to populate self.feed_state from subscription URL.
         feed_get_result = self.get_feed()
         if feed_get_result not in (UpdateResult.SUCCESS, UpdateResult.UNNEEDED):
             return False
 
-        LOG.info(f"Subscription {self.metadata['name']} got updated feed.")
+        LOG.info("Subscription %s got updated feed.", self.metadata['name'])
 
-        # Only consider backlog if we don't have a latest entry number already.
-        number_feeds = len(self.feed_state.entries)
-        if self.latest() is None:
-            if self.settings["backlog_limit"] is None:
-                self.feed_state.latest_entry_number = 0
-                LOG.info(f"Interpreting 'None' backlog limit as 'No Limit' and downloading full "
-                         f"backlog ({number_feeds} entries).")
-
-            elif self.settings["backlog_limit"] < 0:
-                LOG.error(f"Invalid backlog limit {self.settings['backlog_limit']}, "
-                          f"downloading nothing.")
-                return False
-
-            elif self.settings["backlog_limit"] > 0:
-                LOG.info(f"Backlog limit provided as '{self.settings['backlog_limit']}'")
-                self.settings["backlog_limit"] = util.max_clamp(self.settings["backlog_limit"],
-                                                                number_feeds)
-                LOG.info(f"Backlog limit clamped to '{self.settings['backlog_limit']}'")
-                self.feed_state.latest_entry_number = number_feeds - self.settings["backlog_limit"]
+        if not self.apply_backlog_limit():
+            return False
 
-            else:
-                self.feed_state.latest_entry_number = number_feeds
-                LOG.info(f"Download backlog for {self.metadata['name']} is zero."
-                         f"\nNot downloading backlog but setting number downloaded to "
-                         f"{self.latest()}.")
+        self.compact_entries()
 
+        number_feeds = len(self.feed_state.entries)
         if self.latest() >= number_feeds:
-            LOG.info(f"Num downloaded for {self.metadata['name']} matches feed "
-                     f"entry count {number_feeds}."
-                     f"\nNothing to do.")
+            LOG.info("Num downloaded for %s matches feed "
+                     "entry count %s."
+                     "\nNothing to do.", self.metadata['name'], number_feeds)
             return True
 
         number_to_download = number_feeds - self.latest()
-        LOG.info(f"Number of downloaded feeds for {self.metadata['name']} is {self.latest()}, "
-                 f"{number_to_download} less than feed entry count {number_feeds}."
-                 f"\nDownloading {number_to_download} entries.")
+        LOG.info("Number of downloaded feeds for %s is %s, "
+                 "%s less than feed entry count %s."
+                 "\nDownloading %s entries.",
+                 self.metadata['name'], self.latest(), number_to_download, number_feeds,
+                 number_to_download)
 
         # Queuing feeds in order of age makes the most sense for RSS feeds, so we do that.
         for i in range(self.latest(), number_feeds):
             self.feed_state.queue.append(i + 1)
 
-        self.download_queue()
+        self.download_queue(stop)
+
+        return True
+
+    def apply_backlog_limit(self) -> bool:
+        """
+        Decide how much of the backlog to download, if that hasn't been decided yet.
+        Entries older than the backlog limit count as already downloaded.
+
+        :returns: False if the backlog limit is invalid, True otherwise.
+        """
+        # Only consider backlog if we don't have a latest entry number already.
+        if self.latest() is not None:
+            return True
+
+        number_feeds = len(self.feed_state.entries)
+        if self.settings["backlog_limit"] is None:
+            self.feed_state.latest_entry_number = 0
+            LOG.info("Interpreting 'None' backlog limit as 'No Limit' and downloading full "
+                     "backlog (%s entries).", number_feeds)
+
+        elif self.settings["backlog_limit"] < 0:
+            LOG.error("Invalid backlog limit %s, downloading nothing.",
+                      self.settings['backlog_limit'])
+            return False
+
+        elif self.settings["backlog_limit"] > 0:
+            LOG.info("Backlog limit provided as '%s'", self.settings['backlog_limit'])
+            self.settings["backlog_limit"] = util.max_clamp(self.settings["backlog_limit"],
+                                                            number_feeds)
+            LOG.info("Backlog limit clamped to '%s'", self.settings['backlog_limit'])
+            self.feed_state.latest_entry_number = number_feeds - self.settings["backlog_limit"]
+
+        else:
+            self.feed_state.latest_entry_number = number_feeds
+            LOG.info("Download backlog for %s is zero."
+                     "\nNot downloading backlog but setting number downloaded to "
+                     "%s.", self.metadata['name'], self.latest())
 
         return True
 
-    def download_queue(self) -> None:
+    def compact_entries(self) -> int:
+        """
+        Compact old entries this subscription is done with, if it has a 'keep_entries' limit.
+        See _FeedState.compact.
+
+        :returns: Number of entries compacted.
+        """
+        keep = self.settings.get("keep_entries")
+        if keep is None:
+            return 0
+
+        compacted = self.feed_state.compact(keep)
+        if compacted > 0:
+            LOG.debug("Compacted %s old entries for %s.", compacted, self.metadata["name"])
+
+        return compacted
+
+    def download_queue(self, stop: Optional[threading.Event]=None) -> None:
         """
         Download feed enclosure(s) for all entries in the queue.
+
+        :param stop: Event that, once set, stops downloading after the current entry.
+            Entries not yet downloaded stay in the queue.
         """
 
-        LOG.info(f"Queue for sub {self.metadata['name']} "
-                 f"has {len(self.feed_state.queue)} entries.")
+        LOG.info("Queue for sub %s has %s entries.",
+                 self.metadata['name'], len(self.feed_state.queue))
 
+        # Compacted entries can't be downloaded until an update fetches their details again.
+        deferred: List[int] = []
+        one_indexed_entry_num: Optional[int] = None
         try:
             while self.feed_state.queue:
+                if stop is not None and stop.is_set():
+                    LOG.info("Stopping downloads for %s, "
+                             "%s entries left in queue.",
+                             self.metadata['name'], len(self.feed_state.queue))
+                    break
 
                 # Pull index from queue, transform from one-indexing to zero-indexing.
                 one_indexed_entry_num = self.feed_state.queue.popleft()
@@ -288,49 +528,75 @@ class Subscription(object):
 
                 # Do a bounds check in case we accidentally let something bad into the queue.
                 if entry_num < 0 or entry_num >= num_entries:
-                    LOG.debug(f"Invalid num {one_indexed_entry_num} in queue - skipping.")
+                    LOG.debug("Invalid num %s in queue - skipping.", one_indexed_entry_num)
                     continue
 
                 entry_age = num_entries - (one_indexed_entry_num)
                 entry = self.feed_state.entries[entry_age]
 
+                if is_tombstone(entry):
+                    LOG.info("Entry number %s for '%s' was compacted, it will be downloaded "
+                             "after the next update.", one_indexed_entry_num,
+                             self.metadata['name'])
+                    deferred.append(one_indexed_entry_num)
+                    continue
+
                 # Don't overwrite files if we have the matching entry downloaded already, according
                 # to records.
                 if self.feed_state.entries_state_dict.get(entry_num, False):
-                    LOG.info(f"SKIPPING entry number {one_indexed_entry_num} (age {entry_age}) "
-                             f"for '{self.metadata['name']}' - it's recorded as downloaded.")
+                    LOG.info("SKIPPING entry number %s (age %s) "
+                             "for '%s' - it's recorded as downloaded.",
+                             one_indexed_entry_num, entry_age, self.metadata['name'])
 
                 else:
                     urls = entry["urls"]
                     num_entry_files = len(urls)
 
-                    LOG.info(f"Trying to download entry number {one_indexed_entry_num}"
-                             f"(age {entry_age}) for '{self.metadata['name']}'.")
+                    LOG.info("Trying to download entry number %s"
+                             "(age %s) for '%s'.",
+                             one_indexed_entry_num, entry_age, self.metadata['name'])
 
                     # Create directory just for enclosures for this entry if there are many.
                     directory = self.directory
                     if num_entry_files > 1:
                         directory = os.path.join(directory, entry["title"])
-                        msg = f"Creating directory to store {num_entry_files} enclosures."
-                        LOG.info(msg)
+                        LOG.info("Creating directory to store %s enclosures.", num_entry_files)
+
+                    # Loading subscriptions doesn't touch the filesystem, so this is the first
+                    # point the directory has to exist.
+                    util.ensure_dir(directory)
 
                     for i, url in enumerate(urls):
                         if num_entry_files > 1:
-                            LOG.info(f"Downloading enclosure {i+1} of {num_entry_files}.")
+                            LOG.info("Downloading enclosure %s of %s.", i+1, num_entry_files)
 
-                        LOG.debug(f"Extracted url {url} from enclosure.")
+                        LOG.debug("Extracted url %s from enclosure.", url)
 
                         # TODO catch errors? What if we try to save to a nonsense file?
                         dest = self._get_dest(url=url, title=entry["title"], directory=directory)
-                        self.downloader(url=url, dest=dest)
+                        start = time.perf_counter()
+                        with trace.span("download", "download", subscription=self.metadata["name"],
+                                        entry=one_indexed_entry_num, url=url):
+                            self.downloader(url=url, dest=dest)
+                        seconds = time.perf_counter() - start
+                        self.completed_downloads.append({
+                            "time": time.time(),
+                            "subscription": self.metadata["name"],
+                            "number": one_indexed_entry_num,
+                            "id": entry.get("id", None),
+                            "title": entry["title"],
+                            "url": url,
+                            "path": dest,
+                            "bytes": self._record_download(url, dest, seconds),
+                            "seconds": seconds,
+                        })
 
                         self.check_tag_edit_safe(dest, entry)
 
                     if one_indexed_entry_num > self.feed_state.latest_entry_number:
                         self.feed_state.latest_entry_number = one_indexed_entry_num
-                        LOG.info(
-                            f"Have {one_indexed_entry_num} entries for "
-                            f"{self.metadata['name']}.")
+                        LOG.info("Have %s entries for %s.",
+                                 one_indexed_entry_num, self.metadata['name'])
 
                     # Update various things now that we've downloaded a new entry.
                     self.feed_state.entries_state_dict[entry_num] = True
@@ -342,7 +608,15 @@ class Subscription(object):
                         })
 
         except KeyboardInterrupt:
-            self.feed_state.queue.appendleft(entry_num)
+            # The queue holds one-indexed numbers. Nothing was in flight if we were interrupted
+            # before taking anything from it.
+            if one_indexed_entry_num is not None:
+                self.feed_state.queue.appendleft(one_indexed_entry_num)
+
+        finally:
+            self.feed_state.queue.extend(deferred)
+
+        self.compact_entries()
 
     def enqueue(self, nums: List[int]) -> List[int]:
         """
@@ -359,7 +633,7 @@ class Subscription(object):
             if one_indexed_num not in self.feed_state.queue:
                 self.feed_state.queue.append(one_indexed_num)
 
-        LOG.info(f"New queue for {self.metadata['name']}: {list(self.feed_state.queue)}")
+        LOG.info("New queue for %s: %s", self.metadata['name'], list(self.feed_state.queue))
 
         return actual_nums
 
@@ -378,7 +652,7 @@ class Subscription(object):
             num = one_indexed_num - 1
             self.feed_state.entries_state_dict[num] = True
 
-        LOG.info(f"Items marked as downloaded for {self.metadata['name']}: {actual_nums}.")
+        LOG.info("Items marked as downloaded for %s: %s.", self.metadata['name'], actual_nums)
         return actual_nums
 
     def unmark(self, nums: List[int]) -> List[int]:
@@ -397,7 +671,7 @@ class Subscription(object):
             num = one_indexed_num - 1
             self.feed_state.entries_state_dict[num] = False
 
-        LOG.info(f"Items marked as not downloaded for {self.metadata['name']}: {actual_nums}.")
+        LOG.info("Items marked as not downloaded for %s: %s.", self.metadata['name'], actual_nums)
         return actual_nums
 
     def update(
@@ -441,8 +715,6 @@ class Subscription(object):
                 else:
                     self.directory = os.path.join(config_dir, d)
 
-                util.ensure_dir(self.directory)
-
         if url is not None:
             self.url = url
 
@@ -455,6 +727,25 @@ class Subscription(object):
         if metadata is not None:
             self.metadata = {**self.metadata, **metadata}
 
+    def check_directory(self) -> Optional[str]:
+        """
+        Make sure this subscription's directory exists and can be written to.
+
+        :returns: Description of the problem if it can't be used, None otherwise.
+        """
+        if os.path.isfile(self.directory):
+            return f"Directory '{self.directory}' is actually a file."
+
+        try:
+            util.ensure_dir(self.directory)
+        except OSError as exception:
+            return f"Directory '{self.directory}' can't be created: {exception}."
+
+        if not os.access(self.directory, os.W_OK | os.X_OK):
+            return f"Directory '{self.directory}' isn't writable."
+
+        return None
+
     def default_missing_fields(self, settings: Mapping[str, Any]) -> None:
         """
         Set default values for any fields that are None (ones that were never set).
@@ -469,11 +760,11 @@ class Subscription(object):
         if self.settings["use_title_as_filename"] is None:
             self.settings["use_title_as_filename"] = settings["use_title_as_filename"]
 
-        if not hasattr(self, "feed_state") or self.feed_state is None:
-            self.feed_state = _FeedState()
+        if self.settings.get("keep_entries") is None:
+            self.settings["keep_entries"] = settings.get("keep_entries")
 
-        self.downloader = util.generate_downloader(HEADERS, self.metadata["name"])
-        self.parser = _generate_feedparser(self.metadata["name"])
+        if self._feed_state is None and self._feed_state_loader is None:
+            self.feed_state = _FeedState()
 
     def get_status(self, index: int, total_subs: int) -> str:
         """
@@ -497,41 +788,78 @@ class Subscription(object):
         return f"{padded_cur_num}/{total_subs} - '{self.metadata['name']}' " + \
                 f"|{one_indexed_entry_num}|"
 
-    def get_details(self, index: int, total_subs: int) -> None:
+    def get_details(self, index: int, total_subs: int, start: int=1,
+                    limit: Optional[int]=None) -> None:
         """
         Provide multiline summary of subscription state.
+        Runs of entries with the same state are shown as ranges, like '1-340+ 341-345-'.
 
         :param index: Index of this subscription,
             used for display purposes.
         :param total_subs: Total number of subscriptions,
             used for display purposes.
-        :returns: Multiline string containing oneline status,
-            this subscription's queue,
-            and the state of this subscription's entries.
+        :param start: First entry number to show.
+        :param limit: Most entries to show. All entries from start are shown if None.
         """
+        data = self.details_data(start, limit)
+        entries = data["entries"]
+
         detail_lines = []
 
         detail_lines.append(self.get_status(index, total_subs))
 
-        num_entries = len(self.feed_state.entries)
-        pad_num = len(str(num_entries))
-        detail_lines.append("Status of podcast queue:")
-        detail_lines.append(f"{repr(self.feed_state.queue)}")
+        detail_lines.append(f"Status of podcast queue ({data['queue_length']} entries):")
+        detail_lines.append(" ".join(_format_range(first, last) for (first, last) in data["queue"])
+                            or "Empty.")
         detail_lines.append("")
-        detail_lines.append("Status of podcast entries:")
 
-        entry_indicators = []
-        for entry in range(num_entries):
-            if self.feed_state.entries_state_dict.get(entry, False):
-                indicator = "+"
-            else:
-                indicator = "-"
+        if entries["ranges"]:
+            detail_lines.append(f"Status of podcast entries {entries['first']}-{entries['last']} "
+                                f"of {entries['total']}:")
+            detail_lines.append(" ".join(f"{_format_range(r['first'], r['last'])}"
+                                         f"{'+' if r['downloaded'] else '-'}"
+                                         for r in entries["ranges"]))
+        else:
+            detail_lines.append(f"No podcast entries to show ({entries['total']} in feed).")
+
+        if entries["last"] < entries["total"]:
+            detail_lines.append(f"{entries['total'] - entries['last']} more entries after "
+                                f"{entries['last']}.")
 
-            entry_indicators.append(f"{str(entry+1).zfill(pad_num)}{indicator}")
+        LOG.info("\n".join(detail_lines))
 
-        detail_lines.append(" ".join(entry_indicators))
-        details = "\n".join(detail_lines)
-        LOG.info(details)
+    def details_data(self, start: int=1, limit: Optional[int]=None) -> Dict[str, Any]:
+        """
+        Provide state of this subscription's queue and entries, for display or scripting.
+
+        :param start: First entry number to include.
+        :param limit: Most entries to include. All entries from start are included if None.
+        :returns: Dict with the name, latest entry number, the queue as (first, last) runs of
+            consecutive entry numbers, and the requested page of entries as runs of entries with
+            the same downloaded state.
+        """
+        num_entries = len(self.feed_state.entries)
+        first = util.max_clamp(max(start, 1), num_entries + 1)
+        last = num_entries if limit is None else min(num_entries, first + max(limit, 0) - 1)
+
+        # One pass, extending the current run while the state stays the same.
+        downloaded_state = self.feed_state.entries_state_dict
+        ranges: List[Dict[str, Any]] = []
+        for one_indexed_num in range(first, last + 1):
+            downloaded = bool(downloaded_state.get(one_indexed_num - 1, False))
+            if ranges and ranges[-1]["downloaded"] == downloaded:
+                ranges[-1]["last"] = one_indexed_num
+            else:
+                ranges.append({"first": one_indexed_num, "last": one_indexed_num,
+                               "downloaded": downloaded})
+
+        return {
+            "name": self.metadata["name"],
+            "latest": self.latest(),
+            "queue_length": len(self.feed_state.queue),
+            "queue": _compress_nums(self.feed_state.queue),
+            "entries": {"first": first, "last": last, "total": num_entries, "ranges": ranges},
+        }
 
     def get_feed(self, attempt_count: int=0) -> "UpdateResult":
         """
@@ -543,21 +871,21 @@ class Subscription(object):
         """
         res = None
         if attempt_count > MAX_RECURSIVE_ATTEMPTS:
-            LOG.debug(f"Too many recursive attempts ({attempt_count}) to get feed for sub"
-                      f"{self.metadata['name']}, canceling.")
+            LOG.debug("Too many recursive attempts (%s) to get feed for sub"
+                      "%s, canceling.", attempt_count, self.metadata['name'])
             res = UpdateResult.FAILURE
 
         elif self.url is None or self.url == "":
-            LOG.debug(f"URL {self.url} is empty , cannot get feed for sub "
-                      f"{self.metadata['name']}.")
+            LOG.debug("URL %s is empty , cannot get feed for sub "
+                      "%s.", self.url, self.metadata['name'])
             res = UpdateResult.FAILURE
 
         if res is not None:
             return res
 
         else:
-            LOG.info(f"Getting entries (attempt {attempt_count}) for {self.metadata['name']} "
-                     f"from {self.url}.")
+            LOG.info("Getting entries (attempt %s) for %s "
+                     "from %s.", attempt_count, self.metadata['name'], self.url)
 
         (parsed, code) = self._feedparser_parse_with_options()
         if code == UpdateResult.UNNEEDED:
@@ -565,7 +893,7 @@ class Subscription(object):
             return code
 
         elif code != UpdateResult.SUCCESS:
-            LOG.info(f"Feedparser parse failed ({code}), aborting.")
+            LOG.info("Feedparser parse failed (%s), aborting.", code)
             return code
 
         LOG.debug("Feedparser parse succeeded.")
@@ -580,10 +908,12 @@ class Subscription(object):
                 self.url = temp
 
         elif code != UpdateResult.SUCCESS:
-            LOG.debug(f"Ran into HTTP error ({code}), aborting.")
+            LOG.debug("Ran into HTTP error (%s), aborting.", code)
 
         else:
-            self.feed_state.load_rss_info(parsed)
+            with metrics.FEED_PARSE_SECONDS.time(subscription=self.metadata["name"]), \
+                    trace.span("parse", "feed", subscription=self.metadata["name"]):
+                self.feed_state.load_rss_info(parsed)
 
         return code
 
@@ -615,6 +945,8 @@ class Subscription(object):
             alongside metadata,
             to populate ID3v2 tags.
         """
+        import magic
+
         # need to test this is an MP3 file first.
         magic_res = magic.from_file(dest)
 
@@ -634,13 +966,15 @@ class Subscription(object):
 
         if not file_is_mp3:
             LOG.info(
-                f"Skipping adding tags for {dest}, "
-                "because it doesn't seem to be an mp3 file."
+                "Skipping adding tags for %s, "
+                "because it doesn't seem to be an mp3 file.", dest
             )
             return
 
-        LOG.info(f"Editing tags for {dest}.")
-        self.process_tags(dest, entry)
+        LOG.info("Editing tags for %s.", dest)
+        with metrics.TAG_SECONDS.time(subscription=self.metadata["name"]), \
+                trace.span("tag", "download", subscription=self.metadata["name"], dest=dest):
+            self.process_tags(dest, entry)
 
     def process_tags(self, dest: str, entry: Mapping[str, Any]) -> None:
         """
@@ -651,14 +985,16 @@ class Subscription(object):
             alongside metadata,
             to populate ID3v2 tags.
         """
+        import eyed3
+
         audiofile = eyed3.load(dest)
 
         # Process tags. If set to set_tags and tags are empty, write tags.
         # Pull tags into sub metadata if it's not set.
         # Pull tags into entry unless they're empty, and then try sub.
-        LOG.info(f"Artist tag is '{audiofile.tag.artist}'.")
+        LOG.info("Artist tag is '%s'.", audiofile.tag.artist)
         if audiofile.tag.artist == "" and self.settings["set_tags"]:
-            LOG.info(f"Setting artist tag to '{self.metadata['artist']}'.")
+            LOG.info("Setting artist tag to '%s'.", self.metadata['artist'])
             audiofile.tag.artist = self.metadata["artist"]
 
         if self.metadata["artist"] == "":
@@ -669,9 +1005,9 @@ class Subscription(object):
         else:
             entry["metadata"]["artist"] = self.metadata["artist"]
 
-        LOG.info(f"Album tag is '{audiofile.tag.album}'.")
+        LOG.info("Album tag is '%s'.", audiofile.tag.album)
         if audiofile.tag.album == "":
-            LOG.info(f"Setting album tag to '{self.metadata['album']}'.")
+            LOG.info("Setting album tag to '%s'.", self.metadata['album'])
             audiofile.tag.album = self.metadata["album"]
 
         if self.metadata["album"] == "":
@@ -682,9 +1018,9 @@ class Subscription(object):
         else:
             entry["metadata"]["album"] = self.metadata["album"]
 
-        LOG.info(f"Album Artist tag is '{audiofile.tag.album_artist}'.")
+        LOG.info("Album Artist tag is '%s'.", audiofile.tag.album_artist)
         if audiofile.tag.album_artist == "":
-            LOG.info(f"Setting album_artist tag to '{self.metadata['album_artist']}'.")
+            LOG.info("Setting album_artist tag to '%s'.", self.metadata['album_artist'])
             audiofile.tag.album_artist = self.metadata["album_artist"]
 
         if self.metadata["album_artist"] == "":
@@ -695,10 +1031,10 @@ class Subscription(object):
         else:
             entry["metadata"]["album_artist"] = self.metadata["album_artist"]
 
-        LOG.info(f"Title tag is '{audiofile.tag.title}'.")
-        LOG.info(f"Overwrite setting is set to '{self.settings['overwrite_title']}'.")
+        LOG.info("Title tag is '%s'.", audiofile.tag.title)
+        LOG.info("Overwrite setting is set to '%s'.", self.settings['overwrite_title'])
         if audiofile.tag.title == "" or self.settings["overwrite_title"]:
-            LOG.info(f"Setting title tag to '{entry['title']}'.")
+            LOG.info("Setting title tag to '%s'.", entry['title'])
             audiofile.tag.title = entry["title"]
 
         # Store some extra tags on the entry. Doesn't matter if they're empty, they're empty on the
@@ -723,11 +1059,13 @@ class Subscription(object):
             "backlog_limit": self.settings["backlog_limit"],
             "set_tags": self.settings["set_tags"],
             "overwrite_title": self.settings["overwrite_title"],
+            "update_interval": self.settings.get("update_interval"),
+            "keep_entries": self.settings.get("keep_entries"),
             "directory": self.directory
         }
 
     # "Private" class functions (messy internals).
-    def _feedparser_parse_with_options(self) -> Tuple[feedparser.FeedParserDict, "UpdateResult"]:
+    def _feedparser_parse_with_options(self) -> Tuple["feedparser.FeedParserDict", "UpdateResult"]:
         """
         Perform a feedparser parse, providing arguments (like etag) we might want it to use.
         Don't provide etag/last_modified if the last get was unsuccessful.
@@ -740,7 +1078,13 @@ class Subscription(object):
         # NOTE - this naming is a bit confusing here - parser is really a thing you call with
         # arguments to get a feedparser result.
         # Maybe better called parser-generator, or parse-performer or something?
-        parsed = self.parser(self.url, self.feed_state.etag, last_mod)
+        host = metrics.host_of(self.url)
+        with metrics.FEED_FETCH_SECONDS.time(subscription=self.metadata["name"], host=host), \
+                trace.span("fetch", "feed", subscription=self.metadata["name"], url=self.url):
+            parsed = self.parser(self.url, self.feed_state.etag, last_mod)
+
+        status = parsed.get("status", "error" if parsed.get("bozo", None) == 1 else "none")
+        metrics.FEED_RESPONSES.inc(subscription=self.metadata["name"], host=host, status=status)
 
         self.feed_state.etag = parsed.get("etag", self.feed_state.etag)
         self.feed_state.store_last_modified(parsed.get("modified_parsed", None))
@@ -756,18 +1100,34 @@ class Subscription(object):
             else:
                 msg = repr(parsed.bozo_exception)
 
-            LOG.info(f"Unable to retrieve feed for {self.metadata['name']} from {self.url}.")
-            LOG.debug(f"Update failed because bozo exception {msg} occurred.")
+            LOG.info("Unable to retrieve feed for %s from %s.", self.metadata['name'], self.url)
+            LOG.debug("Update failed because bozo exception %s occurred.", msg)
             return (None, UpdateResult.FAILURE)
 
-        elif parsed.get("status") == requests.codes["NOT_MODIFIED"]:
+        elif parsed.get("status") == HTTPStatus.NOT_MODIFIED:
             LOG.debug("No update to feed, nothing to do.")
             return (None, UpdateResult.UNNEEDED)
 
         else:
             return (parsed, UpdateResult.SUCCESS)
 
-    def _handle_http_codes(self, parsed: feedparser.FeedParserDict) -> "UpdateResult":
+    def _record_download(self, url: str, dest: str, seconds: float) -> Optional[int]:
+        """Record size and speed of a finished download, and provide its size, if known."""
+        labels = {"subscription": self.metadata["name"], "host": metrics.host_of(url)}
+        metrics.DOWNLOAD_SECONDS.observe(seconds, **labels)
+
+        try:
+            size = os.path.getsize(dest)
+        except OSError:
+            return None
+
+        metrics.DOWNLOAD_BYTES.inc(size, **labels)
+        if seconds > 0:
+            metrics.DOWNLOAD_THROUGHPUT.observe(size / seconds, **labels)
+
+        return size
+
+    def _handle_http_codes(self, parsed: "feedparser.FeedParserDict") -> "UpdateResult":
         """
         Given feedparser parse result, determine if parse succeeded, and what to do about that.
         """
@@ -778,46 +1138,51 @@ class Subscription(object):
 
         status = parsed.get("status", 200)
         result = UpdateResult.SUCCESS
-        if status == requests.codes["NOT_FOUND"]:
-            LOG.error(f"Saw status {status}, unable to retrieve feed text for "
-                      f"{self.metadata['name']}."
-                      f"\nStored URL {self.url} for {self.metadata['name']} will be preserved"
-                      f"and checked again on next attempt.")
+        if status == HTTPStatus.NOT_FOUND:
+            LOG.error("Saw status %s, unable to retrieve feed text for "
+                      "%s."
+                      "\nStored URL %s for %s will be preserved"
+                      "and checked again on next attempt.",
+                      status, self.metadata['name'], self.url, self.metadata['name'])
 
             result = UpdateResult.FAILURE
 
-        elif status in [requests.codes["UNAUTHORIZED"], requests.codes["GONE"]]:
-            LOG.error(f"Saw status {status}, unable to retrieve feed text for "
-                      f"{self.metadata['name']}."
-                      f"\nClearing stored URL {self.url} for {self.metadata['name']}."
-                      f"\nPlease provide new URL and authorization for subscription "
-                      f"{self.metadata['name']}.")
+        elif status in [HTTPStatus.UNAUTHORIZED, HTTPStatus.GONE]:
+            LOG.error("Saw status %s, unable to retrieve feed text for "
+                      "%s."
+                      "\nClearing stored URL %s for %s."
+                      "\nPlease provide new URL and authorization for subscription "
+                      "%s.",
+                      status, self.metadata['name'], self.url, self.metadata['name'],
+                      self.metadata['name'])
 
             self.url = ""
             result = UpdateResult.FAILURE
 
         # handle redirecting errors
-        elif status in [requests.codes["MOVED_PERMANENTLY"], requests.codes["PERMANENT_REDIRECT"]]:
-            LOG.warning(f"Saw status {status} indicating permanent URL change."
-                        f"\nChanging stored URL {self.url} for {self.metadata['name']} to "
-                        f"{parsed.get('href')} and attempting get with new URL.")
+        elif status in [HTTPStatus.MOVED_PERMANENTLY, HTTPStatus.PERMANENT_REDIRECT]:
+            LOG.warning("Saw status %s indicating permanent URL change."
+                        "\nChanging stored URL %s for %s to "
+                        "%s and attempting get with new URL.",
+                        status, self.url, self.metadata['name'], parsed.get('href'))
 
             self.url = parsed.get("href")
             result = UpdateResult.ATTEMPT_AGAIN
 
-        elif status in [requests.codes["FOUND"], requests.codes["SEE_OTHER"],
-                        requests.codes["TEMPORARY_REDIRECT"]]:
-            LOG.warning(f"Saw status {status} indicating temporary URL change."
-                        f"\nAttempting with new URL {parsed.get('href')}."
-                        f"\nStored URL {self.url} for {self.metadata['name']} will be unchanged.")
+        elif status in [HTTPStatus.FOUND, HTTPStatus.SEE_OTHER,
+                        HTTPStatus.TEMPORARY_REDIRECT]:
+            LOG.warning("Saw status %s indicating temporary URL change."
+                        "\nAttempting with new URL %s."
+                        "\nStored URL %s for %s will be unchanged.",
+                        status, parsed.get('href'), self.url, self.metadata['name'])
 
             self.temp_url = self.url
             self.url = parsed.get("href")
             result = UpdateResult.ATTEMPT_AGAIN
 
         elif status != 200:
-            LOG.warning(f"Saw '{status}'. Retrying retrieve for {self.metadata['name']} "
-                        f"at {self.url}.")
+            LOG.warning("Saw '%s'. Retrying retrieve for %s at %s.",
+                        status, self.metadata['name'], self.url)
             result = UpdateResult.ATTEMPT_AGAIN
 
         else:
@@ -857,7 +1222,31 @@ class Subscription(object):
         return os.path.join(directory, filename)
 
     def __eq__(self, rhs: Any) -> bool:
-        return isinstance(rhs, Subscription) and repr(self) == repr(rhs)
+        if not isinstance(rhs, Subscription):
+            return False
+
+        if self is rhs:
+            return True
+
+        # Cheap fields first, so most mismatches never get as far as the feed state.
+        if (self.metadata != rhs.metadata or
+                self.url != rhs.url or
+                self.original_url != rhs.original_url or
+                self.directory != rhs.directory or
+                self.settings != rhs.settings):
+            return False
+
+        # Unloaded feed states from the same cache shard are the same state, no need to load them.
+        if (not self.feed_state_loaded and not rhs.feed_state_loaded and
+                self.cache_key is not None and self.cache_key == rhs.cache_key):
+            return True
+
+        return self.feed_state == rhs.feed_state
+
+    def __hash__(self) -> int:
+        # Only identity fields, which equal subscriptions always share.
+        # Don't rename or re-point a subscription while it's in a set or used as a dict key.
+        return hash((self.metadata["name"], self.original_url))
 
     def __ne__(self, rhs: Any) -> bool:
         return not self.__eq__(rhs)
@@ -869,14 +1258,56 @@ class Subscription(object):
         return str(self)
 
 
+class LazySubscription(object):
+    """
+    Cached subscription that hasn't been decoded yet.
+    Only the fields needed to match it against the config file are read up front.
+    """
+
+    def __init__(
+            self,
+            sub_dictionary: Mapping[str, Any],
+            feed_state_loader: Optional[Callable[[], Optional[Mapping[str, Any]]]]=None,
+    ) -> None:
+        """
+        Object constructor for lazy subscription.
+
+        :param sub_dictionary: Encoded subscription or cache index record.
+        :param feed_state_loader: Loader for the feed state, see decode_subscription.
+        """
+        self.sub_dictionary = sub_dictionary
+        self.feed_state_loader = feed_state_loader
+
+        self.name: Optional[str] = sub_dictionary.get("name", None)
+        self.original_url: Optional[str] = sub_dictionary.get("original_url", None)
+
+        self._sub: Optional[Subscription] = None
+
+    def decode(self) -> Subscription:
+        """
+        Decode into a full subscription. The feed state itself stays lazy.
+        Repeated calls provide the same object.
+
+        :returns: Decoded subscription.
+        """
+        if self._sub is None:
+            self._sub = Subscription.decode_subscription(self.sub_dictionary,
+                                                         feed_state_loader=self.feed_state_loader)
+            self._sub.cache_key = self.sub_dictionary.get("shard", None)
+
+        return self._sub
+
+
 class _FeedState(object):
-    def __init__(self, feedstate_dict: Mapping[str, Any]=None) -> None:
+    def __init__(self, feedstate_dict: Optional[Mapping[str, Any]]=None) -> None:
         if feedstate_dict is not None:
             LOG.debug("Successfully loaded feed state dict.")
 
-            self.feed = feedstate_dict.get("feed", {})
-            self.entries = feedstate_dict.get("entries", [])
-            self.entries_state_dict = feedstate_dict.get("entries_state_dict", {})
+            # Copied, so the feed state never shares mutable state with what it was decoded from
+            # (like another subscription's as_dict).
+            self.feed = dict(feedstate_dict.get("feed", {}))
+            self.entries = [_copy_entry(entry) for entry in feedstate_dict.get("entries", [])]
+            self.entries_state_dict = dict(feedstate_dict.get("entries_state_dict", {}))
             self.queue = collections.deque(feedstate_dict.get("queue", []))
 
             # Store the most recent SUMMARY_LIMIT items we've downloaded.
@@ -889,8 +1320,7 @@ class _FeedState(object):
             # When we load from the cache file, mark all of the items in the summary queue as not
             # being from the current session.
             for elem in temp_list:
-                elem["is_this_session"] = False
-                self.summary_queue.append(elem)
+                self.summary_queue.append({**elem, "is_this_session": False})
 
             last_modified = feedstate_dict.get("last_modified", None)
             self.store_last_modified(last_modified)
@@ -911,21 +1341,59 @@ class _FeedState(object):
             self.etag = ""
             self.latest_entry_number = None
 
-    def load_rss_info(self, parsed: feedparser.FeedParserDict) -> None:
+    def load_rss_info(self, parsed: "feedparser.FeedParserDict") -> None:
         """
         Load some RSS subscription elements into this feed state."""
         self.entries = []
         for entry in parsed.get("entries"):
             new_entry = {}
             new_entry["title"] = entry["title"]
+            new_entry["id"] = entry.get("id", None)
 
             new_entry["urls"] = []
             new_entry["metadata"] = {}
-            for enclosure in entry["enclosures"]:
-                new_entry["urls"].append(enclosure["href"])
+            # Items without enclosures (text posts) are kept, so entry numbers match the feed.
+            for enclosure in entry.get("enclosures", None) or []:
+                if enclosure.get("href", None):
+                    new_entry["urls"].append(enclosure["href"])
 
             self.entries.append(new_entry)
 
+    def compact(self, keep: int) -> int:
+        """
+        Replace old entries that are done with by tombstones, holding only the entry's ID and
+        whether it was downloaded. Tombstones keep their place, so entry numbers don't change.
+        Entries are done with once they're at or below the latest entry number, unless they're
+        queued or were unmarked.
+        Updates parse the whole feed again, so this has to be repeated after each one.
+
+        :param keep: Number of newest entries to always keep whole.
+        :returns: Number of entries compacted.
+        """
+        if self.latest_entry_number is None:
+            return 0
+
+        queued = set(self.queue)
+        num_entries = len(self.entries)
+        compacted = 0
+
+        # Entries are newest first, so entry number n is at position num_entries - n.
+        for position in range(max(keep, 0), num_entries):
+            one_indexed_num = num_entries - position
+            entry = self.entries[position]
+            if (is_tombstone(entry) or one_indexed_num > self.latest_entry_number or
+                    one_indexed_num in queued or
+                    self.entries_state_dict.get(one_indexed_num - 1, None) is False):
+                continue
+
+            self.entries[position] = {
+                "id": entry.get("id", None),
+                "downloaded": bool(self.entries_state_dict.get(one_indexed_num - 1, False)),
+            }
+            compacted += 1
+
+        return compacted
+
     def as_dict(self) -> Dict[str, Any]:
         """
         Return dictionary of this feed state object.
@@ -955,6 +1423,20 @@ class _FeedState(object):
             LOG.debug("Unhandled 'last_modified' type, ignoring.")
             self.last_modified = None
 
+    def __eq__(self, rhs: Any) -> bool:
+        # Same fields as as_dict, cheapest first.
+        return (isinstance(rhs, _FeedState) and
+                self.latest_entry_number == rhs.latest_entry_number and
+                self.etag == rhs.etag and
+                len(self.entries) == len(rhs.entries) and
+                list(self.queue) == list(rhs.queue) and
+                list(self.summary_queue) == list(rhs.summary_queue) and
+                self.entries_state_dict == rhs.entries_state_dict and
+                self.entries == rhs.entries)
+
+    def __ne__(self, rhs: Any) -> bool:
+        return not self.__eq__(rhs)
+
     def __str__(self) -> str:
         return str(self.as_dict())
 
@@ -962,18 +1444,35 @@ class _FeedState(object):
         return str(self)
 
 
+def is_tombstone(entry: Mapping[str, Any]) -> bool:
+    """
+    Check whether a feed state entry was compacted.
+
+    :param entry: Entry from a feed state.
+    :returns: True if only the entry's ID and download state are left.
+    """
+    return "urls" not in entry
+
+
 # "Private" file functions (messy internals).
+def _copy_entry(entry: Mapping[str, Any]) -> Dict[str, Any]:
+    """Copy a feed state entry, and the lists and dicts in it (tagging updates its metadata)."""
+    return {key: (value.copy() if isinstance(value, (list, dict)) else value)
+            for (key, value) in entry.items()}
+
+
 def _process_directory(d: Optional[str]) -> str:
-    """Assign directory if none was given, and create directory if necessary."""
+    """
+    Assign directory if none was given.
+    Directories aren't created here - that waits until something is downloaded into them.
+    """
     if d is None:
-        LOG.debug(f"No directory provided, creating a default one.")
+        LOG.debug("No directory provided, using the default one.")
         return util.expand(constants.APPDIRS.user_data_dir)
 
     directory = util.expand(d)
 
-    LOG.debug(f"Using directory {directory}.")
-
-    util.ensure_dir(directory)
+    LOG.debug("Using directory %s.", directory)
 
     return directory
 
@@ -982,15 +1481,21 @@ def _filter_nums(*, nums: List[int], min_lim: int=0, max_lim: int) -> List[int]:
     """Given two limits, remove elements from the list that aren't in that range."""
     return [num for num in nums if num > min_lim and num <= max_lim]
 
-def _generate_feedparser(name: str) -> Any:
-    """Perform rate-limited parse with feedparser."""
 
-    @util.rate_limited(120, name)
-    def _rate_limited_parser(url: str, etag: str, last_modified: Any) -> feedparser.FeedParserDict:
-        # pylint: disable=no-member
-        return feedparser.parse(url, etag=etag, modified=last_modified)
+def _compress_nums(nums: Iterable[int]) -> List[Tuple[int, int]]:
+    """Collapse runs of consecutive numbers, keeping their order, into (first, last) pairs."""
+    runs: List[Tuple[int, int]] = []
+    for num in nums:
+        if runs and num == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], num)
+        else:
+            runs.append((num, num))
+
+    return runs
+
 
-    return _rate_limited_parser
+def _format_range(first: int, last: int) -> str:
+    return str(first) if first == last else f"{first}-{last}"
 
 
 class UpdateResult(enum.Enum):
@@ -0,0 +1,204 @@
+"""Tests for the cache module."""
+import os
+import sqlite3
+from typing import Any, Dict
+
+import pytest
+import umsgpack
+
+import puckfetcher.cache as cache
+import puckfetcher.codec as codec
+
+
+def test_save_and_load(sharded_cache: cache.ShardedCache) -> None:
+    """Index records and shards should come back as they were saved."""
+    records = [{"name": "a", "shard": "ka"}, {"name": "b", "shard": "kb"}]
+    shards = {"ka": {"entries": [1, 2]}, "kb": {"entries": []}}
+
+    assert not sharded_cache.exists()
+
+    sharded_cache.save(records, shards)
+
+    assert sharded_cache.exists()
+    assert _strip(sharded_cache.load_index()) == records
+    assert _strip(sharded_cache.load_shard("ka")) == {"entries": [1, 2]}
+    assert _strip(sharded_cache.shard_loader("kb")()) == {"entries": []}
+
+
+def test_unchanged_shards_kept(sharded_cache: cache.ShardedCache) -> None:
+    """Shards not provided on save should be left alone, unless no record references them."""
+    sharded_cache.save([{"shard": "ka"}, {"shard": "kb"}],
+                       {"ka": {"x": 1, "entries": []}, "kb": {"x": 2, "entries": []}})
+    sharded_cache.save([{"shard": "ka"}], {})
+
+    shard = sharded_cache.load_shard("ka")
+    assert shard is not None
+    assert shard["x"] == 1
+    assert not os.path.exists(os.path.join(sharded_cache.shard_dir, "kb"))
+
+
+def test_missing_shard(sharded_cache: cache.ShardedCache) -> None:
+    """Missing shards should load as None rather than failing."""
+    sharded_cache.save([], {})
+
+    assert sharded_cache.load_shard("nope") is None
+
+
+def test_sqlite_round_trip(sqlite_cache: cache.SqliteCache) -> None:
+    """Feed state should come back from the database as it went in."""
+    feed_state = _feed_state()
+    records = [{"name": "a", "url": "u", "original_url": "u", "shard": "ka"}]
+
+    assert not sqlite_cache.exists()
+
+    sqlite_cache.save(records, {"ka": feed_state})
+
+    assert sqlite_cache.exists()
+    assert _strip(sqlite_cache.load_index()) == records
+    assert _strip(sqlite_cache.load_shard("ka")) == feed_state
+
+    # Tables are created once, and the database remembers its schema version.
+    with sqlite3.connect(sqlite_cache.db_file) as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == cache.SCHEMA_VERSION
+
+    fresh = cache.SqliteCache(sqlite_cache.cache_dir)
+    assert _strip(fresh.load_index()) == records
+
+
+def test_sqlite_entry_updates(sqlite_cache: cache.SqliteCache) -> None:
+    """Changing entry state should only touch that entry, and dropped subs should be removed."""
+    records = [{"name": "a", "url": "u", "original_url": "u", "shard": "ka"},
+               {"name": "b", "url": "v", "original_url": "v", "shard": "kb"}]
+    sqlite_cache.save(records, {"ka": _feed_state(), "kb": _feed_state()})
+
+    feed_state = _feed_state()
+    feed_state["entries_state_dict"][1] = True
+    feed_state["queue"] = []
+    sqlite_cache.save(records[0:1], {"ka": feed_state})
+
+    assert _strip(sqlite_cache.load_shard("ka")) == feed_state
+    assert sqlite_cache.load_shard("kb") is None
+    assert [r["name"] for r in sqlite_cache.load_index()] == ["a"]
+
+    with sqlite3.connect(sqlite_cache.db_file) as conn:
+        guids = conn.execute("SELECT number FROM entries WHERE guid = ?", ("g2",)).fetchall()
+    assert guids == [(1,)]
+
+
+def test_stream_records(tmpdir: Any) -> None:
+    """Streaming should skip unwanted records and decode the rest exactly."""
+    records = [
+        {"name": "a", "original_url": "u", "data": [None, True, 1.5, -3, 2 ** 40, b"x" * 300]},
+        {"name": "b", "original_url": "v", "data": {"s" * 40: "t" * 70000, 1: [{}] * 20}},
+        {"name": "c", "original_url": "w", "data": umsgpack.Ext(5, b"abcd")},
+    ]
+    path = str(tmpdir.join("records"))
+    with open(path, "wb") as stream:
+        stream.write(umsgpack.packb(records))
+
+    # Ext types decode differently per codec, so stick to the one that wrote them.
+    record_codec = codec.CODECS["umsgpack"]
+    assert list(cache.iter_packed_records(path, record_codec=record_codec)) == records
+
+    wanted = list(cache.iter_packed_records(path, lambda peek: peek["name"] != "b",
+                                            record_codec))
+    assert wanted == [records[0], records[2]]
+
+    assert list(cache.iter_packed_records(str(tmpdir.join("missing")))) == []
+
+
+@pytest.mark.parametrize("compression", [None, *codec.COMPRESSORS])
+@pytest.mark.parametrize("codec_name", list(codec.CODECS))
+def test_codecs_and_compression(tmpdir: Any, compression: str, codec_name: str) -> None:
+    """Every codec and compression should round trip, and be readable by every other codec."""
+    writer = cache.ShardedCache(str(tmpdir), compression=compression, codec_name=codec_name)
+    writer.save([{"name": "a", "shard": "ka"}], {"ka": _feed_state()})
+
+    for other_codec in codec.CODECS:
+        reader = cache.ShardedCache(str(tmpdir), codec_name=other_codec)
+        assert _strip(reader.load_shard("ka")) == _feed_state()
+        assert _strip(reader.load_index()) == [{"name": "a", "shard": "ka"}]
+
+
+@pytest.mark.parametrize("compression", list(codec.COMPRESSORS))
+def test_corrupt_compressed_shard(sharded_cache: cache.ShardedCache, compression: str) -> None:
+    """Shards whose entries don't decompress should be reset, whatever the compression."""
+    os.makedirs(sharded_cache.shard_dir, exist_ok=True)
+    with open(os.path.join(sharded_cache.shard_dir, "ka"), "wb") as stream:
+        stream.write(sharded_cache.codec.packb({"compression": compression,
+                                                "entries": b"\x28\xb5\x2f\xfdgarbage"}))
+
+    assert sharded_cache.load_shard("ka") is None
+
+    with pytest.raises(codec.DecompressionError):
+        codec.decompress(compression, b"garbage")
+
+
+@pytest.mark.parametrize("backend", list(cache.BACKENDS))
+def test_history(tmpdir: Any, backend: str) -> None:
+    """History should be queryable by recency, time and subscription, across appends."""
+    history_cache = cache.get_backend(backend, str(tmpdir))
+    items = [{"time": 1000.0 + i, "shard": "ka" if i % 2 == 0 else "kb", "number": i}
+             for i in range(10)]
+
+    assert history_cache.load_history() == []
+
+    history_cache.append_history(items[0:4])
+    history_cache.append_history(items[4:])
+
+    assert history_cache.load_history() == list(reversed(items))
+    assert [item["number"] for item in history_cache.load_history(limit=3)] == [9, 8, 7]
+    assert [item["number"] for item in history_cache.load_history(since=1006.5)] == [9, 8, 7]
+    assert [item["number"] for item in history_cache.load_history(shard="kb")] == [9, 7, 5, 3, 1]
+    assert [item["number"] for item in
+            history_cache.load_history(shard="ka", since=1003.0, limit=2)] == [8, 6]
+    assert history_cache.load_history(shard="kc") == []
+
+
+def test_migrate_old_format() -> None:
+    """Unversioned feed states should gain entry GUIDs when migrated."""
+    old = {"name": "a", "feed_state": {"entries": [{"title": "t", "urls": []}]}}
+
+    migrated = cache.migrate_record(old)
+
+    assert migrated["__format__"] == cache.FORMAT_VERSION
+    assert migrated["feed_state"]["__format__"] == cache.FORMAT_VERSION
+    assert migrated["feed_state"]["entries"] == [{"title": "t", "urls": [], "id": None}]
+
+
+# Helpers.
+def _strip(data: Any) -> Any:
+    """Remove cache format bookkeeping, to compare with what was saved."""
+    if isinstance(data, list):
+        return [_strip(item) for item in data]
+
+    return {k: v for (k, v) in data.items() if k not in ("__format__", "compression")}
+
+
+
+def _feed_state() -> Dict[str, Any]:
+    return {
+        "entries": [
+            {"title": "two", "id": "g1", "urls": ["b"], "metadata": {}},
+            {"title": "one", "id": "g2", "urls": ["a"], "metadata": {}},
+        ],
+        "entries_state_dict": {0: True, 5: False},
+        "queue": [2],
+        "latest_entry_number": 1,
+        "summary_queue": [{"number": 1, "name": "one", "is_this_session": False}],
+        "last_modified": None,
+        "etag": "abc",
+    }
+
+
+# Fixtures.
+@pytest.fixture(scope="function")
+def sharded_cache(tmpdir: Any) -> cache.ShardedCache:
+    """Create a sharded cache in a temporary directory."""
+    return cache.ShardedCache(str(tmpdir.mkdir("cache")))
+
+
+@pytest.fixture(scope="function")
+def sqlite_cache(tmpdir: Any) -> cache.SqliteCache:
+    """Create a SQLite cache in a temporary directory."""
+    return cache.SqliteCache(str(tmpdir.mkdir("cache")))
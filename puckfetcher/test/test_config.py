@@ -1,13 +1,16 @@
 """Tests for the config module."""
 import copy
 import os
-from typing import Any, List, Tuple
+from typing import Any, List, Mapping, Sequence, Tuple
 
 import pytest
 import umsgpack
 import yaml
 
+import puckfetcher.cache as cache
 import puckfetcher.config as config
+import puckfetcher.error as error
+import puckfetcher.fetch as fetch
 import puckfetcher.subscription as subscription
 
 
@@ -54,6 +57,20 @@ def test_non_config_subs_ignore(default_config: config.Config, default_conf_file
     assert default_config.subscriptions == subscriptions[0:1]
 
 
+def test_unmatched_cache_not_decoded(default_config: config.Config, default_conf_file: str,
+                                     default_cache_file: str,
+                                     subscriptions: List[subscription.Subscription],
+                                     ) -> None:
+    """Only cached subscriptions matched to the config file should be decoded."""
+    write_subs_to_file(subs=subscriptions, out_file=default_cache_file, write_type="cache")
+    write_subs_to_file(subs=subscriptions[0:1], out_file=default_conf_file, write_type="config")
+
+    default_config.load_state()
+
+    assert list(default_config.cache_map["by_name"]) == [subscriptions[0].metadata["name"]]
+    assert not default_config.subscriptions[0].feed_state_loaded
+
+
 def test_subscriptions_matching(default_config: config.Config, default_conf_file: str,
                                 default_cache_file: str,
                                 subscriptions: List[subscription.Subscription],
@@ -93,7 +110,7 @@ def test_subscriptions_matching(default_config: config.Config, default_conf_file
         assert sub.feed_state.latest_entry_number == test_nums[i]
 
 
-def test_save_works(default_config: config.Config, default_cache_file: str,
+def test_save_works(default_config: config.Config,
                     subscriptions: List[subscription.Subscription],
                     ) -> None:
     """Test that we can save subscriptions correctly."""
@@ -101,14 +118,151 @@ def test_save_works(default_config: config.Config, default_cache_file: str,
 
     default_config.save_cache()
 
-    with open(default_cache_file, "rb") as stream:
-        contents = stream.read()
-        unpacked_contents = umsgpack.unpackb(contents)
-        subs = [subscription.Subscription.decode_subscription(sub) for sub in unpacked_contents]
+    subs = []
+    for record in default_config.cache.load_index():
+        loader = default_config.cache.shard_loader(record["shard"])
+        subs.append(subscription.Subscription.decode_subscription(record,
+                                                                  feed_state_loader=loader))
 
     assert default_config.subscriptions == subs
 
 
+def test_history_kept_until_saved(default_config: config.Config,
+                                  subscriptions: List[subscription.Subscription],
+                                  monkeypatch: Any) -> None:
+    """Completed downloads should only be dropped once they're in the download history."""
+    default_config.subscriptions = subscriptions
+    sub = subscriptions[0]
+    sub.completed_downloads = [{"time": 1000.0, "subscription": sub.metadata["name"],
+                                "number": 1}]
+
+    def _broken_append(items: List[Any]) -> None:
+        raise OSError("No space left on device.")
+
+    monkeypatch.setattr(default_config.cache, "append_history", _broken_append)
+    with pytest.raises(OSError):
+        default_config.save_cache()
+    assert len(sub.completed_downloads) == 1
+
+    monkeypatch.undo()
+    default_config.save_cache()
+    assert sub.completed_downloads == []
+    assert [item["number"] for item in default_config.cache.load_history()] == [1]
+
+
+def test_list_reads_only_index(default_config: config.Config, default_conf_file: str,
+                               subscriptions: List[subscription.Subscription],
+                               ) -> None:
+    """Listing subscriptions shouldn't load any feed state from the cache."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    for i, sub in enumerate(subscriptions):
+        sub.feed_state.latest_entry_number = i + 5
+
+    default_config.subscriptions = subscriptions
+    default_config.save_cache()
+
+    default_config.load_state()
+    default_config.list()
+
+    for i, sub in enumerate(default_config.subscriptions):
+        assert not sub.feed_state_loaded
+        assert sub.latest() == i + 5
+
+    assert default_config.subscriptions[1].feed_state.latest_entry_number == 6
+    assert default_config.subscriptions[1].feed_state_loaded
+
+
+def test_corrupt_shard_is_isolated(default_config: config.Config, default_conf_file: str,
+                                   subscriptions: List[subscription.Subscription],
+                                   ) -> None:
+    """A corrupt shard should only reset the feed state of its own subscription."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    for sub in subscriptions:
+        sub.feed_state.latest_entry_number = 3
+        sub.feed_state.queue.append(1)
+
+    default_config.subscriptions = subscriptions
+    default_config.save_cache()
+
+    assert isinstance(default_config.cache, cache.ShardedCache)
+    assert subscriptions[0].cache_key is not None
+    with open(os.path.join(default_config.cache.shard_dir, subscriptions[0].cache_key),
+              "wb") as stream:
+        stream.write(b"\xc1garbage")
+
+    default_config.load_state()
+
+    (broken, *rest) = default_config.subscriptions
+    assert list(broken.feed_state.queue) == []
+    assert broken.feed_state.latest_entry_number == 3
+    for sub in rest:
+        assert list(sub.feed_state.queue) == [1]
+
+
+def test_old_cache_migrated(default_config: config.Config, default_conf_file: str,
+                            default_cache_file: str,
+                            subscriptions: List[subscription.Subscription],
+                            ) -> None:
+    """The old single-file cache should be read, and moved aside once the sharded one is saved."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    write_subs_to_file(subs=subscriptions, out_file=default_cache_file, write_type="cache")
+
+    default_config.load_state()
+    default_config.save_cache()
+
+    assert default_config.cache.exists()
+    assert not os.path.exists(default_cache_file)
+    assert os.path.isfile(f"{default_cache_file}.old")
+
+    default_config.load_state()
+    assert default_config.subscriptions == subscriptions
+
+
+def test_migrate_cache(default_config: config.Config, default_conf_file: str,
+                       subscriptions: List[subscription.Subscription],
+                       ) -> None:
+    """Migrating should copy the msgpack cache into the SQLite cache."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    for sub in subscriptions:
+        sub.feed_state.latest_entry_number = 7
+
+    default_config.subscriptions = subscriptions
+    default_config.save_cache()
+
+    with open(default_conf_file, "a", encoding="UTF-8") as stream:
+        stream.write("cache_backend: sqlite\n")
+
+    default_config.load_state()
+    assert isinstance(default_config.cache, cache.SqliteCache)
+    assert not default_config.cache.exists()
+
+    default_config.migrate_cache()
+
+    default_config.load_state()
+    assert default_config.cache.exists()
+    assert default_config.subscriptions == subscriptions
+    for sub in default_config.subscriptions:
+        assert sub.feed_state.latest_entry_number == 7
+
+
+def test_load_creates_no_dirs(default_config: config.Config, default_conf_file: str,
+                              subscriptions: List[subscription.Subscription],
+                              ) -> None:
+    """Loading shouldn't create subscription directories, but checking them should."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+
+    default_config.load_state()
+
+    for sub in default_config.subscriptions:
+        assert not os.path.exists(sub.directory)
+
+    open(default_config.subscriptions[0].directory, "w").close()
+
+    assert default_config.check_dirs() == [subscriptions[0].metadata["name"]]
+    for sub in default_config.subscriptions[1:]:
+        assert os.path.isdir(sub.directory)
+
+
 def test_reload_config(default_config: config.Config, default_conf_file: str,
                                 default_cache_file: str,
                                 subscriptions: List[subscription.Subscription],
@@ -133,6 +287,230 @@ def test_reload_config(default_config: config.Config, default_conf_file: str,
     assert default_config.subscriptions == new_subscriptions
 
 
+def test_reload_only_changed(default_config: config.Config, default_conf_file: str,
+                             subscriptions: List[subscription.Subscription],
+                             ) -> None:
+    """Reloading should only touch added, removed and modified subscriptions."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    default_config.load_state()
+
+    (untouched, modified, removed) = default_config.subscriptions
+    untouched.feed_state.queue.append(3)
+
+    new_subscriptions = copy.deepcopy(subscriptions[0:2])
+    new_subscriptions[1].metadata["artist"] = "foo"
+    new_subscriptions.append(subscription.Subscription(name="added", url="addedurl",
+                                                       directory=subscriptions[0].directory))
+    write_subs_to_file(subs=new_subscriptions, out_file=default_conf_file, write_type="config")
+
+    result = default_config.reload_config()
+
+    assert result.added == ["added"]
+    assert result.removed == [removed.metadata["name"]]
+    assert result.modified == [modified.metadata["name"]]
+
+    assert default_config.subscriptions[0] is untouched
+    assert list(untouched.feed_state.queue) == [3]
+    assert default_config.subscriptions[1] is modified
+    assert modified.metadata["artist"] == "foo"
+    assert default_config.subscriptions[2].metadata["name"] == "added"
+
+
+def test_batch_saves_once(default_config: config.Config, default_conf_file: str,
+                          subscriptions: List[subscription.Subscription], monkeypatch: Any,
+                          ) -> None:
+    """Batch commands should all apply, bad lines should be reported, and the cache saved once."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    default_config.load_state()
+    for sub in default_config.subscriptions:
+        sub.feed_state.entries = [{"title": f"Entry {i}", "id": f"id-{i}", "urls": [],
+                                   "metadata": {}} for i in range(20, 0, -1)]
+
+    saves = []
+    real_save = default_config.cache.save
+
+    def _recording_save(records: Sequence[Mapping[str, Any]],
+                        shards: Mapping[str, Any]) -> None:
+        saves.append(records)
+        real_save(records, shards)
+
+    monkeypatch.setattr(default_config.cache, "save", _recording_save)
+
+    lines = [
+        "# Comment line.",
+        "mark test0 1-3",
+        "",
+        "enqueue 'TEST1' 4,5",
+        "unmark 1 2",
+        "mark nobody 1",
+        "frobnicate test0 1",
+    ]
+    failures = default_config.batch(lines)
+
+    assert failures == 2
+    assert len(saves) == 1
+
+    (first, second, _) = default_config.subscriptions
+    assert first.feed_state.entries_state_dict == {0: True, 1: False, 2: True}
+    assert list(second.feed_state.queue) == [4, 5]
+
+
+def test_shared_cache_keeps_changes(config_dirs: Tuple[str, str, str], default_conf_file: str,
+                                    subscriptions: List[subscription.Subscription]) -> None:
+    """Configs sharing a cache should keep each other's saves, and not share leases."""
+    write_subs_to_file(subs=subscriptions, out_file=default_conf_file, write_type="config")
+    ours = config.Config(*config_dirs)
+    ours.load_state()
+    ours.save_cache()
+    theirs = config.Config(*config_dirs)
+    theirs.load_state()
+
+    for conf in [ours, theirs]:
+        for sub in conf.subscriptions:
+            sub.feed_state.entries = [{"title": f"Entry {i}", "id": None, "urls": [],
+                                       "metadata": {}} for i in range(20, 0, -1)]
+
+    ours.enqueue(0, [1, 2])
+    theirs.enqueue(1, [3])
+
+    fresh = config.Config(*config_dirs)
+    fresh.load_state()
+    assert [sub.queue_length() for sub in fresh.subscriptions] == [2, 1, 0]
+
+    with ours.leased(ours.subscriptions[1]) as leased_sub:
+        assert leased_sub is not None
+        assert list(leased_sub.feed_state.queue) == [3]
+        assert ours.subscriptions[1] is leased_sub
+
+        with theirs.leased(theirs.subscriptions[1]) as other_sub:
+            assert other_sub is None
+
+
+def test_update_processes_matches_serial(tmpdir: Any) -> None:
+    """Updating in worker processes should leave the same state as updating serially."""
+    feed_dir = tmpdir.mkdir("feeds")
+    subs = []
+    for i in range(0, 3):
+        items = "".join(f"<item><title>Episode {n}</title><guid>{i}-{n}</guid>"
+                        f"<enclosure url='http://example.com/{i}/{n}.mp3' type='audio/mpeg'/>"
+                        "</item>" for n in range(0, 5))
+        feed_file = feed_dir.join(f"feed{i}.xml")
+        feed_file.write(f"<rss version='2.0'><channel><title>Feed {i}</title>{items}"
+                        "</channel></rss>")
+
+        sub = subscription.Subscription(name=f"test{i}", url=str(feed_file),
+                                        directory=str(tmpdir.join(f"dir{i}")))
+        sub.settings["backlog_limit"] = 0
+        subs.append(sub)
+
+    states = []
+    for processes in [1, 2]:
+        (config_dir, cache_dir, data_dir) = [str(tmpdir.mkdir(f"{name}{processes}"))
+                                             for name in ["config", "cache", "data"]]
+        write_subs_to_file(subs=subs, out_file=os.path.join(config_dir, "config.yaml"),
+                           write_type="config")
+
+        conf = config.Config(config_dir=config_dir, cache_dir=cache_dir, data_dir=data_dir)
+        conf.update(processes=processes)
+
+        reloaded = config.Config(config_dir=config_dir, cache_dir=cache_dir, data_dir=data_dir)
+        reloaded.load_state()
+        states.append([subscription.Subscription.encode_subscription(sub)
+                       for sub in reloaded.subscriptions])
+
+    assert [entry["urls"] for entry in states[0][0]["feed_state"]["entries"]] == \
+        [[f"http://example.com/0/{n}.mp3"] for n in range(0, 5)]
+    assert states[0] == states[1]
+
+
+def test_import_opml(tmpdir: Any, config_dirs: Tuple[str, str, str], default_conf_file: str,
+                     ) -> None:
+    """New feeds should be checked and added to the config file and cache, others reported."""
+    feed_dir = tmpdir.mkdir("feeds")
+    for i in range(0, 2):
+        items = "".join(f"<item><title>Episode {n}</title><guid>{i}-{n}</guid>"
+                        f"<enclosure url='http://example.com/{i}/{n}.mp3' type='audio/mpeg'/>"
+                        "</item>" for n in range(0, 5))
+        feed_dir.join(f"feed{i}.xml").write(f"<rss version='2.0'><channel><title>Feed {i}"
+                                            f"</title>{items}</channel></rss>")
+
+    with open(default_conf_file, "w") as stream:
+        stream.write("# Settings.\nbacklog_limit: 2\n\nsubscriptions:\n"
+                     f"    - name: Old\n      url: {feed_dir.join('feed0.xml')}\n"
+                     "      # Comment.\n\n# Trailing comment.\n")
+
+    opml_file = tmpdir.join("feeds.opml")
+    opml_file.write(
+        "<?xml version='1.0'?><opml version='2.0'><body>"
+        f"<outline text='Copy of old' xmlUrl='{feed_dir.join('feed0.xml')}'/>"
+        "<outline text='Folder'>"
+        f"<outline text='Old' type='rss' xmlUrl='{feed_dir.join('feed1.xml')}'/>"
+        f"<outline text='Broken' type='rss' xmlUrl='{feed_dir.join('missing.xml')}'/>"
+        "</outline></body></opml>")
+
+    conf = config.Config(*config_dirs)
+    results = conf.import_opml(str(opml_file), threads=2)
+
+    assert [(result.name, result.imported) for result in results] == \
+        [("Copy of old", False), ("Old (2)", True), ("Broken", False)]
+    assert results[1].detail == "5 entries, 2 to download"
+
+    with open(default_conf_file) as stream:
+        text = stream.read()
+    assert text.startswith("# Settings.")
+    assert text.index("name: Old (2)") < text.index("# Trailing comment.")
+
+    reloaded = config.Config(*config_dirs)
+    reloaded.load_state()
+    assert reloaded.get_subs() == ["Old", "Old (2)"]
+    assert reloaded.subscriptions[1].latest() == 3
+
+
+def test_probe_errors_reported(tmpdir: Any, monkeypatch: Any) -> None:
+    """Errors checking a feed should be reported as that feed's problem, not raised."""
+    sub = subscription.Subscription(url="http://example.com/feed", name="Test",
+                                    directory=str(tmpdir))
+
+    def _broken_get_feed() -> None:
+        raise ValueError("Unexpected feed.")
+
+    monkeypatch.setattr(sub, "get_feed", _broken_get_feed)
+    assert config._probe_feed(sub) == "error checking feed: Unexpected feed."
+
+
+def test_reparse(config_dirs: Tuple[str, str, str], default_conf_file: str) -> None:
+    """Entries should be rebuilt from archived feeds, and reparsing needs archiving on."""
+    with open(default_conf_file, "w") as stream:
+        stream.write("subscriptions:\n    - name: Test\n      url: http://example.com/feed\n")
+
+    conf = config.Config(*config_dirs)
+    with pytest.raises(error.BadCommandError):
+        conf.reparse()
+
+    with open(default_conf_file, "a") as stream:
+        stream.write("archive_feeds: true\n")
+
+    try:
+        conf.reload_config()
+        archive = fetch.get_service().archive
+        assert archive is not None
+        items = "".join(f"<item><title>Episode {n}</title>"
+                        f"<enclosure url='http://example.com/{n}.mp3' type='audio/mpeg'/></item>"
+                        for n in range(0, 3))
+        archive.store(
+            "Test", f"<rss version='2.0'><channel>{items}</channel></rss>".encode("UTF-8"))
+
+        assert conf.reparse() == ["Test"]
+        assert [entry["title"] for entry in conf.subscriptions[0].feed_state.entries] == \
+            ["Episode 0", "Episode 1", "Episode 2"]
+
+        reloaded = config.Config(*config_dirs)
+        reloaded.load_state()
+        assert len(reloaded.subscriptions[0].feed_state.entries) == 3
+    finally:
+        fetch.get_service().archive = None
+
+
 # Helpers.
 def write_subs_to_file(subs: List[subscription.Subscription], out_file: str, write_type: str,
                       ) -> None:
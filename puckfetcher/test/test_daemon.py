@@ -0,0 +1,201 @@
+"""Tests for the daemon module."""
+import contextlib
+import os
+import threading
+from types import SimpleNamespace
+from typing import Any, Iterator, List, Mapping, Optional
+
+import pytest
+
+import puckfetcher.daemon as daemon
+import puckfetcher.error as error
+import puckfetcher.lock as lock
+
+
+def test_intervals_respected(tmpdir: Any) -> None:
+    """Subscriptions should be updated on their own intervals, and saved after each update."""
+    clock = FakeClock()
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("fast", 1), FakeSub("slow", None)])
+    test_daemon = daemon.Daemon(conf, clock=clock)
+    test_daemon.stop_event = FakeEvent(clock)
+
+    for sub in conf.subscriptions:
+        test_daemon.schedule(sub, 0)
+
+    # Run for two and a half minutes of fake time. "slow" uses the config's 2 minute default.
+    while clock.now < 150:
+        test_daemon.run_pending()
+
+    assert [sub.updates for sub in conf.subscriptions] == [3, 2]
+    assert len(conf.saved) == 5
+    assert conf.saved[0] == ["fast"]
+
+
+def test_removed_sub_dropped(tmpdir: Any) -> None:
+    """Subscriptions removed from the config should fall out of the schedule."""
+    clock = FakeClock()
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("gone", 1)])
+    test_daemon = daemon.Daemon(conf, clock=clock)
+    test_daemon.schedule(conf.subscriptions[0], 0)
+
+    conf.subscriptions = []
+    test_daemon.run_pending()
+
+    assert test_daemon._schedule == []
+    assert conf.saved == []
+
+
+def test_reload_schedules_added(tmpdir: Any) -> None:
+    """Subscriptions added by a config reload should be updated straight away."""
+    clock = FakeClock()
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("old", 1)])
+    test_daemon = daemon.Daemon(conf, clock=clock)
+    test_daemon.stop_event = FakeEvent(clock)
+    watcher: Any = FakeWatcher()
+    test_daemon.watcher = watcher
+
+    test_daemon.schedule(conf.subscriptions[0], 30)
+    conf.pending_subs = [FakeSub("new", 1)]
+    watcher.pending = True
+
+    test_daemon.run_pending()
+
+    assert clock.now == 0
+    assert [sub.updates for sub in conf.subscriptions] == [0, 1]
+
+
+def test_leased_elsewhere_skipped(tmpdir: Any) -> None:
+    """Subscriptions leased by another process should be tried again an interval later."""
+    clock = FakeClock()
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("busy", 1)])
+    conf.leased_elsewhere = ["busy"]
+    test_daemon = daemon.Daemon(conf, clock=clock)
+    test_daemon.schedule(conf.subscriptions[0], 0)
+
+    test_daemon.run_pending()
+
+    assert conf.subscriptions[0].updates == 0
+    assert conf.saved == []
+    assert test_daemon._schedule[0][0] == 60
+
+
+def test_stop_and_lock(tmpdir: Any) -> None:
+    """Stopping should end run() with a final save, and a second daemon should be refused."""
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("a", 1)])
+    test_daemon = daemon.Daemon(conf, watch_config=False)
+
+    conf.subscriptions[0].on_update = test_daemon.stop
+
+    runner = threading.Thread(target=test_daemon.run)
+    runner.start()
+    runner.join(5)
+
+    assert not runner.is_alive()
+    assert conf.saved == [["a"], []]
+
+    if lock.fcntl is not None:
+        test_daemon._acquire_lock()
+        with pytest.raises(error.AlreadyRunningError):
+            daemon.Daemon(conf)._acquire_lock()
+        test_daemon._release_lock()
+
+
+def test_failed_start_cleans_up(tmpdir: Any, monkeypatch: Any) -> None:
+    """A daemon failing part way through starting should still save and release its lock."""
+    def _broken_watcher(path: str) -> None:
+        raise OSError(f"Can't watch {path}.")
+
+    monkeypatch.setattr(daemon.watch, "FileWatcher", _broken_watcher)
+    conf: Any = FakeConfig(str(tmpdir), [FakeSub("a", 1)])
+
+    with pytest.raises(OSError):
+        daemon.Daemon(conf).run()
+
+    assert conf.saved == [[]]
+    assert conf.subscriptions[0].updates == 0
+    if lock.fcntl is not None:
+        restarted = daemon.Daemon(conf)
+        restarted._acquire_lock()
+        restarted._release_lock()
+
+
+# Helpers.
+class FakeClock(object):
+    """Clock that only moves when waited on."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeEvent(threading.Event):
+    """Event whose waits advance a fake clock instead of sleeping."""
+
+    def __init__(self, clock: FakeClock) -> None:
+        super(FakeEvent, self).__init__()
+        self.clock = clock
+
+    def wait(self, timeout: Optional[float]=None) -> bool:
+        self.clock.now += timeout or 0
+        return self.is_set()
+
+
+class FakeWatcher(object):
+    """Watcher reporting a change only when told to."""
+
+    def __init__(self) -> None:
+        self.pending = False
+        self.poll_interval = 5.0
+
+    def changed(self) -> bool:
+        (changed, self.pending) = (self.pending, False)
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class FakeSub(object):
+    """Just enough of a subscription for the scheduler."""
+
+    def __init__(self, name: str, interval: Any) -> None:
+        self.metadata = {"name": name}
+        self.settings = {"update_interval": interval}
+        self.updates = 0
+        self.on_update = lambda: None
+
+    def attempt_update(self, stop: Optional[threading.Event]=None) -> bool:
+        self.updates += 1
+        self.on_update()
+        return True
+
+
+class FakeConfig(object):
+    """Just enough of a config for the scheduler, recording saves."""
+
+    def __init__(self, cache_dir: str, subs: List[FakeSub]) -> None:
+        self.cache_dir = cache_dir
+        self.config_file = os.path.join(cache_dir, "config.yaml")
+        self.subscriptions = subs
+        self.pending_subs: List[FakeSub] = []
+        self.settings: Mapping[str, Any] = {"update_interval": 2}
+        self.saved: List[Any] = []
+        self.leased_elsewhere: List[str] = []
+
+    @contextlib.contextmanager
+    def leased(self, sub: FakeSub) -> Iterator[Optional[FakeSub]]:
+        yield None if sub.metadata["name"] in self.leased_elsewhere else sub
+
+    def save_cache(self, changed: Optional[List[FakeSub]]=None) -> None:
+        self.saved.append(None if changed is None else [s.metadata["name"] for s in changed])
+
+    def write_metrics(self) -> None:
+        pass
+
+    def reload_config(self) -> Any:
+        added = [sub.metadata["name"] for sub in self.pending_subs]
+        self.subscriptions = self.subscriptions + self.pending_subs
+        self.pending_subs = []
+        return SimpleNamespace(added=added, removed=[], modified=[])
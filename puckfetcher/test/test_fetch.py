@@ -0,0 +1,91 @@
+"""Tests for the fetch module."""
+import gzip
+import http.server
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+
+import pytest
+
+import puckfetcher.fetch as fetch
+
+RSS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel><title>Test</title>
+<item><title>Episode 1</title><guid>1</guid>
+<enclosure url="http://example.com/1.mp3" type="audio/mpeg" length="1"/></item>
+</channel></rss>
+"""
+
+LAST_MODIFIED = "Sat, 17 Oct 2026 10:00:00 GMT"
+
+
+def test_archive_round_trip(tmpdir: Any) -> None:
+    """Archived feeds should load back as stored, replacing older archives in other formats."""
+    archive = fetch.FeedArchive(str(tmpdir), "zlib")
+    assert archive.load("Test") is None
+
+    archive.store("Test", RSS)
+    assert archive.load("Test") == RSS
+    assert len(tmpdir.listdir()) == 1
+    assert tmpdir.listdir()[0].read_binary() != RSS
+
+    uncompressed = fetch.FeedArchive(str(tmpdir), None)
+    assert uncompressed.compression == fetch.DEFAULT_ARCHIVE_COMPRESSION
+    assert uncompressed.load("Test") == RSS
+
+
+def test_fetch_compressed(feed_server: Tuple[str, List[Dict[str, str]]], tmpdir: Any) -> None:
+    """Feeds should be asked for compressed, archived, and conditionally fetched."""
+    (url, requests) = feed_server
+    service = fetch.FetchService()
+    service.archive = fetch.FeedArchive(str(tmpdir))
+
+    parsed = fetch._fetch_feed(service, "Test", url, None, None)
+    assert "gzip" in requests[-1]["accept-encoding"]
+    assert parsed["status"] == 200
+    assert parsed["etag"] == '"abc"'
+    assert parsed["modified_parsed"][0:6] == (2026, 10, 17, 10, 0, 0)
+    assert [entry["title"] for entry in parsed["entries"]] == ["Episode 1"]
+    assert service.archive.load("Test") == RSS
+
+    parsed = fetch._fetch_feed(service, "Test", url, parsed["etag"], parsed["modified_parsed"])
+    assert requests[-1]["if-none-match"] == '"abc"'
+    assert requests[-1]["if-modified-since"] == LAST_MODIFIED
+    assert parsed["status"] == 304
+    assert parsed["entries"] == []
+    assert service.archive.load("Test") == RSS
+
+
+@pytest.fixture()
+def feed_server() -> Iterator[Tuple[str, List[Dict[str, str]]]]:
+    """Serve RSS gzipped on a local port. Provides its URL and the headers of each request."""
+    requests: List[Dict[str, str]] = []
+
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            requests.append({key.lower(): value for (key, value) in self.headers.items()})
+            if self.headers.get("If-None-Match") == '"abc"':
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            body = gzip.compress(RSS)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", '"abc"')
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield (f"http://127.0.0.1:{server.server_address[1]}/feed", requests)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,51 @@
+"""Tests for the lock module."""
+import json
+import os
+from typing import Any
+
+import pytest
+
+import puckfetcher.error as error
+import puckfetcher.lock as lock
+
+
+@pytest.mark.skipif(lock.fcntl is None, reason="needs fcntl")
+def test_file_lock_exclusive(tmpdir: Any) -> None:
+    """A held lock should keep others out until it is released."""
+    path = str(tmpdir.join("test.lock"))
+    first = lock.FileLock(path)
+    first.acquire()
+
+    with pytest.raises(error.AlreadyRunningError):
+        lock.FileLock(path).acquire(timeout=0.2)
+
+    first.release()
+    with lock.FileLock(path) as second:
+        assert second.held
+
+
+def test_leases(tmpdir: Any) -> None:
+    """Leases should be exclusive until released, and expired ones should be taken over."""
+    directory = str(tmpdir.join("leases"))
+    ours = lock.LeaseManager(directory, ttl=60, owner="ours")
+    theirs = lock.LeaseManager(directory, ttl=60, owner="theirs")
+
+    assert ours.acquire("Podcast")
+    assert not theirs.acquire("Podcast")
+    assert theirs.holder("Podcast") == "ours"
+
+    ours.release("Podcast")
+    assert theirs.acquire("Podcast")
+    theirs.release_all()
+    assert os.listdir(directory) == [lock.LEASE_LOCK_FILENAME]
+
+    # Expired lease from a process on another host.
+    with open(ours._lease_path("Other"), "w", encoding="UTF-8") as stream:
+        json.dump({"name": "Other", "owner": "gone", "host": "elsewhere", "pid": 1,
+                   "expires": 0}, stream)
+
+    assert ours.holder("Other") is None
+    assert ours.acquire("Other")
+    ours.renew()
+    assert ours.holder("Other") == "ours"
+    ours.release_all()
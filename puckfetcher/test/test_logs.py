@@ -0,0 +1,74 @@
+"""Tests for the logs module."""
+import json
+import logging
+import multiprocessing
+from typing import Any, List
+
+import puckfetcher.logs as logs
+
+
+def test_async_json_file(tmpdir: Any) -> None:
+    """Queued records should reach the file as JSON, with handlers restored after stopping."""
+    log_file = str(tmpdir.join("test.log"))
+    logger = logging.getLogger("puckfetcher-test-logs")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    file_handler = logging.FileHandler(log_file, encoding="UTF-8")
+    logger.addHandler(file_handler)
+
+    listener = logs.start_async(logger, json_file=True)
+    assert listener is not None
+    assert [type(handler) for handler in logger.handlers] == [logging.handlers.QueueHandler]
+
+    logger.info("Downloaded %s of %s.", 3, 5, extra={"subscription": "Test"})
+    logs.stop_async(logger, listener)
+    assert logger.handlers == [file_handler]
+
+    file_handler.close()
+    logger.removeHandler(file_handler)
+
+    with open(log_file, encoding="UTF-8") as stream:
+        events = [json.loads(line) for line in stream]
+
+    assert len(events) == 1
+    assert events[0]["message"] == "Downloaded 3 of 5."
+    assert events[0]["level"] == "INFO"
+    assert events[0]["subscription"] == "Test"
+
+
+def test_worker_process_logging() -> None:
+    """Records logged in a worker process should reach the parent's logger."""
+    records: List[logging.LogRecord] = []
+    logger = logging.getLogger("root")
+    handler = _ListHandler(records)
+    old_level = logger.level
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    context = multiprocessing.get_context("spawn")
+    (record_queue, listener) = logs.start_process_logging(logger, context)
+    try:
+        with context.Pool(1, logs.init_worker_logging, (record_queue, logging.INFO)) as pool:
+            pool.apply(_log_in_worker)
+            pool.close()
+            pool.join()
+    finally:
+        listener.stop()
+        logger.removeHandler(handler)
+        logger.setLevel(old_level)
+
+    assert [record.getMessage() for record in records] == ["Hello from 3."]
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self, records: List[logging.LogRecord]) -> None:
+        super(_ListHandler, self).__init__()
+        self.records = records
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
+
+def _log_in_worker() -> None:
+    logging.getLogger("root").debug("Not shown.")
+    logging.getLogger("root").info("Hello from %s.", 3)
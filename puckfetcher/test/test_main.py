@@ -1,4 +1,6 @@
 """Tests for the __main__ module."""
+import subprocess
+import sys
 from unittest.mock import MagicMock
 
 import puckfetcher.__main__ as main
@@ -15,10 +17,16 @@ def test_simple_commands() -> None:
     main._handle_command("update", conf)
     main._handle_command("list", conf)
     main._handle_command("reload_config", conf)
+    main._handle_command("migrate_cache", conf)
+    main._handle_command("daemon", conf)
+    main._handle_command("history", conf)
 
     conf.update.assert_called_once_with()
     conf.list.assert_called_once_with()
     conf.reload_config.assert_called_once_with()
+    conf.migrate_cache.assert_called_once_with()
+    conf.daemon.assert_called_once_with()
+    conf.history.assert_called_once_with()
 
 # TODO split these out
 def test_list_commands() -> None:
@@ -60,3 +68,13 @@ def test_list_commands() -> None:
     # TODO set up tests for summarize.
 
     # TODO restore fake command test
+
+def test_lazy_imports() -> None:
+    """Starting up shouldn't import modules only needed to fetch, download, tag or prompt."""
+    code = ("import sys, puckfetcher.__main__; "
+            "print(' '.join(m for m in ('feedparser', 'eyed3', 'magic', 'clint') "
+            "if m in sys.modules))")
+
+    output = subprocess.check_output([sys.executable, "-c", code], universal_newlines=True)
+
+    assert output.strip() == ""
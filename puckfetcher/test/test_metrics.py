@@ -0,0 +1,78 @@
+"""Tests for the metrics module."""
+import urllib.request
+from typing import Any
+
+import pytest
+
+import puckfetcher.metrics as metrics
+
+
+def test_counter_render() -> None:
+    """Counters should add up per label set and render with escaped labels."""
+    registry = metrics.Registry()
+    counter = registry.counter("test_total", "A test counter.", ["sub"])
+
+    counter.inc(sub="a")
+    counter.inc(2, sub="a")
+    counter.inc(sub='quote"d')
+
+    assert counter.value(sub="a") == 3
+    assert registry.render() == (
+        "# HELP test_total A test counter.\n"
+        "# TYPE test_total counter\n"
+        'test_total{sub="a"} 3.0\n'
+        'test_total{sub="quote\\"d"} 1.0\n'
+    )
+
+    with pytest.raises(ValueError):
+        counter.inc(other="a")
+
+
+def test_histogram_render() -> None:
+    """Histogram buckets should be cumulative, with a sum and count."""
+    registry = metrics.Registry()
+    histogram = registry.histogram("test_seconds", "A test histogram.", ["sub"], [1, 5])
+
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value, sub="a")
+
+    with histogram.time(sub="b"):
+        pass
+
+    assert histogram.count(sub="a") == 4
+    assert histogram.count(sub="b") == 1
+    lines = registry.render().splitlines()
+    assert lines[2:7] == [
+        'test_seconds_bucket{sub="a",le="1.0"} 2',
+        'test_seconds_bucket{sub="a",le="5.0"} 3',
+        'test_seconds_bucket{sub="a",le="+Inf"} 4',
+        'test_seconds_sum{sub="a"} 14.5',
+        'test_seconds_count{sub="a"} 4',
+    ]
+
+
+def test_textfile_and_http(tmpdir: Any) -> None:
+    """Metrics should be written to a textfile and served over HTTP identically."""
+    registry = metrics.Registry()
+    registry.counter("test_total", "A test counter.", []).inc()
+
+    path = str(tmpdir.join("puckfetcher.prom"))
+    registry.write_textfile(path)
+    with open(path, encoding="UTF-8") as stream:
+        assert stream.read() == registry.render()
+
+    server = registry.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode("UTF-8") == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_host_of() -> None:
+    """Hosts should be pulled out of URLs, and be empty for things that aren't URLs."""
+    assert metrics.host_of("https://Example.com:8080/rss?x=1") == "example.com"
+    assert metrics.host_of("valid") == ""
+    assert metrics.host_of(None) == ""
@@ -0,0 +1,40 @@
+"""Tests for the opml module."""
+from typing import Any
+
+import pytest
+
+import puckfetcher.error as error
+import puckfetcher.opml as opml
+
+
+def test_iter_feeds(tmpdir: Any) -> None:
+    """Feeds should come out in order, from inside folders too, skipping non-feed outlines."""
+    opml_file = tmpdir.join("feeds.opml")
+    opml_file.write(
+        "<?xml version='1.0'?><opml version='2.0' xmlns='http://example.com/opml'>"
+        "<head><title>Feeds</title></head><body>"
+        "<outline text='Folder'>"
+        "<outline text='One' type='rss' xmlUrl='http://example.com/1.xml'/>"
+        "<outline text='Two &amp; Three' title='Two' xmlUrl=' http://example.com/2.xml '/>"
+        "</outline>"
+        "<outline text='Web page' type='link' url='http://example.com/'/>"
+        "<outline xmlUrl='http://example.com/4.xml'/>"
+        "</body></opml>")
+
+    assert list(opml.iter_feeds(str(opml_file))) == [
+        opml.Outline("One", "http://example.com/1.xml"),
+        opml.Outline("Two", "http://example.com/2.xml"),
+        opml.Outline("http://example.com/4.xml", "http://example.com/4.xml"),
+    ]
+
+
+def test_malformed_opml(tmpdir: Any) -> None:
+    """Broken or missing files should raise a config error."""
+    opml_file = tmpdir.join("feeds.opml")
+    opml_file.write("<opml><body><outline text='One'")
+
+    with pytest.raises(error.MalformedConfigError):
+        list(opml.iter_feeds(str(opml_file)))
+
+    with pytest.raises(error.MalformedConfigError):
+        list(opml.iter_feeds(str(tmpdir.join("missing.opml"))))
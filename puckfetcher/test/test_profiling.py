@@ -0,0 +1,52 @@
+"""Tests for the profiling module."""
+import os
+import pstats
+from typing import Any, List
+
+import puckfetcher.profiling as profiling
+
+
+def test_run_profiled(tmpdir: Any) -> None:
+    """Profiling should return the function's result and write loadable stats."""
+    stats_file = str(tmpdir.join("test.prof"))
+
+    assert profiling.run_profiled(lambda: sum(range(1000)), stats_file, top=5) == 499500
+
+    assert os.path.getsize(stats_file) > 0
+    pstats.Stats(stats_file)
+
+
+def test_memory_phases() -> None:
+    """Nested phases should each be reported, with the outer peak covering the inner one."""
+    held: List[Any] = []
+
+    @profiling.traced_phase("inner")
+    def _inner() -> None:
+        held.append(bytearray(4 * 1024 * 1024))
+
+    @profiling.traced_phase("outer")
+    def _outer() -> None:
+        big = bytearray(2 * 1024 * 1024)
+        _inner()
+        _inner()
+        del big
+
+    # Not tracing - phases are just function calls.
+    _outer()
+    assert profiling._TRACER is None
+
+    tracer = profiling.MemoryTracer(top=3)
+    profiling._TRACER = tracer
+    tracer.start()
+    try:
+        _outer()
+    finally:
+        profiling._TRACER = None
+        tracer.stop()
+
+    assert tracer.phases["inner"].calls == 2
+    assert tracer.phases["outer"].calls == 1
+    assert tracer.phases["outer"].peak >= 10 * 1024 * 1024
+    assert tracer.phases["inner"].peak >= 4 * 1024 * 1024
+    assert tracer.phases["inner"].top[0].size_diff >= 4 * 1024 * 1024
+    assert "Phase 'outer': 1 calls" in tracer.report()
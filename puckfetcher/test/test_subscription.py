@@ -6,8 +6,10 @@ from typing import Any, Callable, Dict, Mapping
 import eyed3
 from eyed3.id3 import Tag
 import pytest
+import umsgpack
 
 import puckfetcher.error as error
+import puckfetcher.fetch as fetch
 import puckfetcher.subscription as subscription
 
 RSS_ADDRESS = "valid"
@@ -197,6 +199,90 @@ def test_unmark(sub_with_entries: subscription.Subscription) -> None:
     for bad_num in bad_nums:
         assert bad_num not in sub_with_entries.feed_state.entries_state_dict
 
+def test_details_ranges(sub_with_entries: subscription.Subscription) -> None:
+    """Details should collapse entries and queue into runs, one page at a time."""
+    sub_with_entries.mark(list(range(1, 11)) + [13])
+    sub_with_entries.enqueue([15, 16, 17, 19])
+
+    data = sub_with_entries.details_data()
+    assert data["queue"] == [(15, 17), (19, 19)]
+    assert data["entries"]["total"] == 20
+    assert [(r["first"], r["last"], r["downloaded"]) for r in data["entries"]["ranges"]] == \
+        [(1, 10, True), (11, 12, False), (13, 13, True), (14, 20, False)]
+
+    page = sub_with_entries.details_data(start=12, limit=3)["entries"]
+    assert (page["first"], page["last"]) == (12, 14)
+    assert [(r["first"], r["last"], r["downloaded"]) for r in page["ranges"]] == \
+        [(12, 12, False), (13, 13, True), (14, 14, False)]
+
+def test_compact_entries(sub_with_entries: subscription.Subscription) -> None:
+    """Old entries that are done with should shrink to tombstones, keeping their numbers."""
+    feed_state = sub_with_entries.feed_state
+    feed_state.latest_entry_number = 15
+    feed_state.etag = "etag"
+    sub_with_entries.mark([3, 4])
+    sub_with_entries.unmark([5])
+    sub_with_entries.enqueue([7])
+    full_size = len(umsgpack.packb(feed_state.as_dict()))
+
+    assert sub_with_entries.compact_entries() == 0
+
+    sub_with_entries.settings["keep_entries"] = 5
+    assert sub_with_entries.compact_entries() == 13
+    assert sub_with_entries.compact_entries() == 0
+    assert len(umsgpack.packb(feed_state.as_dict())) < full_size
+
+    # Entry number n is at position 20 - n.
+    assert len(feed_state.entries) == 20
+    assert feed_state.entries[17] == {"id": "id-3", "downloaded": True}
+    assert feed_state.entries[19] == {"id": "id-1", "downloaded": False}
+    assert not subscription.is_tombstone(feed_state.entries[15])
+    assert not subscription.is_tombstone(feed_state.entries[13])
+    assert all(not subscription.is_tombstone(entry) for entry in feed_state.entries[0:5])
+
+    # Queued tombstones wait for the next update to fetch the whole feed again.
+    feed_state.queue.clear()
+    sub_with_entries.enqueue([2])
+    sub_with_entries.download_queue()
+    assert list(feed_state.queue) == [2]
+
+    etags = []
+    parser = generate_feedparser()
+
+    def _recording_parser(url: str, etag: Any, last_modified: Any) -> Dict[str, Any]:
+        etags.append(etag)
+        return parser(url, etag, last_modified)
+
+    sub_with_entries.parser = _recording_parser
+    sub_with_entries.attempt_update()
+    assert etags == [""]
+
+
+def test_interrupted_download_requeued(sub_with_entries: subscription.Subscription) -> None:
+    """An entry whose download is interrupted should go back on the front of the queue."""
+    def _interrupted(url: str, dest: str) -> None:
+        raise KeyboardInterrupt()
+
+    sub_with_entries.downloader = _interrupted
+    sub_with_entries.enqueue([3, 4])
+    sub_with_entries.download_queue()
+
+    assert list(sub_with_entries.feed_state.queue) == [3, 4]
+    assert sub_with_entries.completed_downloads == []
+
+
+def test_entries_without_enclosures(sub: subscription.Subscription) -> None:
+    """Items with no enclosure should still be numbered, with nothing to download."""
+    sub.feed_state.load_rss_info({"entries": [
+        {"title": "Episode 2", "id": "2", "enclosures": [{"href": "http://example.com/2.mp3"}]},
+        {"title": "Announcement", "id": "post"},
+        {"title": "Episode 1", "id": "1", "enclosures": [{"href": "http://example.com/1.mp3"}]},
+    ]})
+
+    assert [entry["urls"] for entry in sub.feed_state.entries] == \
+        [["http://example.com/2.mp3"], [], ["http://example.com/1.mp3"]]
+
+
 def test_url_with_qparams() -> None:
     """Test that the _get_dest helper handles query parameters properly."""
     test_sub = subscription.Subscription(url="test", name="test", directory="test")
@@ -288,6 +374,43 @@ def _test_url_helper(strdir: str, given: str, name: str, expected_current: str,
     assert test_sub.url == expected_current
     assert test_sub.original_url == expected_original
 
+def test_loading_creates_no_network_objects(strdir: str,
+                                            monkeypatch: Any) -> None:
+    """Constructing and decoding subscriptions shouldn't create downloaders or parsers."""
+    service = fetch.FetchService()
+    monkeypatch.setattr(fetch, "_SERVICE", service)
+
+    for i in range(1000):
+        test_sub = subscription.Subscription(url=f"test{i}", name=f"test{i}", directory=strdir)
+        decoded = subscription.Subscription.decode_subscription(
+            subscription.Subscription.encode_subscription(test_sub))
+        decoded.default_missing_fields({"directory": strdir, "backlog_limit": 1,
+                                        "use_title_as_filename": False, "set_tags": False,
+                                        "overwrite_title": False})
+
+    assert service.created() == 0
+
+    # First use creates them, once per name.
+    assert decoded.parser is decoded.parser
+    assert service.created() == 1
+
+def test_equality_and_hash(strdir: str) -> None:
+    """Subscriptions should compare field by field, and hash on name and original URL."""
+    test_sub = subscription.Subscription(url="test", name="test", directory=strdir)
+    same_sub = subscription.Subscription.decode_subscription(
+        subscription.Subscription.encode_subscription(test_sub))
+
+    assert test_sub == same_sub
+    assert len({test_sub, same_sub}) == 1
+
+    same_sub.feed_state.entries_state_dict[0] = True
+    assert test_sub != same_sub
+    assert hash(test_sub) == hash(same_sub)
+
+    renamed_sub = subscription.Subscription(url="test", name="other", directory=strdir)
+    assert test_sub != renamed_sub
+    assert len({test_sub, renamed_sub}) == 2
+
 def _check_tag_absence(
     filename_num: int,
     directory: str,
@@ -418,7 +541,9 @@ def sub(strdir: str) -> subscription.Subscription:
 @pytest.fixture(scope="function")
 def sub_with_entries(sub: subscription.Subscription) -> subscription.Subscription:
     """Create a test subscription with faked entries."""
-    sub.feed_state.entries = list(range(0, 20))
+    # Newest first, like a parsed feed.
+    sub.feed_state.entries = [{"title": f"Entry {i}", "id": f"id-{i}", "urls": [f"hi{i}.mp3"],
+                               "metadata": {}} for i in range(20, 0, -1)]
 
     sub.downloader = generate_fake_downloader()
 
@@ -0,0 +1,55 @@
+"""Tests for the trace module."""
+import json
+import threading
+from typing import Any
+
+import puckfetcher.trace as trace
+
+
+def test_spans_across_threads(tmpdir: Any) -> None:
+    """Spans should become matching begin/end events, with each thread named."""
+    trace.start()
+    try:
+        with trace.span("update", "subscription", subscription="Test"):
+            worker = threading.Thread(target=_download, name="worker")
+            worker.start()
+            worker.join()
+    finally:
+        recorder = trace.stop()
+
+    assert recorder is not None
+    trace_file = str(tmpdir.join("trace.json"))
+    recorder.write(trace_file)
+    with open(trace_file, encoding="UTF-8") as stream:
+        events = json.load(stream)["traceEvents"]
+
+    spans = [(event["ph"], event["name"]) for event in events if event["ph"] != "M"]
+    assert spans == [("B", "update"), ("B", "download"), ("E", "download"), ("E", "update")]
+    assert events[-4]["args"] == {"subscription": "Test"}
+
+    thread_names = {event["args"]["name"] for event in events if event["ph"] == "M"}
+    assert "worker" in thread_names
+    assert len({event["tid"] for event in events if event["ph"] == "B"}) == 2
+
+
+def test_ring_buffer() -> None:
+    """Only the most recent events should be kept, and nothing recorded once stopped."""
+    trace.start(capacity=4)
+    for i in range(10):
+        with trace.span(f"span {i}", "test"):
+            pass
+    recorder = trace.stop()
+
+    with trace.span("after", "test"):
+        pass
+
+    assert recorder is not None
+    chrome_trace = recorder.as_chrome_trace()
+    names = [event["name"] for event in chrome_trace["traceEvents"] if event["ph"] != "M"]
+    assert names == ["span 8", "span 8", "span 9", "span 9"]
+    assert chrome_trace["otherData"] == {"recorded": 20, "dropped": 16}
+
+
+def _download() -> None:
+    with trace.span("download", "download"):
+        pass
@@ -0,0 +1,50 @@
+"""Tests for the watch module."""
+import os
+import time
+from typing import Any
+
+import pytest
+
+import puckfetcher.watch as watch
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_changes_noticed(tmpdir: Any, use_inotify: bool) -> None:
+    """Writing, replacing and removing the file should be noticed, other files ignored."""
+    path = str(tmpdir.join("config.yaml"))
+    with open(path, "w") as stream:
+        stream.write("a: 1\n")
+
+    watcher = watch.FileWatcher(path, poll_interval=0, use_inotify=use_inotify)
+    try:
+        assert not watcher.changed()
+
+        with open(str(tmpdir.join("other.yaml")), "w") as stream:
+            stream.write("b: 2\n")
+        assert not watcher.changed()
+
+        with open(path, "w") as stream:
+            stream.write("a: 22\n")
+        assert _eventually(watcher)
+        assert not watcher.changed()
+
+        with open(f"{path}.tmp", "w") as stream:
+            stream.write("a: 333\n")
+        os.replace(f"{path}.tmp", path)
+        assert _eventually(watcher)
+
+        os.remove(path)
+        assert _eventually(watcher)
+
+    finally:
+        watcher.close()
+
+
+def _eventually(watcher: watch.FileWatcher) -> bool:
+    # inotify events can take a moment to arrive.
+    for _ in range(50):
+        if watcher.changed():
+            return True
+        time.sleep(0.01)
+
+    return False
@@ -0,0 +1,172 @@
+"""
+Module for recording a timeline of what puckfetcher did, for the --trace flag.
+Spans (fetching a feed, downloading an enclosure, saving the cache...) are recorded as begin and
+end events in the Chrome trace event format, which Perfetto and chrome://tracing can open.
+Events are kept in a ring buffer, so only the most recent ones are kept on long runs.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+LOG = logging.getLogger("root")
+
+# Events kept by default. Each is a small tuple, so this is a few tens of megabytes at most.
+DEFAULT_CAPACITY = 100000
+
+# (phase, name, category, timestamp in microseconds, thread id, args).
+Event = Tuple[str, str, str, float, int, Optional[Dict[str, Any]]]
+
+
+class TraceRecorder(object):
+    """Ring buffer of trace events, safe to record into from any thread."""
+
+    def __init__(self, capacity: int=DEFAULT_CAPACITY) -> None:
+        """
+        Object constructor for trace recorder.
+
+        :param capacity: Most events to keep. Older events are dropped to make room.
+        """
+        self.capacity = capacity
+        self.events: Deque[Event] = collections.deque(maxlen=capacity)
+        self.recorded = 0
+        self.thread_names: Dict[int, str] = {}
+        self.pid = os.getpid()
+
+    def record(self, phase: str, name: str, category: str,
+               args: Optional[Dict[str, Any]]=None) -> None:
+        """
+        Record an event now, on the current thread.
+
+        :param phase: Chrome trace event phase - "B" to begin a span, "E" to end it.
+        :param name: Name of span.
+        :param category: Category of span, for filtering in the viewer.
+        :param args: Extra details shown with the event.
+        """
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+
+        # deque.append is atomic, so no lock is needed.
+        self.events.append((phase, name, category, time.perf_counter() * 1e6, tid, args))
+        # Not locked either, so this can undercount a little when threads race.
+        self.recorded += 1
+
+    def as_chrome_trace(self) -> Dict[str, Any]:
+        """
+        Provide recorded events in the Chrome trace event format.
+
+        :returns: Trace, ready to dump as JSON.
+        """
+        events: List[Dict[str, Any]] = []
+        for (tid, thread_name) in list(self.thread_names.items()):
+            events.append({"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid,
+                           "args": {"name": thread_name}})
+
+        for (phase, name, category, timestamp, tid, args) in list(self.events):
+            event = {"ph": phase, "name": name, "cat": category, "ts": timestamp,
+                     "pid": self.pid, "tid": tid}
+            if args:
+                event["args"] = args
+            events.append(event)
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"recorded": self.recorded,
+                          "dropped": max(0, self.recorded - len(self.events))},
+        }
+
+    def write(self, path: str) -> None:
+        """
+        Write recorded events to a file.
+
+        :param path: File to write. Open it in Perfetto or chrome://tracing.
+        """
+        trace = self.as_chrome_trace()
+        with open(path, "w", encoding="UTF-8") as stream:
+            json.dump(trace, stream, default=str)
+
+        LOG.info("Wrote %s trace events to '%s' (%s dropped).",
+                 len(self.events), path, trace["otherData"]["dropped"])
+
+
+class _Span(object):
+    """Records begin and end events around the body of a with statement."""
+
+    __slots__ = ("recorder", "name", "category", "args")
+
+    def __init__(self, recorder: TraceRecorder, name: str, category: str,
+                 args: Dict[str, Any]) -> None:
+        self.recorder = recorder
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self) -> None:
+        self.recorder.record("B", self.name, self.category, self.args)
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.recorder.record("E", self.name, self.category)
+
+
+class _NoSpan(object):
+    """Stand-in for a span when nothing is being recorded."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+# Recorder in use, if --trace was given.
+_RECORDER: Optional[TraceRecorder] = None
+
+
+def span(name: str, category: str, **args: Any) -> Any:
+    """
+    Trace the body of a with statement as a span.
+    Does nothing beyond one check unless a recorder is running.
+
+    :param name: Name of span.
+    :param category: Category of span.
+    :param args: Extra details shown with the span.
+    :returns: Context manager.
+    """
+    recorder = _RECORDER
+    if recorder is None:
+        return _NO_SPAN
+
+    return _Span(recorder, name, category, args)
+
+
+def start(capacity: int=DEFAULT_CAPACITY) -> TraceRecorder:
+    """
+    Start recording spans.
+
+    :param capacity: Most events to keep.
+    :returns: Recorder now in use.
+    """
+    global _RECORDER
+    _RECORDER = TraceRecorder(capacity)
+    return _RECORDER
+
+
+def stop() -> Optional[TraceRecorder]:
+    """
+    Stop recording spans.
+
+    :returns: Recorder that was in use, if any.
+    """
+    global _RECORDER
+    recorder = _RECORDER
+    _RECORDER = None
+    return recorder
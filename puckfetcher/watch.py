@@ -0,0 +1,107 @@
+"""
+Module for noticing when a file (the config file, in practice) changes.
+inotify is used when the optional inotify_simple package is installed, otherwise the file's
+modification time is polled.
+"""
+import logging
+import os
+import time
+from typing import Any, Optional, Tuple
+
+LOG = logging.getLogger("root")
+
+# How often to stat the file when inotify isn't available, in seconds.
+POLL_INTERVAL = 5.0
+
+
+class FileWatcher(object):
+    """Watcher for changes to one file, including it being replaced by a rename."""
+
+    def __init__(self, path: str, *, poll_interval: float=POLL_INTERVAL,
+                 use_inotify: bool=True) -> None:
+        """
+        Object constructor for file watcher.
+
+        :param path: File to watch. Doesn't have to exist yet.
+        :param poll_interval: Seconds between checks when polling.
+        :param use_inotify: Whether to use inotify if it's available.
+        """
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+
+        self._inotify: Any = None
+        if use_inotify:
+            self._inotify = _open_inotify(os.path.dirname(self.path))
+
+        self._last_stat = _stat(self.path)
+        self._last_poll = time.monotonic()
+
+    @property
+    def uses_inotify(self) -> bool:
+        """
+        Whether changes come from inotify rather than polling.
+
+        :returns: True if inotify is in use.
+        """
+        return self._inotify is not None
+
+    def changed(self) -> bool:
+        """
+        Check, without blocking, whether the file changed since the last check.
+        When polling, the file is only looked at once per poll interval.
+
+        :returns: True if the file was written, replaced, created or removed.
+        """
+        if self._inotify is not None:
+            name = os.path.basename(self.path)
+            return any(event.name == name for event in self._inotify.read(timeout=0))
+
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return False
+
+        self._last_poll = now
+        current = _stat(self.path)
+        if current == self._last_stat:
+            return False
+
+        self._last_stat = current
+        return True
+
+    def close(self) -> None:
+        """Stop watching."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def _open_inotify(directory: str) -> Any:
+    try:
+        import inotify_simple
+    except ImportError:
+        LOG.debug("inotify_simple isn't installed, polling for changes instead.")
+        return None
+
+    flags = inotify_simple.flags
+    inotify = None
+    try:
+        inotify = inotify_simple.INotify()
+        # Watch the directory rather than the file, since editors often replace files by renaming.
+        inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE |
+                          flags.DELETE | flags.MOVED_FROM)
+    except OSError as exception:
+        LOG.debug("Unable to set up inotify (%s), polling for changes instead.", exception)
+        if inotify is not None:
+            inotify.close()
+        return None
+
+    return inotify
+
+
+def _stat(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        result = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (result.st_mtime_ns, result.st_size, result.st_ino)
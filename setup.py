@@ -24,6 +24,22 @@ INSTALL_REQUIRES = [
     "drewtilities>=1.3.2, <2.0.0",
 ]
 
+EXTRAS_REQUIRE = {
+    # C-accelerated cache encoding and zstd cache compression.
+    "fast": [
+        "msgpack>=1.0.0, <2.0.0",
+        "zstandard>=0.15.0, <1.0.0",
+    ],
+    # Brotli-compressed feed responses, from servers that offer them.
+    "brotli": [
+        "brotli>=1.0.9, <2.0.0",
+    ],
+    # inotify-based config file watching for the daemon, instead of polling.
+    "watch": [
+        "inotify_simple>=1.3.0, <2.0.0",
+    ],
+}
+
 TEST_REQUIRES = [
     "coveralls>=3.0.0, <4.0.0",
     "pytest>=6.2.1, <7.0.0",
@@ -71,6 +87,7 @@ setup(author="Andrew Michaud",
       packages=find_packages(),
       long_description=LONG_DESCRIPTION,
       install_requires=INSTALL_REQUIRES,
+      extras_require=EXTRAS_REQUIRE,
       tests_require=TEST_REQUIRES,
       version=VERSION,
       )